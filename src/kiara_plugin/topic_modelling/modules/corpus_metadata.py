@@ -283,4 +283,428 @@ class CorpusDistTime(KiaraModule):
             raise
 
         outputs.set_value("dist_table", queried_table)
-        outputs.set_value("dist_list", list_of_dicts)
\ No newline at end of file
+        outputs.set_value("dist_list", list_of_dicts)
+
+class TopicDistTime(KiaraModule):
+    """
+    This module aggregates the topic weights of the documents of a corpus by day, month or year and by publication.
+    It joins the document topics table created by 'topic_modelling.lda' or 'topic_modelling.nmf' with the corpus table the tokens were created from (documents are matched by position),
+    and returns, for each period, publication and topic, the number of documents, the summed and the mean topic weight.
+    The aggregation is done in a single DuckDB query, so the output can be used directly for visualization.
+    """
+
+    _module_type_name = "topic_modelling.topic_distribution"
+
+    def create_inputs_schema(self):
+
+        return {
+            "periodicity": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["day", "month", "year"]},
+                "doc": "The desired data periodicity to aggregate the data. Values can be either 'day','month' or 'year'.",
+                "optional": False,
+            },
+            "date_col": {
+                "type": "string",
+                "doc": "Column name of the column that contains the date. Values in this column need to comply with the date format '%Y-%m-%d'.",
+                "optional": False,
+            },
+            "publication_ref_col": {
+                "type": "string",
+                "doc": "Column name of the values containing publication names or ref/id. This column will be used in the output.",
+                "optional": False,
+            },
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table the tokens were created from.",
+                "optional": False,
+            },
+            "document_topics": {
+                "type": "table",
+                "doc": "The document topics table, with a 'doc_id' column and one 'topic_<n>' column per topic.",
+                "optional": False,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {"dist_table": {"type": "table", "doc": "The aggregated topic weights, in long format (date, publication_name, topic_id, doc_count, weight_sum, weight_mean)."}}
+
+    def process(self, inputs, outputs) -> None:
+
+        import duckdb # type: ignore
+        import numpy as np
+        import pyarrow as pa   # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import get_topic_columns
+
+        agg = inputs.get_value_obj("periodicity").data
+        title_col = inputs.get_value_obj("publication_ref_col").data
+        time_col = inputs.get_value_obj("date_col").data
+
+        sources: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        doc_topics: pa.Table = inputs.get_value_data("document_topics").arrow_table
+
+        sources_col_names = sources.column_names
+
+        if title_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find title name/id column '{title_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+
+        if time_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find date column '{time_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+
+        topic_cols = get_topic_columns(doc_topics)
+        if "doc_id" not in doc_topics.column_names or not topic_cols:
+            raise KiaraProcessingException(
+                "The document topics table needs a 'doc_id' column and at least one 'topic_<n>' column."
+            )
+
+        if doc_topics.num_rows != sources.num_rows:
+            raise KiaraProcessingException(
+                f"The document topics table has {doc_topics.num_rows} rows, but the corpus table has {sources.num_rows}. Both need to be created from the same corpus."
+            )
+
+        # only the columns needed for the aggregation are handed over to DuckDB
+        sources = pa.table({
+            "doc_id": pa.array(np.arange(sources.num_rows, dtype=np.int64)),
+            "date": sources.column(time_col),
+            "publication": sources.column(title_col),
+        })
+        doc_topics = doc_topics.select(["doc_id", *topic_cols])
+
+        query = f"""
+        SELECT date_trunc('{agg}', CAST(strptime(s.date, '%Y-%m-%d') AS DATE)) as date,
+            s.publication as publication_name,
+            CAST(regexp_extract(t.topic, '(\\d+)$') AS INTEGER) as topic_id,
+            COUNT(*) as doc_count,
+            SUM(t.weight) as weight_sum,
+            AVG(t.weight) as weight_mean
+        FROM sources s
+        JOIN (
+            UNPIVOT doc_topics ON COLUMNS('^topic_\\d+$') INTO NAME topic VALUE weight
+        ) t ON s.doc_id = t.doc_id
+        GROUP BY ALL
+        ORDER BY date, publication_name, topic_id
+        """
+
+        con = duckdb.connect(':memory:')
+        con.register('sources', sources)
+        con.register('doc_topics', doc_topics)
+
+        try:
+            queried_table = con.execute(query).fetch_arrow_table()
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Could not aggregate the topic weights, please check that the date column complies with the format '%Y-%m-%d': {e}"
+            )
+
+        outputs.set_value("dist_table", queried_table)
+
+
+class TermDistTime(KiaraModule):
+    """
+    This module counts the occurrences of terms by day, month or year and by publication, from a tokens array and the corpus table it was created from (documents are matched by position).
+    The terms are either a given list of terms, or the most frequent terms of the corpus.
+    It returns, for each period, publication and term, the number of occurrences, and the relative frequency of the term among all tokens of that period and publication.
+
+    The tokens are encoded and filtered to the selected terms in Arrow and NumPy, the aggregation is done in a single DuckDB query.
+    """
+
+    _module_type_name = "topic_modelling.term_distribution"
+
+    def create_inputs_schema(self):
+
+        return {
+            "periodicity": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["day", "month", "year"]},
+                "doc": "The desired data periodicity to aggregate the data. Values can be either 'day','month' or 'year'.",
+                "optional": False,
+            },
+            "date_col": {
+                "type": "string",
+                "doc": "Column name of the column that contains the date. Values in this column need to comply with the date format '%Y-%m-%d'.",
+                "optional": False,
+            },
+            "publication_ref_col": {
+                "type": "string",
+                "doc": "Column name of the values containing publication names or ref/id. This column will be used in the output.",
+                "optional": False,
+            },
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table the tokens were created from.",
+                "optional": False,
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens of each document of the corpus table.",
+                "optional": False,
+            },
+            "terms": {
+                "type": "list",
+                "doc": "The terms to count. If not provided, the 'top_n' most frequent terms of the corpus are counted.",
+                "optional": True,
+            },
+            "top_n": {
+                "type": "integer",
+                "doc": "Number of most frequent terms to count, if no terms are provided.",
+                "optional": True,
+                "default": 20
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {"dist_table": {"type": "table", "doc": "The term frequencies, in long format (date, publication_name, term, count, total_tokens, relative_frequency). Periods in which a term doesn't occur are not included, documents without a date are counted in a period with a null date."}}
+
+    def process(self, inputs, outputs) -> None:
+
+        import duckdb # type: ignore
+        import numpy as np
+        import pyarrow as pa   # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens, top_k
+
+        agg = inputs.get_value_obj("periodicity").data
+        title_col = inputs.get_value_obj("publication_ref_col").data
+        time_col = inputs.get_value_obj("date_col").data
+        terms = inputs.get_value_data("terms")
+        top_n = inputs.get_value_data("top_n")
+
+        sources: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+
+        sources_col_names = sources.column_names
+
+        if title_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find title name/id column '{title_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+
+        if time_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find date column '{time_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+
+        if len(tokens_array_pa) != sources.num_rows:
+            raise KiaraProcessingException(
+                f"The tokens array has {len(tokens_array_pa)} rows, but the corpus table has {sources.num_rows}. Both need to be created from the same corpus."
+            )
+
+        flat_tokens, doc_ids = flatten_tokens(tokens_array_pa)
+        vocabulary, term_ids = encode_tokens(flat_tokens)
+
+        valid = term_ids >= 0
+        doc_ids = doc_ids[valid]
+        term_ids = term_ids[valid]
+
+        if terms:
+            selected = pc.index_in(
+                pa.array(list(terms), type=pa.large_string()), value_set=vocabulary
+            ).drop_null().to_numpy()
+            selected = np.unique(selected)
+        else:
+            term_counts = np.bincount(term_ids, minlength=len(vocabulary))
+            selected, _ = top_k(term_counts[None, :], top_n)
+            selected = selected[0]
+
+        # only the tokens of the selected terms are handed over to DuckDB, the totals are counted per document
+        is_selected = np.zeros(len(vocabulary), dtype=bool)
+        is_selected[selected] = True
+        keep = is_selected[term_ids]
+
+        sources = pa.table({
+            "doc_id": pa.array(np.arange(sources.num_rows, dtype=np.int64)),
+            "date": sources.column(time_col),
+            "publication": sources.column(title_col),
+            "num_tokens": pa.array(np.bincount(doc_ids, minlength=sources.num_rows).astype(np.int64)),
+        })
+        tokens = pa.table({
+            "doc_id": pa.array(doc_ids[keep]),
+            "term_id": pa.array(term_ids[keep].astype(np.int64)),
+        })
+        selected_terms = pa.table({
+            "term_id": pa.array(selected.astype(np.int64)),
+            "term": vocabulary.take(pa.array(selected)).cast(pa.string()),
+        })
+
+        query = f"""
+        WITH docs AS (
+            SELECT doc_id,
+                date_trunc('{agg}', CAST(strptime(date, '%Y-%m-%d') AS DATE)) as date,
+                publication,
+                num_tokens
+            FROM sources
+        ),
+        totals AS (
+            SELECT date, publication, SUM(num_tokens) as total_tokens
+            FROM docs
+            GROUP BY ALL
+        ),
+        counts AS (
+            SELECT d.date, d.publication, t.term_id, COUNT(*) as count
+            FROM tokens t
+            JOIN docs d ON t.doc_id = d.doc_id
+            GROUP BY ALL
+        )
+        SELECT c.date,
+            c.publication as publication_name,
+            s.term,
+            c.count,
+            CAST(n.total_tokens AS BIGINT) as total_tokens,
+            c.count / n.total_tokens as relative_frequency
+        FROM counts c
+        JOIN totals n ON c.date IS NOT DISTINCT FROM n.date AND c.publication IS NOT DISTINCT FROM n.publication
+        JOIN selected_terms s ON c.term_id = s.term_id
+        ORDER BY c.date, publication_name, s.term
+        """
+
+        con = duckdb.connect(':memory:')
+        con.register('sources', sources)
+        con.register('tokens', tokens)
+        con.register('selected_terms', selected_terms)
+
+        try:
+            queried_table = con.execute(query).fetch_arrow_table()
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Could not aggregate the term frequencies, please check that the date column complies with the format '%Y-%m-%d': {e}"
+            )
+
+        outputs.set_value("dist_table", queried_table)
+
+
+class SampleCorpus(KiaraModule):
+    """
+    This module draws a reproducible stratified sample from a corpus table, for example to tune pre-processing settings before running them on the whole corpus.
+    Strata are publications, periods (day, month or year of the date column), or both, based on the columns created by 'topic_modelling.lccn_metadata'.
+
+    From each stratum, 'sample_fraction' of the documents (but at least one) are drawn at random, optionally capped at 'max_per_stratum'. The order of the rows of the corpus table is preserved.
+    """
+
+    _module_type_name = "topic_modelling.sample_corpus"
+
+    def create_inputs_schema(self):
+
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table to sample from.",
+                "optional": False,
+            },
+            "stratify_by": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["publication", "period", "publication_period"]},
+                "doc": "How to stratify the sample: by 'publication', by 'period', or by both ('publication_period').",
+                "optional": True,
+                "default": "publication_period",
+            },
+            "sample_fraction": {
+                "type": "float",
+                "doc": "The fraction of documents to draw from each stratum.",
+                "optional": True,
+                "default": 0.05,
+            },
+            "max_per_stratum": {
+                "type": "integer",
+                "doc": "The maximum number of documents to draw from each stratum.",
+                "optional": True,
+            },
+            "periodicity": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["day", "month", "year"]},
+                "doc": "The period used for stratification. Values can be either 'day','month' or 'year'.",
+                "optional": True,
+                "default": "year",
+            },
+            "date_col": {
+                "type": "string",
+                "doc": "Column name of the column that contains the date. Values in this column need to comply with the date format '%Y-%m-%d'.",
+                "optional": True,
+                "default": "date",
+            },
+            "publication_ref_col": {
+                "type": "string",
+                "doc": "Column name of the values containing publication names or ref/id.",
+                "optional": True,
+                "default": "publication_ref",
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state.",
+                "optional": True,
+                "default": 0,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {"corpus_table": {"type": "table", "doc": "The sampled corpus table."}}
+
+    def process(self, inputs, outputs) -> None:
+
+        import numpy as np
+        import pyarrow as pa   # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens
+
+        stratify_by = inputs.get_value_data("stratify_by")
+        sample_fraction = inputs.get_value_data("sample_fraction")
+        max_per_stratum = inputs.get_value_data("max_per_stratum")
+        agg = inputs.get_value_data("periodicity")
+        title_col = inputs.get_value_data("publication_ref_col")
+        time_col = inputs.get_value_data("date_col")
+        random_state = inputs.get_value_data("random_state")
+
+        sources: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        sources_col_names = sources.column_names
+
+        if not 0 < sample_fraction <= 1:
+            raise KiaraProcessingException(
+                f"Invalid sample fraction '{sample_fraction}', needs to be greater than 0 and at most 1."
+            )
+
+        keys = []
+        if stratify_by in ["publication", "publication_period"]:
+            if title_col not in sources_col_names:
+                raise KiaraProcessingException(
+                    f"Could not find title name/id column '{title_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+                )
+            keys.append(pc.cast(sources.column(title_col), pa.string()))
+
+        if stratify_by in ["period", "publication_period"]:
+            if time_col not in sources_col_names:
+                raise KiaraProcessingException(
+                    f"Could not find date column '{time_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+                )
+            # dates are '%Y-%m-%d' strings, so periods are prefixes
+            period_length = {"day": 10, "month": 7, "year": 4}[agg]
+            dates = pc.cast(sources.column(time_col), pa.string())
+            keys.append(pc.utf8_slice_codeunits(dates, 0, period_length))
+
+        # only the stratum columns are touched until the final 'take'
+        stratum_keys = pc.binary_join_element_wise(
+            *[pc.fill_null(key, "") for key in keys], "\x1f"
+        )
+        _, strata = encode_tokens(stratum_keys)
+        strata = strata.astype(np.int64)
+
+        rng = np.random.default_rng(random_state)
+        order = np.lexsort((rng.random(len(strata)), strata))
+
+        stratum_sizes = np.bincount(strata)
+        stratum_starts = np.cumsum(stratum_sizes) - stratum_sizes
+        ranks = np.empty(len(strata), dtype=np.int64)
+        ranks[order] = np.arange(len(strata)) - stratum_starts[strata[order]]
+
+        sample_sizes = np.maximum(np.round(stratum_sizes * sample_fraction), 1).astype(np.int64)
+        if max_per_stratum is not None:
+            sample_sizes = np.minimum(sample_sizes, max_per_stratum)
+
+        sample_indices = np.flatnonzero(ranks < sample_sizes[strata])
+
+        outputs.set_value("corpus_table", sources.take(sample_indices))
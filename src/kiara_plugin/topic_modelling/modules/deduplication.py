@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class Deduplicate(KiaraModule):
+    """
+    This module detects near-duplicate documents (for example reprinted articles) in a tokenized corpus, and removes them from the corpus table and the tokens array.
+
+    Each document is represented by the set of its token shingles (sequences of 'shingle_size' consecutive tokens). MinHash signatures of those sets are bucketed with locality-sensitive hashing (LSH):
+    documents that share a bucket in at least one band, and whose estimated Jaccard similarity is at least 'threshold', end up in the same cluster.
+    Only the first document of each cluster is kept. Documents that have fewer tokens than 'shingle_size' are never considered duplicates.
+    """
+
+    _module_type_name = "topic_modelling.deduplicate"
+
+    def create_inputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table the tokens were created from.",
+                "optional": False,
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens of each document of the corpus table.",
+                "optional": False,
+            },
+            "shingle_size": {
+                "type": "integer",
+                "doc": "Number of consecutive tokens per shingle.",
+                "optional": True,
+                "default": 5
+            },
+            "num_perm": {
+                "type": "integer",
+                "doc": "Number of hash functions of the MinHash signatures.",
+                "optional": True,
+                "default": 128
+            },
+            "bands": {
+                "type": "integer",
+                "doc": "Number of LSH bands, needs to be a divisor of num_perm. More bands find more (and less similar) candidates.",
+                "optional": True,
+                "default": 32
+            },
+            "threshold": {
+                "type": "float",
+                "doc": "Minimum estimated Jaccard similarity of the shingle sets for two documents to be considered duplicates.",
+                "optional": True,
+                "default": 0.8
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state for the hash functions.",
+                "optional": True,
+                "default": 0
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table without duplicates."
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "The tokens array without duplicates."
+            },
+            "cluster_ids": {
+                "type": "array",
+                "doc": "For each row of the input corpus table, the id of its duplicate cluster (the row index of the document that was kept)."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens
+
+        corpus_table: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+
+        shingle_size = inputs.get_value_data("shingle_size")
+        num_perm = inputs.get_value_data("num_perm")
+        bands = inputs.get_value_data("bands")
+        threshold = inputs.get_value_data("threshold")
+        random_state = inputs.get_value_data("random_state")
+
+        if len(tokens_array_pa) != corpus_table.num_rows:
+            raise KiaraProcessingException(
+                f"The tokens array has {len(tokens_array_pa)} rows, but the corpus table has {corpus_table.num_rows}. Both need to be created from the same corpus."
+            )
+
+        if shingle_size < 1 or num_perm < 1 or bands < 1 or num_perm % bands != 0:
+            raise KiaraProcessingException(
+                f"Invalid MinHash configuration: shingle_size ({shingle_size}), num_perm ({num_perm}) and bands ({bands}) need to be positive, and num_perm a multiple of bands."
+            )
+
+        try:
+            flat_tokens, doc_ids = flatten_tokens(tokens_array_pa)
+            _, term_ids = encode_tokens(flat_tokens)
+            shingles, shingle_docs = self.create_shingles(term_ids, doc_ids, shingle_size)
+            signatures = self.create_signatures(
+                shingles, shingle_docs, len(tokens_array_pa), num_perm, random_state
+            )
+            cluster_ids = self.cluster(signatures, shingle_docs, bands, threshold)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to detect duplicates: {e}")
+
+        keep = np.flatnonzero(cluster_ids == np.arange(len(cluster_ids)))
+
+        outputs.set_value("corpus_table", corpus_table.take(keep))
+        outputs.set_value("tokens_array", tokens_array_pa.take(keep))
+        outputs.set_value("cluster_ids", pa.array(cluster_ids))
+
+    def create_shingles(self, term_ids, doc_ids, shingle_size):
+        """Hash every run of 'shingle_size' consecutive tokens of the same document to an unsigned 32-bit integer."""
+
+        import numpy as np
+
+        num_shingles = len(term_ids) - shingle_size + 1
+        if num_shingles <= 0:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+
+        token_hashes = self.mix(term_ids.astype(np.uint64))
+        shingle_hashes = np.zeros(num_shingles, dtype=np.uint64)
+        for offset in range(shingle_size):
+            shingle_hashes = self.mix(
+                shingle_hashes ^ token_hashes[offset:offset + num_shingles]
+            )
+
+        valid = doc_ids[:num_shingles] == doc_ids[shingle_size - 1:]
+        return (shingle_hashes[valid] >> np.uint64(32)).astype(np.uint32), doc_ids[:num_shingles][valid]
+
+    def create_signatures(self, shingles, shingle_docs, num_docs, num_perm, random_state):
+        """Compute the MinHash signature of each document, using multiply-shift hash functions.
+
+        Documents without shingles get the maximum hash value for all hash functions.
+        """
+
+        import numpy as np
+
+        rng = np.random.default_rng(random_state)
+        a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+        signatures = np.full((num_docs, num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        if len(shingles) == 0:
+            return signatures
+
+        # shingles are ordered by document, so the minimum per document can be computed with 'reduceat' over segments
+        x = shingles.astype(np.uint64)
+        chunk_size = max(1, 2**24 // num_perm)
+        for start in range(0, len(x), chunk_size):
+            chunk_x = x[start:start + chunk_size]
+            chunk_docs = shingle_docs[start:start + chunk_size]
+            segment_starts = np.flatnonzero(np.r_[True, chunk_docs[1:] != chunk_docs[:-1]])
+            # (num_perm x shingles) layout, so the reduction runs over contiguous memory
+            hashes = ((a[:, None] * chunk_x[None, :] + b[:, None]) >> np.uint64(32)).astype(np.uint32)
+            minima = np.minimum.reduceat(hashes, segment_starts, axis=1)
+            docs = chunk_docs[segment_starts]
+            signatures[docs] = np.minimum(signatures[docs], minima.T)
+
+        return signatures
+
+    def cluster(self, signatures, shingle_docs, bands, threshold):
+        """Group documents whose signatures collide in at least one LSH band and are similar enough.
+
+        Returns, for each document, the index of the first document of its cluster.
+        """
+
+        import numpy as np
+        from scipy import sparse  # type: ignore
+        from scipy.sparse.csgraph import connected_components  # type: ignore
+
+        num_docs, num_perm = signatures.shape
+        rows = num_perm // bands
+        candidates = np.unique(shingle_docs)
+
+        sources = []
+        targets = []
+        for band in range(bands):
+            band_keys = np.zeros(len(candidates), dtype=np.uint64)
+            for column in range(band * rows, (band + 1) * rows):
+                band_keys = self.mix(band_keys ^ signatures[candidates, column].astype(np.uint64))
+            _, bucket = np.unique(band_keys, return_inverse=True)
+            # any member of a bucket can be a collision, so every member is verified against a pivot of its bucket, and
+            # the members that don't match are verified again against a new pivot, until every member is linked or a pivot
+            order = np.argsort(bucket, kind="stable")
+            members = candidates[order]
+            member_buckets = bucket[order]
+            while len(members):
+                is_pivot = np.r_[True, member_buckets[1:] != member_buckets[:-1]]
+                pivots = members[is_pivot][np.cumsum(is_pivot) - 1]
+                rest = ~is_pivot
+                members = members[rest]
+                pivots = pivots[rest]
+                member_buckets = member_buckets[rest]
+                similarity = (signatures[members] == signatures[pivots]).mean(axis=1)
+                similar = similarity >= threshold
+                sources.append(members[similar])
+                targets.append(pivots[similar])
+                members = members[~similar]
+                member_buckets = member_buckets[~similar]
+
+        sources_arr = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        targets_arr = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+
+        graph = sparse.coo_matrix(
+            (np.ones(len(sources_arr), dtype=np.int8), (sources_arr, targets_arr)),
+            shape=(num_docs, num_docs),
+        )
+        _, labels = connected_components(graph, directed=False)
+
+        # use the smallest document index of each component as cluster id
+        _, first_doc, component = np.unique(labels, return_index=True, return_inverse=True)
+        return first_doc[component].astype(np.int64)
+
+    @staticmethod
+    def mix(values):
+        """Scramble unsigned 64-bit integers (splitmix64 finalizer)."""
+
+        import numpy as np
+
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
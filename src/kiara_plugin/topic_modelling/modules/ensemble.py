@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+def _train_lda_run(corpus_path, dictionary_path, num_topics, random_state, passes, chunksize, iterations):
+    """Train one LDA model on a serialized corpus, and return its topic-term matrix (runs in worker processes)."""
+
+    from gensim import corpora  # type: ignore
+    from gensim.models.ldamodel import LdaModel  # type: ignore
+
+    # the corpus is streamed from the file, so all workers share the page cache instead of holding a copy
+    corpus = corpora.MmCorpus(corpus_path)
+    id2word = corpora.Dictionary.load(dictionary_path)
+    model = LdaModel(
+        corpus=corpus,
+        id2word=id2word,
+        num_topics=num_topics,
+        random_state=random_state,
+        passes=passes,
+        chunksize=chunksize,
+        iterations=iterations,
+        eval_every=None,
+    )
+    return model.get_topics()
+
+
+class RunLdaEnsemble(KiaraModule):
+    """
+    This module trains LDA models with different random states in parallel, and combines them into consensus topics, to check how stable the topics are.
+
+    The corpus is serialized once to a temporary file that all worker processes read from. The topics of every run are aligned to the topics of the
+    most central run (the run that is most similar to all others) by Hungarian matching of the cosine similarities of their term distributions.
+    The stability of a consensus topic is the similarity of the matched topics across runs (1 means every run found the same topic),
+    and its term distribution is the mean of the matched topics.
+    """
+
+    _module_type_name = "topic_modelling.lda_ensemble"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to process.",
+            },
+            "no_below": {
+                "type": "integer",
+                "doc": "Remove tokens that appear in less than no_below documents.",
+                "optional": True,
+                "default": False
+            },
+            "no_above": {
+                "type": "float",
+                "doc": "Remove tokens that appear in more than no_above documents (fraction of the total number of documents).",
+                "optional": True,
+            },
+            "num_topics": {
+                "type": "integer",
+                "doc": "Number of topics to process.",
+                "optional": False,
+            },
+            "num_runs": {
+                "type": "integer",
+                "doc": "Number of LDA runs, with the random states random_state, random_state + 1, ...",
+                "optional": True,
+                "default": 5
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state of the first run.",
+                "optional": True,
+                "default": 0
+            },
+            "passes": {
+                "type": "integer",
+                "doc": "Number of passes of each run.",
+                "optional": True,
+                "default": 1
+            },
+            "chunksize": {
+                "type": "integer",
+                "doc": "Number of documents per training chunk.",
+                "optional": True,
+                "default": 2000
+            },
+            "iterations": {
+                "type": "integer",
+                "doc": "Maximum number of inference iterations per document.",
+                "optional": True,
+                "default": 50
+            },
+            "workers": {
+                "type": "integer",
+                "doc": "Number of runs to train in parallel. Defaults to the number of cores.",
+                "optional": True,
+            },
+            "num_words": {
+                "type": "integer",
+                "doc": "Number of top words per consensus topic in the topics and topic_words outputs.",
+                "optional": True,
+                "default": 30
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "topics": {
+                "type": "list",
+                "doc": "The consensus topics."
+            },
+            "topic_words": {
+                "type": "table",
+                "doc": "The top words of each consensus topic, in long format (topic_id, rank, term, weight)."
+            },
+            "topic_terms": {
+                "type": "table",
+                "doc": "The weights of all terms of the vocabulary for each consensus topic, with a 'term' column and one 'topic_<n>' column per topic."
+            },
+            "topic_stability": {
+                "type": "table",
+                "doc": "The mean and minimum cosine similarity of the matched topics of all runs, for each consensus topic (topic_id, stability_mean, stability_min)."
+            },
+            "run_alignment": {
+                "type": "table",
+                "doc": "The topic of each run that was matched to each consensus topic (run, random_state, topic_id, run_topic_id, similarity)."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import os
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        from gensim import corpora  # type: ignore
+
+        from kiara_plugin.topic_modelling.modules.lda import RunLda
+        from kiara_plugin.topic_modelling.utils import (
+            create_topic_terms_table,
+            create_topic_words_table,
+            format_topic,
+            iter_batches,
+            top_k,
+        )
+
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+        no_below = inputs.get_value_data("no_below")
+        no_above = inputs.get_value_data("no_above")
+        num_topics = inputs.get_value_data("num_topics")
+        num_runs = inputs.get_value_data("num_runs")
+        random_state = inputs.get_value_data("random_state")
+        passes = inputs.get_value_data("passes")
+        chunksize = inputs.get_value_data("chunksize")
+        iterations = inputs.get_value_data("iterations")
+        workers = inputs.get_value_data("workers") or os.cpu_count() or 1
+        num_words = inputs.get_value_data("num_words")
+
+        if num_runs < 2:
+            raise KiaraProcessingException(f"Invalid number of runs '{num_runs}', an ensemble needs at least 2 runs.")
+
+        def iter_docs():
+            for batch in iter_batches(tokens_array_pa):
+                for doc in batch.to_pylist():
+                    yield doc or []
+
+        # the same vocabulary as a single 'topic_modelling.lda' run, which marks unset values with False
+        id2word = RunLda.create_dictionary(iter_docs(), no_below=no_below or False, no_above=no_above or False)
+
+        if len(id2word) == 0:
+            raise KiaraProcessingException(
+                "No terms left in the vocabulary, please check the no_below and no_above values."
+            )
+
+        seeds = [random_state + run for run in range(num_runs)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            corpus_path = os.path.join(temp_dir, "corpus.mm")
+            dictionary_path = os.path.join(temp_dir, "dictionary")
+            try:
+                corpora.MmCorpus.serialize(corpus_path, (id2word.doc2bow(doc) for doc in iter_docs()))
+                id2word.save(dictionary_path)
+
+                args = [
+                    (corpus_path, dictionary_path, num_topics, seed, passes, chunksize, iterations)
+                    for seed in seeds
+                ]
+                if workers == 1:
+                    run_topics = [_train_lda_run(*a) for a in args]
+                else:
+                    with ProcessPoolExecutor(max_workers=min(workers, num_runs)) as executor:
+                        run_topics = list(executor.map(_train_lda_run, *zip(*args)))
+            except Exception as e:
+                raise KiaraProcessingException(f"Failed to run LDA: {e}")
+
+        run_topics = np.stack(run_topics).astype(np.float64)
+        reference, matches, similarities = self.align(run_topics)
+
+        # consensus topics: mean term distribution of the matched topics
+        aligned = np.stack([run_topics[run][matches[run]] for run in range(num_runs)])
+        consensus = aligned.mean(axis=0)
+        consensus /= consensus.sum(axis=1, keepdims=True)
+
+        terms = pa.array([id2word[term_id] for term_id in range(len(id2word))], type=pa.large_string())
+        top_terms, top_weights = top_k(consensus, num_words)
+        top_terms_list = terms.take(pa.array(top_terms.ravel())).to_pylist()
+        topics = []
+        for topic_id, weights in enumerate(top_weights):
+            topic_terms = top_terms_list[topic_id * top_terms.shape[1]:(topic_id + 1) * top_terms.shape[1]]
+            topics.append((topic_id, format_topic(topic_terms, weights.tolist())))
+
+        # the reference run is matched to itself, so only the other runs count for the stability
+        others = [run for run in range(num_runs) if run != reference]
+        topic_ids = np.arange(num_topics, dtype=np.int32)
+
+        outputs.set_value("topics", topics)
+        outputs.set_value("topic_words", create_topic_words_table(consensus, terms, num_words))
+        outputs.set_value("topic_terms", create_topic_terms_table(consensus, terms))
+        outputs.set_value("topic_stability", pa.table({
+            "topic_id": pa.array(topic_ids),
+            "stability_mean": pa.array(similarities[others].mean(axis=0).astype(np.float32)),
+            "stability_min": pa.array(similarities[others].min(axis=0).astype(np.float32)),
+        }))
+        outputs.set_value("run_alignment", pa.table({
+            "run": pa.array(np.repeat(np.arange(num_runs, dtype=np.int32), num_topics)),
+            "random_state": pa.array(np.repeat(np.array(seeds, dtype=np.int64), num_topics)),
+            "topic_id": pa.array(np.tile(topic_ids, num_runs)),
+            "run_topic_id": pa.array(matches.ravel().astype(np.int32)),
+            "similarity": pa.array(similarities.ravel().astype(np.float32)),
+        }))
+
+    def align(self, run_topics):
+        """Align the topics of all runs to the topics of the most central run.
+
+        Returns the index of the reference run, and for every run and reference topic the matched topic of the run and its cosine similarity.
+        """
+
+        import numpy as np
+        from scipy.optimize import linear_sum_assignment  # type: ignore
+
+        num_runs, num_topics, _ = run_topics.shape
+        normalized = run_topics / np.maximum(
+            np.linalg.norm(run_topics, axis=2, keepdims=True), np.finfo(np.float64).tiny
+        )
+
+        # cosine similarities of all pairs of topics of all pairs of runs, in one matrix product
+        flat = normalized.reshape(num_runs * num_topics, -1)
+        similarity = (flat @ flat.T).reshape(num_runs, num_topics, num_runs, num_topics).transpose(0, 2, 1, 3)
+
+        matched_similarity = np.zeros((num_runs, num_runs))
+        for run_a in range(num_runs):
+            for run_b in range(num_runs):
+                rows, columns = linear_sum_assignment(similarity[run_a, run_b], maximize=True)
+                matched_similarity[run_a, run_b] = similarity[run_a, run_b][rows, columns].sum()
+        reference = int(np.argmax(matched_similarity.sum(axis=1)))
+
+        matches = np.zeros((num_runs, num_topics), dtype=np.int64)
+        similarities = np.zeros((num_runs, num_topics))
+        for run in range(num_runs):
+            rows, columns = linear_sum_assignment(similarity[reference, run], maximize=True)
+            matches[run, rows] = columns
+            similarities[run, rows] = similarity[reference, run][rows, columns]
+        return reference, matches, similarities
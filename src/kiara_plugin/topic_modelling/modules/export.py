@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class ExportParquetDataset(KiaraModule):
+    """
+    This module exports a corpus and the outputs of the pre-processing and modelling modules as Parquet datasets, to query them outside of kiara
+    (e.g. with DuckDB, Polars or pyarrow).
+
+    The corpus table, the tokens array and the document topics table are written to the 'corpus', 'tokens' and 'document_topics' sub-directories of
+    'export_dir', partitioned by publication and year (Hive-style 'publication=<name>/year=<year>' directories), based on the columns created by
+    'topic_modelling.lccn_metadata'. Every row gets a 'doc_id' column (the position of the document in the corpus table), to join the datasets.
+    The topic words table is written unpartitioned to 'topic_words'. Strings are dictionary encoded, and every row group stores min/max statistics,
+    so readers can skip the partitions and row groups a query doesn't need.
+    """
+
+    _module_type_name = "topic_modelling.export_parquet"
+
+    def create_inputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table to export, with the date and publication columns to partition by.",
+                "optional": False,
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens of each document of the corpus table.",
+                "optional": True,
+            },
+            "document_topics": {
+                "type": "table",
+                "doc": "The document topics table of a model trained on the corpus, with a 'doc_id' column and one 'topic_<n>' column per topic.",
+                "optional": True,
+            },
+            "topic_words": {
+                "type": "table",
+                "doc": "The topic words table of a model trained on the corpus.",
+                "optional": True,
+            },
+            "export_dir": {
+                "type": "string",
+                "doc": "Local directory to export the datasets to. Existing datasets with the same names in this directory are replaced.",
+                "optional": False,
+            },
+            "date_col": {
+                "type": "string",
+                "doc": "Column name of the column that contains the date. Values in this column need to comply with the date format '%Y-%m-%d'.",
+                "optional": True,
+                "default": "date",
+            },
+            "publication_ref_col": {
+                "type": "string",
+                "doc": "Column name of the values containing publication names or ref/id.",
+                "optional": True,
+                "default": "publication_ref",
+            },
+            "row_group_size": {
+                "type": "integer",
+                "doc": "Maximum number of rows per row group.",
+                "optional": True,
+                "default": 100000,
+            },
+            "compression": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["zstd", "snappy", "gzip", "none"]},
+                "doc": "Compression codec of the Parquet files.",
+                "optional": True,
+                "default": "zstd",
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "export_dir": {
+                "type": "string",
+                "doc": "The directory the datasets were exported to."
+            },
+            "export_statistics": {
+                "type": "dict",
+                "doc": "The number of rows, files and partitions of each exported dataset."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import os
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        corpus_table: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        tokens_value = inputs.get_value_data("tokens_array")
+        doc_topics_value = inputs.get_value_data("document_topics")
+        topic_words_value = inputs.get_value_data("topic_words")
+        export_dir = os.path.abspath(inputs.get_value_data("export_dir"))
+        time_col = inputs.get_value_data("date_col")
+        title_col = inputs.get_value_data("publication_ref_col")
+        row_group_size = inputs.get_value_data("row_group_size")
+        compression = inputs.get_value_data("compression")
+
+        sources_col_names = corpus_table.column_names
+        if title_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find title name/id column '{title_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+        if time_col not in sources_col_names:
+            raise KiaraProcessingException(
+                f"Could not find date column '{time_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+            )
+        for name in ["doc_id", "publication", "year"]:
+            if name in sources_col_names:
+                raise KiaraProcessingException(
+                    f"The corpus table already has a '{name}' column, which is added by the export. Please rename it first."
+                )
+        if row_group_size < 1:
+            raise KiaraProcessingException(f"Invalid row group size '{row_group_size}', needs to be at least 1.")
+
+        num_docs = corpus_table.num_rows
+
+        # partition keys: dates are '%Y-%m-%d' strings, so the year is the prefix
+        publications = pc.cast(corpus_table.column(title_col), pa.string())
+        try:
+            years = pc.cast(
+                pc.utf8_slice_codeunits(pc.cast(corpus_table.column(time_col), pa.string()), 0, 4), pa.int16()
+            )
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to extract the years from the date column '{time_col}': {e}")
+
+        # rows are written sorted by partition, so every partition is written in one go, with full row groups
+        keys = pa.table({"publication": publications, "year": years, "doc_id": pa.array(np.arange(num_docs, dtype=np.int64))})
+        order = pc.sort_indices(
+            keys, sort_keys=[("publication", "ascending"), ("year", "ascending"), ("doc_id", "ascending")], null_placement="at_end"
+        ).to_numpy()
+        keys = keys.take(pa.array(order))
+
+        datasets = {"corpus": corpus_table}
+
+        if tokens_value is not None:
+            tokens_array_pa = tokens_value.arrow_array
+            if len(tokens_array_pa) != num_docs:
+                raise KiaraProcessingException(
+                    f"The tokens array has {len(tokens_array_pa)} documents, but the corpus table has {num_docs} rows. Both need to be created from the same corpus."
+                )
+            datasets["tokens"] = pa.table({"tokens": tokens_array_pa})
+
+        if doc_topics_value is not None:
+            doc_topics: pa.Table = doc_topics_value.arrow_table
+            if doc_topics.num_rows != num_docs:
+                raise KiaraProcessingException(
+                    f"The document topics table has {doc_topics.num_rows} rows, but the corpus table has {num_docs}. Both need to be created from the same corpus."
+                )
+            # the doc_id is re-added from the row position, with the other keys
+            datasets["document_topics"] = doc_topics.drop_columns([c for c in ["doc_id"] if c in doc_topics.column_names])
+
+        statistics = {}
+        for name, table in datasets.items():
+            statistics[name] = self.write_dataset(
+                self.iter_partitioned(table, keys, order, row_group_size),
+                os.path.join(export_dir, name),
+                partitioned=True,
+                row_group_size=row_group_size,
+                compression=compression,
+            )
+
+        if topic_words_value is not None:
+            topic_words: pa.Table = topic_words_value.arrow_table
+            statistics["topic_words"] = self.write_dataset(
+                topic_words.to_batches(max_chunksize=row_group_size),
+                os.path.join(export_dir, "topic_words"),
+                partitioned=False,
+                row_group_size=row_group_size,
+                compression=compression,
+                schema=topic_words.schema,
+            )
+
+        outputs.set_value("export_dir", export_dir)
+        outputs.set_value("export_statistics", statistics)
+
+    def iter_partitioned(self, table, keys, order, batch_size):
+        """Iterate over record batches of the rows of a table in partition order, with the 'doc_id' and partition key columns added.
+
+        Only one batch of rows is copied at a time, so the whole table is never materialized in sorted order.
+        """
+
+        import pyarrow as pa  # type: ignore
+
+        for start in range(0, len(order), batch_size):
+            rows = table.take(pa.array(order[start:start + batch_size]))
+            batch_keys = keys.slice(start, batch_size)
+            columns = {"doc_id": batch_keys.column("doc_id")}
+            for column_name in rows.column_names:
+                columns[column_name] = rows.column(column_name)
+            columns["publication"] = batch_keys.column("publication")
+            columns["year"] = batch_keys.column("year")
+            yield from pa.table(columns).to_batches()
+
+    def write_dataset(self, batches, dataset_dir, partitioned, row_group_size, compression, schema=None):
+        """Write record batches as a Parquet dataset, and return the number of rows, files and partitions written.
+
+        The dataset is written to a temporary directory, and moved in place when complete.
+        """
+
+        import itertools
+        import os
+        import shutil
+
+        import pyarrow as pa  # type: ignore
+        import pyarrow.dataset as ds  # type: ignore
+
+        batches = iter(batches)
+        if schema is None:
+            first = next(batches, None)
+            if first is None:
+                return {"num_rows": 0, "num_files": 0, "num_partitions": 0}
+            schema = first.schema
+            batches = itertools.chain([first], batches)
+
+        partitioning = None
+        if partitioned:
+            partitioning = ds.partitioning(
+                pa.schema([("publication", pa.string()), ("year", pa.int16())]), flavor="hive"
+            )
+
+        parquet_format = ds.ParquetFileFormat()
+        file_options = parquet_format.make_write_options(
+            compression=None if compression == "none" else compression,
+            use_dictionary=True,
+            write_statistics=True,
+        )
+
+        written = []
+        temp = f"{dataset_dir}.tmp"
+        try:
+            shutil.rmtree(temp, ignore_errors=True)
+            ds.write_dataset(
+                ds.Scanner.from_batches(batches, schema=schema),
+                temp,
+                format=parquet_format,
+                file_options=file_options,
+                partitioning=partitioning,
+                basename_template="part-{i}.parquet",
+                max_rows_per_group=row_group_size,
+                min_rows_per_group=min(row_group_size, 1024 * 1024),
+                max_partitions=1_000_000,
+                existing_data_behavior="overwrite_or_ignore",
+                # keeps the rows of every partition in doc_id order
+                use_threads=False,
+                file_visitor=lambda written_file: written.append(written_file),
+            )
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            os.makedirs(os.path.dirname(dataset_dir), exist_ok=True)
+            os.replace(temp, dataset_dir)
+        except Exception as e:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise KiaraProcessingException(f"Failed to export the dataset to '{dataset_dir}': {e}")
+
+        return {
+            "num_rows": sum(f.metadata.num_rows for f in written),
+            "num_files": len(written),
+            "num_partitions": len({os.path.dirname(f.path) for f in written}),
+        }
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class HashFeatures(KiaraModule):
+    """
+    This module maps an array of tokens to a sparse document-feature count matrix with the hashing trick: every term is hashed to one of
+    'num_features' columns, so no vocabulary has to be built over the whole corpus first.
+
+    The hashes only depend on the terms, so batches of documents (or separately onboarded corpora) can be featurized independently and in parallel,
+    and their matrices are compatible. The matrix is returned in long (coordinate) format. Optionally, a reverse lookup of the most frequent terms
+    to their features is kept, to interpret the features afterwards.
+    """
+
+    _module_type_name = "topic_modelling.hash_features"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to featurize.",
+            },
+            "num_features": {
+                "type": "integer",
+                "doc": "Number of features (columns of the matrix). More features mean fewer collisions of terms.",
+                "optional": True,
+                "default": 262144
+            },
+            "num_lookup_terms": {
+                "type": "integer",
+                "doc": "Number of most frequent terms to keep in the feature lookup table. If 0, no lookup table is created.",
+                "optional": True,
+                "default": 1000
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "feature_counts": {
+                "type": "table",
+                "doc": "The non-zero counts of the document-feature matrix, in long format (doc_id, feature, count), sorted by document and feature."
+            },
+            "feature_lookup": {
+                "type": "table",
+                "doc": "The features of the most frequent terms (feature, term, count), sorted by descending count. Terms that are frequent in a batch, but in none of the batches among the most frequent terms, may be missing."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import iter_batches
+
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+        num_features = inputs.get_value_data("num_features")
+        num_lookup_terms = inputs.get_value_data("num_lookup_terms")
+
+        if num_features < 1:
+            raise KiaraProcessingException(f"Invalid number of features '{num_features}', needs to be at least 1.")
+
+        count_tables = []
+        lookup_tables = []
+        row_offset = 0
+        try:
+            # every batch is featurized on its own, with its own (batch) vocabulary
+            for batch in iter_batches(tokens_array_pa, 100_000):
+                counts, lookup = self.featurize(batch, num_features, num_lookup_terms)
+                counts = counts.set_column(0, "doc_id", pa.array(counts.column("doc_id").to_numpy() + row_offset))
+                count_tables.append(counts)
+                lookup_tables.append(lookup)
+                row_offset += len(batch)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to featurize the tokens: {e}")
+
+        schema = pa.schema([("doc_id", pa.int64()), ("feature", pa.int64()), ("count", pa.int32())])
+        feature_counts = pa.concat_tables(count_tables) if count_tables else schema.empty_table()
+
+        lookup_schema = pa.schema([("feature", pa.int64()), ("term", pa.large_string()), ("count", pa.int64())])
+        feature_lookup = lookup_schema.empty_table()
+        if num_lookup_terms > 0 and lookup_tables:
+            feature_lookup = (
+                pa.concat_tables(lookup_tables)
+                .group_by(["term", "feature"])
+                .aggregate([("count", "sum")])
+                .rename_columns(["term", "feature", "count"])
+                .sort_by([("count", "descending"), ("term", "ascending")])
+                .slice(0, num_lookup_terms)
+                .select(["feature", "term", "count"])
+            )
+
+        outputs.set_value("feature_counts", feature_counts)
+        outputs.set_value("feature_lookup", feature_lookup)
+
+    def featurize(self, batch, num_features, num_lookup_terms):
+        """Count the hashed features of a batch of token lists.
+
+        Returns the counts table of the batch (with batch-local document ids), and the features of the most frequent terms of the batch.
+        """
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens, hash_terms, top_k
+
+        flat_tokens, doc_ids = flatten_tokens(batch)
+        vocabulary, term_ids = encode_tokens(flat_tokens)
+
+        valid = term_ids >= 0
+        doc_ids = doc_ids[valid]
+        term_ids = term_ids[valid]
+
+        # only the unique terms of the batch are hashed
+        term_features = (hash_terms(vocabulary) % np.uint64(num_features)).astype(np.int64)
+        keys, counts = np.unique(doc_ids * num_features + term_features[term_ids], return_counts=True)
+
+        counts_table = pa.table({
+            "doc_id": pa.array(keys // num_features),
+            "feature": pa.array(keys % num_features),
+            "count": pa.array(counts.astype(np.int32)),
+        })
+
+        term_counts = np.bincount(term_ids, minlength=len(vocabulary))
+        top_terms, top_counts = top_k(term_counts[None, :], max(num_lookup_terms, 0))
+        lookup_table = pa.table({
+            "term": vocabulary.take(pa.array(top_terms[0])).cast(pa.large_string()),
+            "feature": pa.array(term_features[top_terms[0]]),
+            "count": pa.array(top_counts[0].astype(np.int64)),
+        })
+
+        return counts_table, lookup_table
@@ -1,12 +1,18 @@
 from kiara.api import KiaraModule
 from kiara.exceptions import KiaraProcessingException
 
+# with auto_tune, the chunksize is only calibrated on corpora that are at least this many times larger than the calibration sample
+MIN_CORPUS_PER_CALIBRATION_SAMPLE = 20
+
 # work in progress, not ready for use
 
 class RunLda(KiaraModule):
     """
     https://radimrehurek.com/gensim/models/ldamulticore.html
-    
+
+    The passes are run one by one, so the model can be evaluated, checkpointed and stopped early in between. The learning rate
+    decays over the passes as in gensim's own multi-pass training, so without a tolerance, a single worker trains the same model
+    as gensim with 'passes'.
     """
 
     _module_type_name = "topic_modelling.lda"
@@ -42,15 +48,33 @@ class RunLda(KiaraModule):
             },
             "chunksize": {
                 "type": "integer",
-                "doc": "Chunksize.",
+                "doc": "Number of documents per training chunk. If not set, 2000 documents, or a tuned value with auto_tune.",
                 "optional": True,
                 "default": False
             },
              "iterations": {
                 "type": "integer",
-                "doc": "Number of iterations.",
+                "doc": "Maximum number of inference iterations per document. If not set, 50 iterations.",
                 "optional": True,
                 "default": False
+            },
+            "num_words": {
+                "type": "integer",
+                "doc": "Number of top words per topic in the topics and topic_words outputs.",
+                "optional": True,
+                "default": 30
+            },
+            "num_common_words": {
+                "type": "integer",
+                "doc": "Number of most common words overall.",
+                "optional": True,
+                "default": 15
+            },
+            "num_top_documents": {
+                "type": "integer",
+                "doc": "Number of documents with the highest weight per topic in the top_documents output.",
+                "optional": True,
+                "default": 10
             },
              "random_state": {
                 "type": "integer",
@@ -58,24 +82,107 @@ class RunLda(KiaraModule):
                 "optional": True,
                 "default": False
             },
+            "heldout_fraction": {
+                "type": "float",
+                "doc": "Fraction of the documents that is held out from training, and used to track the perplexity after each pass. If 0, the perplexity is tracked on a sample of the training documents.",
+                "optional": True,
+                "default": 0.0
+            },
+            "tolerance": {
+                "type": "float",
+                "doc": "Stop training early when the relative improvement of the per-word likelihood bound after a pass falls below this value. If not set, all passes are run.",
+                "optional": True,
+            },
+            "workers": {
+                "type": "integer",
+                "doc": "Number of worker processes. Defaults to the number of cores minus one, or a tuned value with auto_tune. With a single worker, the serial (and reproducible for a given random state) gensim implementation is used.",
+                "optional": True,
+            },
+            "eval_every": {
+                "type": "integer",
+                "doc": "Let gensim estimate (and log) the perplexity on the current chunk every eval_every updates. If not set, the model is only evaluated once per pass (see the convergence output).",
+                "optional": True,
+            },
+            "auto_tune": {
+                "type": "boolean",
+                "doc": "Choose the number of workers and the chunksize (if not set) from the corpus size, the average document length, the available cores and memory, and a short calibration run on large corpora.",
+                "optional": True,
+                "default": False
+            },
+            "memory_budget": {
+                "type": "integer",
+                "doc": "Memory budget for auto_tune, in megabytes. If not set, half of the available memory.",
+                "optional": True,
+            },
+            "checkpoint_dir": {
+                "type": "string",
+                "doc": "Local directory to save the model state, the dictionary and the pass counter to during training.",
+                "optional": True,
+            },
+            "checkpoint_every": {
+                "type": "integer",
+                "doc": "Save a checkpoint every checkpoint_every passes. A final checkpoint is saved when training stops early (see tolerance), so resuming from it doesn't train further.",
+                "optional": True,
+                "default": 1
+            },
+            "resume": {
+                "type": "boolean",
+                "doc": "Whether to continue training from the latest checkpoint in checkpoint_dir (if there is one).",
+                "optional": True,
+                "default": False
+            },
         }
 
     def create_outputs_schema(self):
         return {
             "most_common_words": {
                 "type": "list",
-                "doc": "The 15 most common words overall."
+                "doc": "The most common words overall."
             },
             "topics": {
                 "type": "list",
                 "doc": "The topics generated by LDA."
+            },
+            "topic_words": {
+                "type": "table",
+                "doc": "The top words of each topic, in long format (topic_id, rank, term, weight)."
+            },
+            "top_documents": {
+                "type": "table",
+                "doc": "The documents with the highest weight for each topic, in long format (topic_id, rank, doc_id, weight)."
+            },
+            "document_topics": {
+                "type": "table",
+                "doc": "The topic weights of each document, with a 'doc_id' column (position in the tokens array) and one 'topic_<n>' column per topic."
+            },
+            "topic_terms": {
+                "type": "table",
+                "doc": "The weights of all terms of the vocabulary for each topic, with a 'term' column and one 'topic_<n>' column per topic."
+            },
+            "convergence": {
+                "type": "table",
+                "doc": "The per-word likelihood bound, perplexity, relative improvement and duration of each training pass."
+            },
+            "training_settings": {
+                "type": "dict",
+                "doc": "The workers, chunksize, iterations and eval_every values used for training, the calibration results (with auto_tune), and the measured throughput in documents per second."
             }
         }
 
     def process(self, inputs, outputs):
 
-        import gensim  # type: ignore
-        from gensim import corpora # type: ignore
+        import logging
+        import time
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import (
+            create_document_topics_table,
+            create_top_documents_table,
+            create_topic_terms_table,
+            create_topic_words_table,
+        )
 
         tokens_array = inputs.get_value_data("tokens_array")
         tokens_array_pa = tokens_array.arrow_array
@@ -90,6 +197,188 @@ class RunLda(KiaraModule):
         chunksize = inputs.get_value_data("chunksize")
         iterations = inputs.get_value_data("iterations")
         random_state = inputs.get_value_data("random_state")
+        num_words = inputs.get_value_data("num_words")
+        num_common_words = inputs.get_value_data("num_common_words")
+        num_top_documents = inputs.get_value_data("num_top_documents")
+        heldout_fraction = inputs.get_value_data("heldout_fraction")
+        tolerance = inputs.get_value_data("tolerance")
+        workers = inputs.get_value_data("workers")
+        checkpoint_dir = inputs.get_value_data("checkpoint_dir")
+        checkpoint_every = inputs.get_value_data("checkpoint_every")
+        resume = inputs.get_value_data("resume")
+        eval_every = inputs.get_value_data("eval_every")
+        auto_tune = inputs.get_value_data("auto_tune")
+        memory_budget = inputs.get_value_data("memory_budget")
+
+        logger = logging.getLogger(__name__)
+
+        if not 0 <= heldout_fraction < 1:
+            raise KiaraProcessingException(
+                f"Invalid heldout fraction '{heldout_fraction}', needs to be at least 0 and smaller than 1."
+            )
+
+        if checkpoint_every < 1:
+            raise KiaraProcessingException(
+                f"Invalid checkpoint interval '{checkpoint_every}', needs to be at least 1."
+            )
+
+        if resume and not checkpoint_dir:
+            raise KiaraProcessingException("Can't resume training without a checkpoint directory.")
+
+        checkpoint = self.load_checkpoint(checkpoint_dir) if resume else None
+
+        if checkpoint is not None:
+            # the dictionary of the checkpoint is used, so the term ids match the model
+            model, id2word, training_state = checkpoint
+            if model.num_topics != num_topics:
+                raise KiaraProcessingException(
+                    f"Can't resume training: the checkpoint has {model.num_topics} topics, not {num_topics}."
+                )
+        else:
+            id2word = self.create_dictionary(tokens_list, no_below=no_below, no_above=no_above)
+
+        try:
+            corpus = [id2word.doc2bow(text) for text in tokens_list]
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Failed to create doc2bow: {e}"
+            )
+
+        rng = np.random.default_rng(None if random_state is False else random_state)
+        shuffled = rng.permutation(len(corpus))
+        if heldout_fraction:
+            num_heldout = max(1, int(len(corpus) * heldout_fraction))
+            heldout_ids = set(shuffled[:num_heldout].tolist())
+            train_corpus = [doc for doc_id, doc in enumerate(corpus) if doc_id not in heldout_ids]
+            eval_corpus = [corpus[doc_id] for doc_id in sorted(heldout_ids)]
+        else:
+            train_corpus = corpus
+            eval_corpus = [corpus[doc_id] for doc_id in sorted(shuffled[:1000].tolist())]
+
+        # unset values (False) fall back to the gensim defaults
+        iterations = iterations or 50
+        calibration = []
+        if auto_tune:
+            workers, chunksize, calibration = self.tune(
+                train_corpus,
+                num_topics=num_topics,
+                num_terms=len(id2word),
+                workers=workers,
+                chunksize=chunksize,
+                memory_budget=memory_budget,
+                create_model=lambda workers, chunksize: self.create_model(
+                    id2word, num_topics, workers, chunksize, iterations, eval_every, random_state
+                ),
+            )
+        chunksize = chunksize or 2000
+
+        if checkpoint is None:
+            try:
+                model = self.create_model(id2word, num_topics, workers, chunksize, iterations, eval_every, random_state)
+            except Exception as e:
+                raise KiaraProcessingException(
+                    f"Failed to run LDA: {e}"
+                )
+            training_state = {
+                "passes_done": 0,
+                "previous_bound": None,
+                "converged": False,
+                "convergence": {"pass": [], "per_word_bound": [], "perplexity": [], "relative_improvement": [], "seconds": []},
+            }
+        else:
+            if workers and hasattr(model, "workers"):
+                model.workers = workers
+            model.chunksize = chunksize
+            model.iterations = iterations
+            model.eval_every = eval_every
+
+        # the passes are run one by one, so the model can be evaluated (and training stopped) in between
+        convergence = training_state["convergence"]
+        previous_bound = training_state["previous_bound"]
+        update_seconds = 0.0
+        updated_docs = 0
+        # a run that stopped early is not trained further when it is resumed
+        last_pass = training_state["passes_done"] if training_state.get("converged") else (passes or 1)
+        for pass_no in range(training_state["passes_done"], last_pass):
+            started = time.time()
+            try:
+                self.train_pass(model, train_corpus, pass_no)
+                update_seconds += time.time() - started
+                updated_docs += len(train_corpus)
+                # the evaluation draws from the random state of the model, which is restored so it doesn't change the training
+                random_state_before = model.random_state.get_state()
+                bound = model.log_perplexity(eval_corpus)
+                model.random_state.set_state(random_state_before)
+            except Exception as e:
+                raise KiaraProcessingException(
+                    f"Failed to run LDA: {e}"
+                )
+
+            improvement = None if previous_bound is None else (bound - previous_bound) / abs(previous_bound)
+            convergence["pass"].append(pass_no + 1)
+            convergence["per_word_bound"].append(bound)
+            convergence["perplexity"].append(float(np.exp2(-bound)))
+            convergence["relative_improvement"].append(improvement)
+            convergence["seconds"].append(time.time() - started)
+
+            converged = bool(tolerance is not None and improvement is not None and improvement < tolerance)
+            previous_bound = bound
+
+            if checkpoint_dir and (converged or (pass_no + 1) % checkpoint_every == 0):
+                self.save_checkpoint(
+                    checkpoint_dir,
+                    model,
+                    id2word,
+                    {
+                        "passes_done": pass_no + 1,
+                        "previous_bound": previous_bound,
+                        "converged": converged,
+                        "convergence": convergence,
+                    },
+                )
+
+            if converged:
+                break
+
+        try:
+            gamma, _ = model.inference(corpus)
+            doc_topic = gamma / gamma.sum(axis=1, keepdims=True)
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Failed to infer document topics: {e}"
+            )
+
+        training_settings = {
+            "workers": getattr(model, "workers", 1),
+            "chunksize": model.chunksize,
+            "iterations": model.iterations,
+            "eval_every": model.eval_every,
+            "auto_tune": auto_tune,
+            "calibration": calibration,
+            "docs_per_second": updated_docs / update_seconds if update_seconds else None,
+        }
+        logger.info("LDA training settings: %s", training_settings)
+
+        terms = pa.array([id2word[term_id] for term_id in range(len(id2word))], type=pa.large_string())
+
+        outputs.set_value("topics", model.print_topics(num_topics=num_topics, num_words=num_words))
+        topic_term = model.get_topics()
+        outputs.set_value("topic_words", create_topic_words_table(topic_term, terms, num_words))
+        outputs.set_value("topic_terms", create_topic_terms_table(topic_term, terms))
+        outputs.set_value("document_topics", create_document_topics_table(doc_topic))
+        outputs.set_value("top_documents", create_top_documents_table(doc_topic, num_top_documents))
+        outputs.set_value("most_common_words", id2word.most_common(num_common_words))
+        outputs.set_value("convergence", pa.table(convergence))
+        outputs.set_value("training_settings", training_settings)
+
+    @staticmethod
+    def create_dictionary(tokens_list, no_below, no_above):
+        """Create the gensim dictionary of the corpus, and filter extreme tokens.
+
+        Also used by 'topic_modelling.lda_ensemble', so both modules train on the same vocabulary.
+        """
+
+        from gensim import corpora # type: ignore
 
         try:
             id2word = corpora.Dictionary(tokens_list)
@@ -115,19 +404,162 @@ class RunLda(KiaraModule):
                 )
             id2word.filter_extremes(no_above=no_above)
 
+        return id2word
+
+    @staticmethod
+    def train_pass(model, corpus, pass_no):
+        """Run one training pass over the corpus, with the same learning rate schedule as gensim's own multi-pass training.
+
+        The passes are run one by one, so the model can be evaluated (and checkpointed) in between. gensim decays the learning rate with the
+        number of the pass, and only counts the updates of the first pass, so that is done here for the passes after the first one, and the
+        model is the same as one trained with 'passes' in a single update.
+        """
+
+        # every pass is an update over the same documents, not over new ones
+        model.state.numdocs = 0
+        if pass_no == 0:
+            model.update(corpus)
+            return
+
+        offset = model.offset
+        do_mstep = model.do_mstep
+        model.offset = offset + pass_no
+        model.do_mstep = lambda rho, other, extra_pass=False: do_mstep(rho, other, True)
         try:
-            corpus = [id2word.doc2bow(text) for text in tokens_list]
+            model.update(corpus)
+        finally:
+            model.offset = offset
+            del model.do_mstep
+
+    def create_model(self, id2word, num_topics, workers, chunksize, iterations, eval_every, random_state):
+        """Create an (untrained) gensim LDA model, the serial implementation for a single worker, the multicore one otherwise."""
+
+        import gensim  # type: ignore
+
+        if workers == 1:
+            # the multicore implementation merges worker results in arrival order, so only the serial one is deterministic
+            return gensim.models.ldamodel.LdaModel(id2word=id2word, num_topics=num_topics, random_state=random_state, passes=1, chunksize=chunksize or 2000, iterations=iterations, eval_every=eval_every)
+        return gensim.models.ldamulticore.LdaMulticore(id2word=id2word, num_topics=num_topics, workers=workers, random_state=random_state, passes=1, chunksize=chunksize or 2000, iterations=iterations, eval_every=eval_every)
+
+    def tune(self, corpus, num_topics, num_terms, workers, chunksize, memory_budget, create_model):
+        """Choose the number of workers and the chunksize, unless they are set.
+
+        Every worker holds a copy of the topic-term statistics, so the number of workers is limited by the memory budget. The chunksize is chosen
+        so that every worker gets several chunks per pass, with a bounded number of tokens per chunk. On large corpora, half, the same and twice that
+        chunksize are compared in a short calibration run on a sample of the corpus, and the one with the highest throughput is used.
+
+        Returns the number of workers, the chunksize and the calibration results.
+        """
+
+        import logging
+        import math
+        import os
+        import time
+
+        logger = logging.getLogger(__name__)
+
+        if not memory_budget:
+            try:
+                memory_budget = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20 / 2
+            except (ValueError, OSError, AttributeError):
+                memory_budget = 2048
+
+        if not workers:
+            cores = os.cpu_count() or 1
+            # sufficient statistics and expected log beta (float32), plus the copy of the main process
+            model_mb = 2 * num_topics * num_terms * 4 / 2**20
+            workers = max(1, min(cores - 1, int(memory_budget // max(model_mb, 1e-3)) - 1))
+
+        calibration = []
+        if chunksize:
+            return workers, chunksize, calibration
+
+        num_docs = len(corpus)
+        avg_doc_length = sum(len(doc) for doc in corpus) / max(num_docs, 1)
+        chunksize = math.ceil(num_docs / (workers * 4))
+        chunksize = max(64, min(chunksize, 4000, int(1_000_000 // max(avg_doc_length, 1))))
+
+        candidates = sorted({max(64, chunksize // 2), chunksize, chunksize * 2})
+        sample_size = 2 * workers * max(candidates)
+        if num_docs < MIN_CORPUS_PER_CALIBRATION_SAMPLE * sample_size:
+            logger.info("LDA auto tune: %s workers, chunksize %s (no calibration, corpus too small)", workers, chunksize)
+            return workers, chunksize, calibration
+
+        sample = corpus[:sample_size]
+        for candidate in candidates:
+            model = create_model(workers, candidate)
+            started = time.time()
+            model.update(sample)
+            seconds = time.time() - started
+            calibration.append({"chunksize": candidate, "docs_per_second": len(sample) / seconds if seconds else None})
+
+        best = max(calibration, key=lambda result: result["docs_per_second"] or 0)
+        logger.info("LDA auto tune: %s workers, chunksize %s, calibration: %s", workers, best["chunksize"], calibration)
+        return workers, best["chunksize"], calibration
+
+    def save_checkpoint(self, checkpoint_dir, model, id2word, training_state):
+        """Save the model, the dictionary and the training state to a new 'pass_<n>' folder in the checkpoint directory.
+
+        The folder is written under a temporary name and renamed when complete, older checkpoints are removed afterwards.
+        """
+
+        import json
+        import os
+        import shutil
+
+        passes_done = training_state["passes_done"]
+        target = os.path.join(checkpoint_dir, f"pass_{passes_done}")
+        temp = os.path.join(checkpoint_dir, f".pass_{passes_done}.tmp")
+
+        try:
+            shutil.rmtree(temp, ignore_errors=True)
+            os.makedirs(temp)
+            model.save(os.path.join(temp, "model"))
+            id2word.save(os.path.join(temp, "dictionary"))
+            with open(os.path.join(temp, "training_state.json"), "w", encoding="utf-8") as f:
+                json.dump(training_state, f)
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(temp, target)
         except Exception as e:
             raise KiaraProcessingException(
-                f"Failed to create doc2bow: {e}"
+                f"Failed to save checkpoint to '{checkpoint_dir}': {e}"
             )
-        
+
+        for name in os.listdir(checkpoint_dir):
+            if name.startswith("pass_") and name != f"pass_{passes_done}":
+                shutil.rmtree(os.path.join(checkpoint_dir, name), ignore_errors=True)
+
+    def load_checkpoint(self, checkpoint_dir):
+        """Load the latest checkpoint from the checkpoint directory.
+
+        Returns the model, the dictionary and the training state, or None if there is no checkpoint.
+        """
+
+        import json
+        import os
+
+        import gensim  # type: ignore
+        from gensim import corpora # type: ignore
+
+        if not os.path.isdir(checkpoint_dir):
+            return None
+
+        checkpoints = [
+            int(name[len("pass_"):]) for name in os.listdir(checkpoint_dir)
+            if name.startswith("pass_") and name[len("pass_"):].isdigit()
+        ]
+        if not checkpoints:
+            return None
+
+        path = os.path.join(checkpoint_dir, f"pass_{max(checkpoints)}")
         try:
-            model = gensim.models.ldamulticore.LdaMulticore(corpus, id2word=id2word, num_topics=num_topics, random_state=random_state, passes=passes, chunksize=chunksize, iterations=iterations)
+            model = gensim.models.ldamodel.LdaModel.load(os.path.join(path, "model"))
+            id2word = corpora.Dictionary.load(os.path.join(path, "dictionary"))
+            with open(os.path.join(path, "training_state.json"), encoding="utf-8") as f:
+                training_state = json.load(f)
         except Exception as e:
             raise KiaraProcessingException(
-                f"Failed to run LDA: {e}"
+                f"Failed to load checkpoint from '{path}': {e}"
             )
-        
-        outputs.set_value("topics", model.print_topics(num_words=30))
-        outputs.set_value("most_common_words", id2word.most_common(15))
\ No newline at end of file
+
+        return model, id2word, training_state
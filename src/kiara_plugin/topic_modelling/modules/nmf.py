@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class RunNmf(KiaraModule):
+    """
+    This module creates topics with non-negative matrix factorization (NMF) of the TF-IDF matrix of a tokenized corpus.
+    It is a much faster alternative to 'topic_modelling.lda' for exploratory runs, and returns the same outputs.
+
+    The factorization uses multiplicative updates on float32 matrices, so the dense matrix products run multithreaded in BLAS.
+    """
+
+    _module_type_name = "topic_modelling.nmf"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to process.",
+            },
+            "no_below": {
+                "type": "integer",
+                "doc": "Remove tokens that appear in less than no_below documents.",
+                "optional": True,
+                "default": False
+            },
+            "no_above": {
+                "type": "float",
+                "doc": "Remove tokens that appear in more than no_above documents (fraction of the total number of documents).",
+                "optional": True,
+            },
+            "num_topics": {
+                "type": "integer",
+                "doc": "Number of topics to process.",
+                "optional": False,
+            },
+            "iterations": {
+                "type": "integer",
+                "doc": "Maximum number of iterations.",
+                "optional": True,
+                "default": 200
+            },
+            "tolerance": {
+                "type": "float",
+                "doc": "Stop when the relative improvement of the reconstruction error falls below this value.",
+                "optional": True,
+                "default": 1e-4
+            },
+            "num_words": {
+                "type": "integer",
+                "doc": "Number of top words per topic in the topics and topic_words outputs.",
+                "optional": True,
+                "default": 30
+            },
+            "num_common_words": {
+                "type": "integer",
+                "doc": "Number of most common words overall.",
+                "optional": True,
+                "default": 15
+            },
+            "num_top_documents": {
+                "type": "integer",
+                "doc": "Number of documents with the highest weight per topic in the top_documents output.",
+                "optional": True,
+                "default": 10
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state.",
+                "optional": True,
+                "default": False
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "most_common_words": {
+                "type": "list",
+                "doc": "The most common words overall."
+            },
+            "topics": {
+                "type": "list",
+                "doc": "The topics generated by NMF."
+            },
+            "topic_words": {
+                "type": "table",
+                "doc": "The top words of each topic, in long format (topic_id, rank, term, weight)."
+            },
+            "top_documents": {
+                "type": "table",
+                "doc": "The documents with the highest weight for each topic, in long format (topic_id, rank, doc_id, weight)."
+            },
+            "document_topics": {
+                "type": "table",
+                "doc": "The topic weights of each document, with a 'doc_id' column (position in the tokens array) and one 'topic_<n>' column per topic."
+            },
+            "topic_terms": {
+                "type": "table",
+                "doc": "The weights of all terms of the vocabulary for each topic, with a 'term' column and one 'topic_<n>' column per topic."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import numpy as np
+
+        from kiara_plugin.topic_modelling.utils import (
+            create_doc_term_matrix,
+            create_document_topics_table,
+            create_tfidf_matrix,
+            create_top_documents_table,
+            create_topic_terms_table,
+            create_topic_words_table,
+            filter_vocabulary,
+            format_topic,
+            top_k,
+        )
+
+        tokens_array = inputs.get_value_data("tokens_array")
+        tokens_array_pa = tokens_array.arrow_array
+
+        no_below = inputs.get_value_data("no_below")
+        no_above = inputs.get_value_data("no_above")
+
+        num_topics = inputs.get_value_data("num_topics")
+
+        iterations = inputs.get_value_data("iterations")
+        tolerance = inputs.get_value_data("tolerance")
+        random_state = inputs.get_value_data("random_state")
+        num_words = inputs.get_value_data("num_words")
+        num_common_words = inputs.get_value_data("num_common_words")
+        num_top_documents = inputs.get_value_data("num_top_documents")
+
+        try:
+            counts, vocabulary = create_doc_term_matrix(tokens_array_pa)
+            counts, vocabulary = filter_vocabulary(
+                counts, vocabulary, no_below=no_below, no_above=no_above
+            )
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Failed to create document-term matrix: {e}"
+            )
+
+        if counts.shape[1] == 0:
+            raise KiaraProcessingException(
+                "No terms left in the vocabulary, please check the no_below and no_above values."
+            )
+
+        tfidf = create_tfidf_matrix(counts)
+
+        try:
+            doc_topic, topic_term = self.factorize(
+                tfidf,
+                num_topics=num_topics,
+                iterations=iterations,
+                tolerance=tolerance,
+                random_state=None if random_state is False else random_state,
+            )
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"Failed to run NMF: {e}"
+            )
+
+        topic_weights = topic_term / np.maximum(
+            topic_term.sum(axis=1, keepdims=True), np.finfo(np.float32).tiny
+        )
+        top_terms, top_weights = top_k(topic_weights, num_words)
+        top_terms_list = vocabulary.take(top_terms.ravel()).to_pylist()
+        topics = []
+        for topic_id, weights in enumerate(top_weights):
+            terms = top_terms_list[topic_id * top_terms.shape[1]:(topic_id + 1) * top_terms.shape[1]]
+            topics.append((topic_id, format_topic(terms, weights.tolist())))
+
+        doc_topic = doc_topic / np.maximum(
+            doc_topic.sum(axis=1, keepdims=True), np.finfo(np.float32).tiny
+        )
+
+        term_counts = np.asarray(counts.sum(axis=0)).ravel()
+        most_common, most_common_counts = top_k(term_counts[None, :], num_common_words)
+
+        outputs.set_value("topics", topics)
+        outputs.set_value("topic_words", create_topic_words_table(topic_weights, vocabulary, num_words))
+        outputs.set_value("topic_terms", create_topic_terms_table(topic_weights, vocabulary))
+        outputs.set_value(
+            "most_common_words",
+            list(zip(vocabulary.take(most_common[0]).to_pylist(), most_common_counts[0].astype(int).tolist())),
+        )
+        outputs.set_value("document_topics", create_document_topics_table(doc_topic))
+        outputs.set_value("top_documents", create_top_documents_table(doc_topic, num_top_documents))
+
+    def factorize(self, matrix, num_topics, iterations, tolerance, random_state):
+        """Factorize a sparse non-negative matrix with multiplicative updates (Frobenius norm).
+
+        Returns the (documents x topics) and (topics x terms) matrices.
+        """
+
+        import numpy as np
+
+        eps = np.finfo(np.float32).eps
+        rng = np.random.default_rng(random_state)
+        num_docs, num_terms = matrix.shape
+
+        scale = np.sqrt(matrix.mean() / num_topics)
+        doc_topic = (scale * rng.random((num_docs, num_topics))).astype(np.float32)
+        topic_term = (scale * rng.random((num_topics, num_terms))).astype(np.float32)
+
+        matrix_t = matrix.T.tocsr()
+        squared_norm = float(matrix.multiply(matrix).sum())
+        previous_error = None
+
+        for iteration in range(iterations):
+            # the sparse products are computed once per update, everything else is dense BLAS
+            numerator = (matrix_t @ doc_topic).T
+            denominator = (doc_topic.T @ doc_topic) @ topic_term
+            topic_term *= numerator / np.maximum(denominator, eps)
+
+            numerator = matrix @ topic_term.T
+            topic_gram = topic_term @ topic_term.T
+            denominator = doc_topic @ topic_gram
+            doc_topic *= numerator / np.maximum(denominator, eps)
+
+            if iteration % 10 == 0 or iteration == iterations - 1:
+                # ||X - WH||^2 = ||X||^2 - 2 tr(W^T X H^T) + tr(W^T W H H^T)
+                error = (
+                    squared_norm
+                    - 2 * float(np.sum(doc_topic * numerator))
+                    + float(np.sum((doc_topic.T @ doc_topic) * topic_gram))
+                )
+                error = np.sqrt(max(error, 0.0))
+                if previous_error is not None and (previous_error - error) < tolerance * previous_error:
+                    break
+                previous_error = error
+
+        return doc_topic, topic_term
@@ -3,6 +3,178 @@ from kiara.api import KiaraModule
 from kiara.exceptions import KiaraProcessingException
 
 
+class CleanText(KiaraModule):
+    """
+    This module cleans an array of raw (OCR) texts before tokenization.
+    It normalizes the text to Unicode NFC, removes control characters, joins words that are hyphenated across line breaks,
+    removes configurable junk patterns (for example page furniture), and collapses repeated whitespace.
+
+    All rules are regular expression kernels of pyarrow.compute that run over whole slices of the array, the slices are cleaned in parallel threads.
+    The exception is the Unicode normalization with pyarrow versions whose 'utf8_normalize' kernel always decomposes the text (pyarrow 15 does):
+    there the texts that are not pure ASCII are normalized one by one in Python, which is considerably slower on large corpora.
+    The cleaning report lists how many characters each rule removed.
+    """
+
+    _module_type_name = "topic_modelling.clean_text"
+
+    def create_inputs_schema(self):
+        return {
+            "corpus_array": {
+                "type": "array",
+                "doc": "Array that contains the text to clean.",
+            },
+            "normalize_unicode": {
+                "type": "boolean",
+                "doc": "Normalize the text to Unicode NFC (in Python, for the non-ASCII texts, with pyarrow versions that can't compose the text).",
+                "optional": True,
+                "default": True
+            },
+            "remove_control_characters": {
+                "type": "boolean",
+                "doc": "Remove control characters (except tabs and line breaks) and soft hyphens.",
+                "optional": True,
+                "default": True
+            },
+            "dehyphenate": {
+                "type": "boolean",
+                "doc": "Join words that are hyphenated across a line break.",
+                "optional": True,
+                "default": True
+            },
+            "junk_patterns": {
+                "type": "list",
+                "doc": "List of regular expressions (RE2 syntax) to remove from the text, e.g. page headers.",
+                "optional": True,
+            },
+            "collapse_whitespace": {
+                "type": "boolean",
+                "doc": "Replace runs of whitespace (including line breaks) with a single space, and trim the text.",
+                "optional": True,
+                "default": True
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "corpus_array": {
+                "type": "array",
+                "doc": "The cleaned array."
+            },
+            "cleaning_report": {
+                "type": "table",
+                "doc": "The number of characters removed by each rule (columns: rule, pattern, characters_removed)."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import iter_batches
+
+        corpus_array = inputs.get_value_data("corpus_array")
+        corpus_array_pa = corpus_array.arrow_array
+
+        junk_patterns = inputs.get_value_data("junk_patterns")
+        junk_patterns = list(junk_patterns) if junk_patterns else []
+
+        rules = []
+        if inputs.get_value_data("normalize_unicode"):
+            rules.append(("normalize_unicode", "NFC"))
+        if inputs.get_value_data("remove_control_characters"):
+            rules.append(("remove_control_characters", r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\x{AD}]"))
+        if inputs.get_value_data("dehyphenate"):
+            rules.append(("dehyphenate", r"(\pL)-[ \t]*\r?\n[ \t]*(\pL)"))
+        for pattern in junk_patterns:
+            rules.append(("junk_pattern", pattern))
+        if inputs.get_value_data("collapse_whitespace"):
+            rules.append(("collapse_whitespace", r"\s+"))
+
+        # the kernels release the GIL, so the slices are cleaned in parallel threads
+        try:
+            with ThreadPoolExecutor(max_workers=pa.cpu_count()) as executor:
+                results = list(executor.map(
+                    lambda batch: self.clean(batch, rules),
+                    iter_batches(corpus_array_pa, 100_000),
+                ))
+        except pa.ArrowInvalid as e:
+            raise KiaraProcessingException(f"Invalid cleaning pattern: {e}")
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to clean the corpus: {e}")
+
+        cleaned = pa.chunked_array([r[0] for r in results], type=pa.large_string())
+        removed = [sum(r[1][i] for r in results) for i in range(len(rules))]
+
+        report = pa.table({
+            "rule": pa.array([rule for rule, _ in rules], type=pa.string()),
+            "pattern": pa.array([pattern for _, pattern in rules], type=pa.string()),
+            "characters_removed": pa.array(removed, type=pa.int64()),
+        })
+
+        outputs.set_value("corpus_array", cleaned)
+        outputs.set_value("cleaning_report", report)
+
+    def clean(self, texts, rules):
+        """Apply the cleaning rules to an array of texts.
+
+        Returns the cleaned texts, and for each rule the number of characters it removed.
+        """
+
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        def num_characters(array):
+            return pc.sum(pc.utf8_length(array)).as_py() or 0
+
+        texts = texts.cast(pa.large_string())
+        length = num_characters(texts)
+
+        removed = []
+        for rule, pattern in rules:
+            if rule == "normalize_unicode":
+                texts = self.normalize_unicode(texts, form=pattern)
+            elif rule == "dehyphenate":
+                texts = pc.replace_substring_regex(texts, pattern=pattern, replacement=r"\1\2")
+            elif rule == "collapse_whitespace":
+                texts = pc.utf8_trim_whitespace(
+                    pc.replace_substring_regex(texts, pattern=pattern, replacement=" ")
+                )
+            else:
+                texts = pc.replace_substring_regex(texts, pattern=pattern, replacement="")
+
+            new_length = num_characters(texts)
+            removed.append(length - new_length)
+            length = new_length
+
+        return texts, removed
+
+    def normalize_unicode(self, texts, form):
+        """Normalize an array of texts to the given Unicode normalization form.
+
+        Some pyarrow versions ignore the form of 'utf8_normalize' (and always decompose), there is no vectorized way to compose the text with them.
+        In that case the texts are normalized with Python's unicodedata, only the ones that are not pure ASCII though, as ASCII texts are
+        normalized in every form.
+        """
+
+        import unicodedata
+
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        probe = pc.utf8_normalize(pa.array(["A\u0300"]), form=form)[0].as_py()
+        if probe == unicodedata.normalize(form, "A\u0300"):
+            return pc.utf8_normalize(texts, form=form)
+
+        non_ascii = pc.invert(pc.fill_null(pc.string_is_ascii(texts), True))
+        normalized = pa.array(
+            [unicodedata.normalize(form, text) for text in texts.filter(non_ascii).to_pylist()],
+            type=pa.large_string(),
+        )
+        return pc.replace_with_mask(texts, non_ascii, normalized)
+
+
 class TokenizeArray(KiaraModule):
     """
     This module creates tokens from an array or from a table.
@@ -40,14 +212,14 @@ class TokenizeArray(KiaraModule):
     def process(self, inputs, outputs):
 
         import nltk  # type: ignore
-        import pyarrow as pa  # type: ignore
         from nltk.tokenize.simple import CharTokenizer  # type: ignore
 
+        from kiara_plugin.topic_modelling.utils import create_tokens_array, iter_batches
+
         nltk.download("punkt")
 
         corpus_array = inputs.get_value_data("corpus_array")
         corpus_array_pa = corpus_array.arrow_array
-        corpus_list = corpus_array_pa.to_pylist()
 
         def tokenize(text: str, tokenize_by_character:bool = False):
             if not tokenize_by_character:
@@ -62,10 +234,13 @@ class TokenizeArray(KiaraModule):
                 except Exception:
                     return None
 
+        # the tokens are converted to Arrow batch by batch, so only one batch of Python lists is held in memory
         if not inputs.get_value_data("tokenize_by_character"):
             try:
-                tokenized_list = [tokenize(str(x)) for x in corpus_list]
-                tokens_array = pa.array(tokenized_list)
+                tokens_array = create_tokens_array(
+                    [tokenize(str(x)) for x in batch.to_pylist()]
+                    for batch in iter_batches(corpus_array_pa)
+                )
 
             except Exception as e:
                 raise KiaraProcessingException(
@@ -73,8 +248,10 @@ class TokenizeArray(KiaraModule):
                 )
         else:
             try:
-                tokenized_list = [tokenize(str(x), tokenize_by_character=True) for x in corpus_list]
-                tokens_array = pa.array(tokenized_list)
+                tokens_array = create_tokens_array(
+                    [tokenize(str(x), tokenize_by_character=True) for x in batch.to_pylist()]
+                    for batch in iter_batches(corpus_array_pa)
+                )
 
             except Exception as e:
                 raise KiaraProcessingException(
@@ -132,52 +309,52 @@ class PreprocessTokens(KiaraModule):
         }
 
     def process(self, inputs, outputs):
-        import polars as pl # type: ignore
-        import pyarrow as pa # type: ignore
+        import pyarrow.compute as pc # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import transform_tokens
 
         tokens_array = inputs.get_value_data("tokens_array")
         tokens_array_pa = tokens_array.arrow_array
-        
-        tokens_list = tokens_array_pa.to_pylist()
 
         do_lowercase = inputs.get_value_data("lowercase")
         do_isalpha = inputs.get_value_data("isalpha")
         do_isdigit = inputs.get_value_data("isdigit")
         min_length = inputs.get_value_data("min_length")
 
-        def preprocess_token(token):
-            if not isinstance(token, str):
-                token = str(token)
-            
+        def preprocess_tokens(tokens):
             if do_lowercase:
-                token = token.lower()
-            
-            if do_isalpha and not token.isalpha():
-                return None
-            
-            if do_isdigit and not token.isdigit():
-                return None
-            
-            if min_length and len(token) < min_length:
-                return None
-            
-            return token
-
-        def process_nested(item):
-            if isinstance(item, list):
-                return [y for y in (process_nested(subitem) for subitem in item) if y is not None]
-            else:
-                return preprocess_token(item)
+                tokens = pc.utf8_lower(tokens)
+
+            keep = None
+
+            def combine(mask):
+                return mask if keep is None else pc.and_(keep, mask)
 
+            if do_isalpha:
+                keep = combine(pc.utf8_is_alpha(tokens))
 
-        processed_tokens = process_nested(tokens_list)
-        processed_array = pa.array(processed_tokens)
+            if do_isdigit:
+                keep = combine(pc.utf8_is_digit(tokens))
+
+            if min_length:
+                keep = combine(pc.greater_equal(pc.utf8_length(tokens), min_length))
+
+            return tokens, keep
+
+        try:
+            processed_array = transform_tokens(tokens_array_pa, preprocess_tokens)
+        except Exception as e:
+            raise KiaraProcessingException(
+                f"An error occurred while pre-processing the tokens: {e}."
+            )
 
         outputs.set_value("tokens_array", processed_array)
 
 class GetBigrams(KiaraModule):
     """
     This module creates bigrams in a tokenized corpus.
+    The learned phrases of the frozen phrase model are returned as a table as well, so they can be applied to new documents with 'topic_modelling.apply_phrases'
+    without training the model again.
 
     """
 
@@ -208,18 +385,21 @@ class GetBigrams(KiaraModule):
             "tokens_array": {
                 "type": "array",
                 "doc": "The array that contains the pre-processed tokens."
+            },
+            "phrase_model": {
+                "type": "table",
+                "doc": "The phrases of the frozen gensim phrase model (phrase, score), with the words of the phrases joined by '_'."
             }
         }
 
     def process(self, inputs, outputs):
-        import polars as pl # type: ignore
-        import pyarrow as pa # type: ignore
         import gensim # type: ignore
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import create_tokens_array, iter_batches
 
         tokens_array = inputs.get_value_data("tokens_array")
         tokens_array_pa = tokens_array.arrow_array
-        
-        tokens_list = tokens_array_pa.to_pylist()
 
         threshold = inputs.get_value_data("threshold")
         min_count = inputs.get_value_data("min_count")
@@ -230,11 +410,538 @@ class GetBigrams(KiaraModule):
         if min_count is not None:
             phrase_kwargs['min_count'] = min_count
 
-        bigram = gensim.models.Phrases(tokens_list, **phrase_kwargs)
+        def iter_docs():
+            for batch in iter_batches(tokens_array_pa):
+                yield from batch.to_pylist()
+
+        bigram = gensim.models.Phrases(iter_docs(), **phrase_kwargs)
         bigram_mod = gensim.models.phrases.Phraser(bigram)
 
-        processed_bigrams = [bigram_mod[doc] for doc in tokens_list]
+        processed_array = create_tokens_array(
+            [bigram_mod[doc] for doc in batch.to_pylist()]
+            for batch in iter_batches(tokens_array_pa)
+        )
+
+        # the frozen model only merges the phrases that score above its threshold
+        phrases = {
+            phrase: score for phrase, score in bigram_mod.phrasegrams.items() if score > bigram_mod.threshold
+        }
+        phrase_table = pa.table({
+            "phrase": pa.array(sorted(phrases), type=pa.large_string()),
+            "score": pa.array([float(phrases[phrase]) for phrase in sorted(phrases)], type=pa.float64()),
+        })
+
+        outputs.set_value("tokens_array", processed_array)
+        outputs.set_value("phrase_model", phrase_table)
+
+
+class SegmentTokens(KiaraModule):
+    """
+    This module splits the documents of a tokens array into pseudo-documents of (at most) 'segment_length' tokens, so that very long and very short documents
+    weigh more evenly in topic modelling. Without a 'step', the segments don't overlap; with a 'step' smaller than 'segment_length', they are sliding windows
+    that start every 'step' tokens (the last window of a document ends at the end of the document).
+
+    The segments are created by computing new list offsets for the tokens, so non-overlapping segments share the token data of the input array.
+    The segments table links every segment to its parent document, so results can be aggregated back onto the rows of the corpus table.
+    Empty and null documents are kept as a single (empty or null) segment.
+    """
+
+    _module_type_name = "topic_modelling.segment_tokens"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to segment.",
+            },
+            "segment_length": {
+                "type": "integer",
+                "doc": "Maximum number of tokens per segment.",
+                "optional": True,
+                "default": 1000
+            },
+            "step": {
+                "type": "integer",
+                "doc": "Number of tokens between the starts of sliding windows. If not set, segments don't overlap.",
+                "optional": True,
+            },
+            "min_segment_length": {
+                "type": "integer",
+                "doc": "Without a step, the last segment of a document is merged into the previous segment if it is shorter than this.",
+                "optional": True,
+                "default": 0
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "The array that contains the tokens of each segment."
+            },
+            "segments": {
+                "type": "table",
+                "doc": "For each segment, its parent document (row index in the input array and the corpus table), its index within the parent document, the position of its first token, and its number of tokens (parent_doc_id, segment_id, start, num_tokens)."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import get_tokens_type
+
+        tokens_array = inputs.get_value_data("tokens_array")
+        tokens_array_pa = tokens_array.arrow_array
+
+        segment_length = inputs.get_value_data("segment_length")
+        step = inputs.get_value_data("step")
+        min_segment_length = inputs.get_value_data("min_segment_length")
+
+        if segment_length < 1:
+            raise KiaraProcessingException(f"Invalid segment length '{segment_length}', needs to be at least 1.")
+        if step is not None and not 0 < step <= segment_length:
+            raise KiaraProcessingException(
+                f"Invalid step '{step}', needs to be at least 1 and at most the segment length ({segment_length})."
+            )
+
+        chunks = [tokens_array_pa] if isinstance(tokens_array_pa, pa.Array) else tokens_array_pa.chunks
+
+        segment_chunks = []
+        segment_tables = []
+        row_offset = 0
+        for chunk in chunks:
+            tokens_chunk = chunk.cast(get_tokens_type())
+            try:
+                segments, table = self.segment(tokens_chunk, segment_length, step, min_segment_length)
+            except Exception as e:
+                raise KiaraProcessingException(f"Failed to segment the tokens: {e}")
+            segment_chunks.append(segments)
+            segment_tables.append(
+                table.set_column(0, "parent_doc_id", pa.array(table.column("parent_doc_id").to_numpy() + row_offset))
+            )
+            row_offset += len(tokens_chunk)
+
+        schema = pa.schema([
+            ("parent_doc_id", pa.int64()), ("segment_id", pa.int32()), ("start", pa.int64()), ("num_tokens", pa.int64())
+        ])
+        outputs.set_value("tokens_array", pa.chunked_array(segment_chunks, type=get_tokens_type()))
+        outputs.set_value("segments", pa.concat_tables(segment_tables) if segment_tables else schema.empty_table())
+
+    def segment(self, chunk, segment_length, step, min_segment_length):
+        """Split the token lists of an array into segments, by computing the offsets of the segments.
+
+        Returns the segments array, and the segments table (with parent document ids relative to the chunk).
+        """
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        offsets = chunk.offsets.to_numpy().astype(np.int64)
+        doc_starts = offsets[:-1]
+        doc_ends = offsets[1:]
+        lengths = doc_ends - doc_starts
+        is_null = chunk.is_null().to_numpy(zero_copy_only=False)
+
+        if step is None:
+            num_segments = np.maximum(1, -(-lengths // segment_length))
+            # a short last segment is merged into the previous one
+            remainder = lengths - (num_segments - 1) * segment_length
+            num_segments -= (num_segments > 1) & (remainder < min_segment_length)
+        else:
+            num_segments = np.where(lengths > segment_length, -(-(lengths - segment_length) // step) + 1, 1)
+        num_segments[is_null] = 1
+
+        parents = np.repeat(np.arange(len(chunk), dtype=np.int64), num_segments)
+        first_segment = np.cumsum(num_segments) - num_segments
+        segment_ids = np.arange(len(parents), dtype=np.int64) - np.repeat(first_segment, num_segments)
+        last = segment_ids == num_segments[parents] - 1
+
+        if step is None:
+            starts = segment_ids * segment_length
+            ends = np.where(last, lengths[parents], starts + segment_length)
+        else:
+            starts = np.where(last, np.maximum(lengths[parents] - segment_length, 0), segment_ids * step)
+            ends = np.minimum(starts + segment_length, lengths[parents])
+        starts[is_null[parents]] = 0
+        ends[is_null[parents]] = lengths[parents][is_null[parents]]
+
+        segment_lengths = ends - starts
+        mask = pa.array(is_null[parents]) if chunk.null_count else None
+        if step is None:
+            # the segments tile the documents, so the token data is shared with the input
+            segment_offsets = np.append(doc_starts[parents] + starts, offsets[-1])
+            segments = pa.LargeListArray.from_arrays(pa.array(segment_offsets), chunk.values, mask=mask)
+        else:
+            segment_offsets = np.zeros(len(parents) + 1, dtype=np.int64)
+            np.cumsum(segment_lengths, out=segment_offsets[1:])
+            indices = (
+                np.arange(segment_offsets[-1], dtype=np.int64)
+                - np.repeat(segment_offsets[:-1], segment_lengths)
+                + np.repeat(doc_starts[parents] + starts, segment_lengths)
+            )
+            segments = pa.LargeListArray.from_arrays(
+                pa.array(segment_offsets), chunk.values.take(pa.array(indices)), mask=mask
+            )
+
+        table = pa.table({
+            "parent_doc_id": pa.array(parents),
+            "segment_id": pa.array(segment_ids.astype(np.int32)),
+            "start": pa.array(starts),
+            "num_tokens": pa.array(np.where(is_null[parents], 0, segment_lengths)),
+        })
+        return segments, table
+
 
-        processed_array = pa.array(processed_bigrams)
+PHRASE_DELIMITER = "_"
+
+# the phrases of the phrase model, only set in worker processes, by their initializer
+_phrase_worker_state: dict = {}
+
+
+def _init_phrase_worker(phrases):
+    """Keep the phrases of the phrase model in a worker process."""
+
+    _phrase_worker_state["phrases"] = phrases
+
+
+def _merge_phrases(batch, phrases):
+    """Merge the phrases of a batch of token lists, the same way gensim's frozen phrase model does.
+
+    Pairs of consecutive tokens of a document are merged from left to right: a pair that is a phrase is merged, unless its first token was
+    already merged with the token before it. In a run of consecutive phrase pairs, that means every other pair, starting with the first.
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+
+    from kiara_plugin.topic_modelling.utils import transform_tokens
+
+    delimiter = pa.scalar(PHRASE_DELIMITER, type=pa.large_string())
+
+    def merge(tokens, doc_ids):
+        if len(tokens) < 2:
+            return tokens, None
+
+        pairs = pc.binary_join_element_wise(tokens.slice(0, len(tokens) - 1), tokens.slice(1), delimiter)
+        is_phrase = pc.fill_null(pc.is_in(pairs, value_set=phrases), False).to_numpy(zero_copy_only=False)
+        is_phrase &= doc_ids[1:] == doc_ids[:-1]
+
+        # position of every pair within its run of consecutive phrase pairs
+        positions = np.arange(len(is_phrase))
+        run_starts = is_phrase & ~np.r_[False, is_phrase[:-1]]
+        run_offsets = positions - np.maximum.accumulate(np.where(run_starts, positions, 0))
+        merged = np.r_[is_phrase & (run_offsets % 2 == 0), False]
+
+        values = pc.if_else(pa.array(merged), pa.concat_arrays([pairs, pa.nulls(1, pa.large_string())]), tokens)
+        keep = ~np.r_[False, merged[:-1]]
+        return values, pa.array(keep)
+
+    return transform_tokens(batch, merge, with_doc_ids=True).combine_chunks()
+
+
+def _merge_phrases_worker(batch):
+    """Merge the phrases of a batch of token lists (runs in worker processes)."""
+
+    return _merge_phrases(batch, _phrase_worker_state["phrases"])
+
+
+class ApplyPhrases(KiaraModule):
+    """
+    This module merges the phrases of a phrase model created by 'topic_modelling.get_bigrams' into an array of tokens, for example to process newly arriving documents.
+    The phrase model is not trained again, the batches of documents are processed in parallel worker processes.
+
+    """
+
+    _module_type_name = "topic_modelling.apply_phrases"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens.",
+            },
+            "phrase_model": {
+                "type": "table",
+                "doc": "The phrase model created by 'topic_modelling.get_bigrams', with a 'phrase' column.",
+            },
+            "workers": {
+                "type": "integer",
+                "doc": "Number of worker processes. Defaults to the number of cores.",
+                "optional": True,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "The array that contains the tokens with merged phrases."
+            }
+        }
+
+    def process(self, inputs, outputs):
+        import os
+        from concurrent.futures import ProcessPoolExecutor
+
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import get_tokens_type, iter_batches
+
+        tokens_array = inputs.get_value_data("tokens_array")
+        tokens_array_pa = tokens_array.arrow_array
+
+        phrase_model: pa.Table = inputs.get_value_data("phrase_model").arrow_table
+        workers = inputs.get_value_data("workers") or os.cpu_count() or 1
+
+        if "phrase" not in phrase_model.column_names:
+            raise KiaraProcessingException(
+                f"The phrase model needs a 'phrase' column, but only has: {', '.join(phrase_model.column_names)}"
+            )
+        phrases = phrase_model.column("phrase").combine_chunks().cast(pa.large_string())
+
+        batches = list(iter_batches(tokens_array_pa))
+
+        try:
+            if workers == 1 or len(batches) <= 1:
+                chunks = [_merge_phrases(batch, phrases) for batch in batches]
+            else:
+                # the phrases are sent to every worker once, the batches as Arrow arrays
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_phrase_worker,
+                    initargs=(phrases,),
+                ) as executor:
+                    chunks = list(executor.map(_merge_phrases_worker, batches))
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to apply the phrase model: {e}")
+
+        outputs.set_value("tokens_array", pa.chunked_array(chunks, type=get_tokens_type()))
+
+
+def _normalize_terms(method: str, language: str, terms):
+    """Stem or lemmatize a list of unique terms (runs in worker processes)."""
+
+    if method == "snowball":
+        from nltk.stem.snowball import SnowballStemmer  # type: ignore
+
+        stemmer = SnowballStemmer(language)
+        return [stemmer.stem(term) for term in terms]
+    else:
+        from nltk.stem import WordNetLemmatizer  # type: ignore
+
+        lemmatizer = WordNetLemmatizer()
+        return [lemmatizer.lemmatize(term) for term in terms]
+
+
+class NormalizeTokens(KiaraModule):
+    """
+    This module stems (NLTK Snowball stemmer) or lemmatizes (NLTK WordNet lemmatizer, English only) an array of tokens.
+
+    Every unique term is normalized only once: the vocabulary of the tokens is computed first, the new terms are normalized in a process pool,
+    and the results are mapped back to the tokens through their term ids. If a cache directory is provided, normalized terms are stored there and reused
+    across runs, so the work scales with the number of new terms, not with the size of the corpus. The cache keeps the most recently used terms,
+    up to 'max_cache_terms'.
+
+    Dependencies:
+    - NLTK: https://www.nltk.org/
+    """
+
+    _module_type_name = "topic_modelling.normalize_tokens"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to normalize.",
+            },
+            "method": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["snowball", "wordnet"]},
+                "doc": "Normalization method: stemming with 'snowball', or lemmatization with 'wordnet'.",
+                "optional": True,
+                "default": "snowball"
+            },
+            "language": {
+                "type": "string",
+                "doc": "Language of the Snowball stemmer, e.g. 'italian' or 'english'.",
+                "optional": True,
+                "default": "english"
+            },
+            "cache_dir": {
+                "type": "string",
+                "doc": "Local directory to keep the normalized terms in, to reuse them across runs.",
+                "optional": True,
+            },
+            "max_cache_terms": {
+                "type": "integer",
+                "doc": "Maximum number of terms to keep in the cache. The terms that were used least recently are removed first.",
+                "optional": True,
+                "default": 1000000
+            },
+            "workers": {
+                "type": "integer",
+                "doc": "Number of worker processes. Defaults to the number of cores.",
+                "optional": True,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "The array that contains the normalized tokens."
+            }
+        }
+
+    def process(self, inputs, outputs):
+        import os
+
+        import pyarrow as pa # type: ignore
+        import pyarrow.compute as pc # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens
+
+        tokens_array = inputs.get_value_data("tokens_array")
+        tokens_array_pa = tokens_array.arrow_array
+
+        method = inputs.get_value_data("method")
+        language = inputs.get_value_data("language")
+        cache_dir = inputs.get_value_data("cache_dir")
+        max_cache_terms = inputs.get_value_data("max_cache_terms")
+        workers = inputs.get_value_data("workers")
+
+        if max_cache_terms < 0:
+            raise KiaraProcessingException(f"Invalid maximum number of cached terms '{max_cache_terms}', needs to be at least 0.")
+
+        if method == "snowball":
+            from nltk.stem.snowball import SnowballStemmer  # type: ignore
+
+            if language not in SnowballStemmer.languages:
+                raise KiaraProcessingException(
+                    f"Language '{language}' not supported by the Snowball stemmer, use one of: {', '.join(SnowballStemmer.languages)}"
+                )
+        else:
+            import nltk  # type: ignore
+
+            nltk.download("wordnet", quiet=True)
+            language = "english"
+
+        flat_tokens, _ = flatten_tokens(tokens_array_pa)
+        vocabulary, term_ids = encode_tokens(flat_tokens)
+        vocabulary = vocabulary.cast(pa.large_string())
+
+        cache_file = os.path.join(cache_dir, f"{method}_{language}.arrow") if cache_dir else None
+        cached = self.load_cache(cache_file)
+
+        # the vocabulary of this run is looked up in the cache once; only terms that are not in the cache yet are normalized
+        cache_index = pc.index_in(vocabulary, value_set=cached.column("term"))
+        is_new = pc.is_null(cache_index)
+        new_terms = vocabulary.filter(is_new).to_pylist()
+
+        try:
+            normalized_new_terms = self.normalize(method, language, new_terms, workers)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to normalize the tokens: {e}")
+
+        # the normalized form of every term of the vocabulary, in vocabulary order
+        normalized = pc.replace_with_mask(
+            cached.column("normalized").combine_chunks().take(cache_index),
+            is_new,
+            pa.array(normalized_new_terms, type=pa.large_string()),
+        )
+
+        if cache_file:
+            # the terms of this run go first, so the least recently used terms are pruned
+            older = cached.filter(pc.invert(pc.is_in(cached.column("term"), value_set=vocabulary)))
+            self.save_cache(cache_file, pa.concat_tables([
+                pa.table({"term": vocabulary, "normalized": normalized}),
+                older,
+            ]).slice(0, max_cache_terms))
+
+        try:
+            normalized_array = self.map_terms(tokens_array_pa, normalized, term_ids)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to map the normalized terms to the tokens: {e}")
+
+        outputs.set_value("tokens_array", normalized_array)
+
+    def map_terms(self, tokens_array, normalized, term_ids):
+        """Replace every token by the normalized form of its term, chunk by chunk, keeping the documents of the tokens array."""
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        chunks = [tokens_array] if isinstance(tokens_array, pa.Array) else tokens_array.chunks
+
+        result = []
+        position = 0
+        for chunk in chunks:
+            num_tokens = len(chunk.flatten())
+            chunk_term_ids = term_ids[position:position + num_tokens]
+            position += num_tokens
+            # null tokens have the term id -1, and stay null
+            values = normalized.take(pa.array(chunk_term_ids, mask=chunk_term_ids < 0))
+
+            # offsets of the flattened tokens (null lists have no tokens)
+            offsets = np.zeros(len(chunk) + 1, dtype=np.int64)
+            np.cumsum(pc.fill_null(pc.list_value_length(chunk), 0).to_numpy(zero_copy_only=False), out=offsets[1:])
+            result.append(
+                pa.LargeListArray.from_arrays(pa.array(offsets), values, mask=chunk.is_null() if chunk.null_count else None)
+            )
+
+        return pa.chunked_array(result, type=result[0].type if result else pa.large_list(pa.large_string()))
+
+    def normalize(self, method, language, terms, workers):
+        """Normalize unique terms, in a process pool for larger vocabularies."""
+
+        import os
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        batch_size = 50_000
+        if workers == 1 or len(terms) <= batch_size:
+            return _normalize_terms(method, language, terms)
+
+        batches = [terms[i:i + batch_size] for i in range(0, len(terms), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _normalize_terms, [method] * len(batches), [language] * len(batches), batches
+            )
+            return [term for batch in results for term in batch]
+
+    def load_cache(self, cache_file):
+        """Load the cached normalized terms, as a table with a 'term' and a 'normalized' column."""
+
+        import os
+
+        import pyarrow as pa # type: ignore
+
+        schema = pa.schema([("term", pa.large_string()), ("normalized", pa.large_string())])
+        if not cache_file or not os.path.exists(cache_file):
+            return schema.empty_table()
+
+        try:
+            with pa.memory_map(cache_file) as source:
+                return pa.ipc.open_file(source).read_all().cast(schema)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to load the term cache '{cache_file}': {e}")
+
+    def save_cache(self, cache_file, cached):
+        """Write the cached normalized terms to a temporary file, and replace the cache file with it."""
+
+        import os
+
+        import pyarrow as pa # type: ignore
 
-        outputs.set_value("tokens_array", processed_array)
\ No newline at end of file
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = f"{cache_file}.tmp"
+        try:
+            with pa.OSFile(temp_file, "wb") as sink:
+                with pa.ipc.new_file(sink, cached.schema) as writer:
+                    writer.write_table(cached)
+            os.replace(temp_file, cache_file)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to save the term cache '{cache_file}': {e}")
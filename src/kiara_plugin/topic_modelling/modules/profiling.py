@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class ProfileCorpus(KiaraModule):
+    """
+    This module profiles a tokenized corpus, to help choosing the filtering settings of the pre-processing and modelling modules before running them.
+
+    It returns summary statistics (number of documents and tokens, vocabulary size, hapax legomena, document length percentiles), a Heaps-law
+    vocabulary growth curve, a Zipf rank-frequency table, and tables that predict how much the vocabulary would shrink with different values of
+    'no_below' and 'no_above' ('topic_modelling.lda', 'topic_modelling.nmf'), 'min_length' ('topic_modelling.preprocess_tokens'),
+    and how many phrases 'topic_modelling.get_bigrams' would find with different values of 'min_count' and 'threshold'.
+
+    All statistics are computed in one vectorized pass over the encoded tokens, optionally on a random sample of the documents.
+    """
+
+    _module_type_name = "topic_modelling.corpus_profile"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens to profile.",
+            },
+            "sample_fraction": {
+                "type": "float",
+                "doc": "Fraction of the documents to profile, drawn at random. If not set, all documents are profiled.",
+                "optional": True,
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state for the sample.",
+                "optional": True,
+                "default": 0
+            },
+            "num_terms": {
+                "type": "integer",
+                "doc": "Number of most frequent terms in the Zipf table.",
+                "optional": True,
+                "default": 1000
+            },
+            "no_below_values": {
+                "type": "list",
+                "doc": "The no_below values (minimum number of documents) to predict the vocabulary size for.",
+                "optional": True,
+                "default": [1, 2, 3, 5, 10, 20, 50, 100]
+            },
+            "no_above_values": {
+                "type": "list",
+                "doc": "The no_above values (maximum fraction of documents) to predict the vocabulary size for.",
+                "optional": True,
+                "default": [0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+            },
+            "min_length_values": {
+                "type": "list",
+                "doc": "The min_length values (minimum number of characters) to predict the vocabulary size for.",
+                "optional": True,
+                "default": [1, 2, 3, 4, 5, 6]
+            },
+            "min_count_values": {
+                "type": "list",
+                "doc": "The min_count values of the phrase detection to predict the number of phrases for.",
+                "optional": True,
+                "default": [2, 5, 10, 20]
+            },
+            "threshold_values": {
+                "type": "list",
+                "doc": "The threshold values of the phrase detection to predict the number of phrases for.",
+                "optional": True,
+                "default": [1, 5, 10, 50, 100]
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "summary": {
+                "type": "dict",
+                "doc": "Summary statistics of the corpus, including the fitted Heaps-law parameters (vocabulary_size = heaps_k * num_tokens ^ heaps_beta)."
+            },
+            "document_lengths": {
+                "type": "table",
+                "doc": "Percentiles of the number of tokens per document (percentile, length)."
+            },
+            "heaps_curve": {
+                "type": "table",
+                "doc": "The vocabulary size after a growing number of tokens (num_tokens, vocabulary_size)."
+            },
+            "zipf_table": {
+                "type": "table",
+                "doc": "The most frequent terms (rank, term, frequency, relative_frequency, document_frequency)."
+            },
+            "filter_predictions": {
+                "type": "table",
+                "doc": "The predicted vocabulary size and share of kept tokens for each filter setting (filter, value, vocabulary_size, vocabulary_share, token_share)."
+            },
+            "phrase_predictions": {
+                "type": "table",
+                "doc": "The predicted number of phrases for each combination of min_count and threshold (min_count, threshold, num_phrases)."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+        from scipy import sparse  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens, top_k
+
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+        sample_fraction = inputs.get_value_data("sample_fraction")
+        random_state = inputs.get_value_data("random_state")
+        num_terms = inputs.get_value_data("num_terms")
+
+        if sample_fraction is not None:
+            if not 0 < sample_fraction <= 1:
+                raise KiaraProcessingException(
+                    f"Invalid sample fraction '{sample_fraction}', needs to be larger than 0 and at most 1."
+                )
+            rng = np.random.default_rng(random_state)
+            num_sampled = max(1, int(round(len(tokens_array_pa) * sample_fraction)))
+            sampled = np.sort(rng.choice(len(tokens_array_pa), size=num_sampled, replace=False))
+            tokens_array_pa = tokens_array_pa.take(pa.array(sampled))
+
+        num_docs = len(tokens_array_pa)
+        if num_docs == 0:
+            raise KiaraProcessingException("The tokens array is empty.")
+
+        flat_tokens, doc_ids = flatten_tokens(tokens_array_pa)
+        vocabulary, term_ids = encode_tokens(flat_tokens)
+
+        valid = term_ids >= 0
+        doc_ids = doc_ids[valid]
+        term_ids = term_ids[valid]
+        num_tokens = len(term_ids)
+        vocabulary_size = len(vocabulary)
+
+        term_frequency = np.bincount(term_ids, minlength=vocabulary_size)
+        doc_term = sparse.coo_matrix(
+            (np.ones(num_tokens, dtype=np.int8), (doc_ids, term_ids)),
+            shape=(num_docs, vocabulary_size),
+        ).tocsr()
+        doc_term.sum_duplicates()
+        document_frequency = np.bincount(doc_term.indices, minlength=vocabulary_size)
+        doc_lengths = np.bincount(doc_ids, minlength=num_docs)
+
+        # document length percentiles
+        percentiles = np.array([0, 1, 5, 10, 25, 50, 75, 90, 95, 99, 100], dtype=np.float64)
+        length_percentiles = np.percentile(doc_lengths, percentiles)
+
+        # Heaps' law: vocabulary size after n tokens, from the position of the first occurrence of every term
+        first_occurrences = np.zeros(vocabulary_size, dtype=np.int64)
+        if num_tokens:
+            _, first_index = np.unique(term_ids, return_index=True)
+            first_occurrences = np.sort(first_index)
+        points = np.unique(np.geomspace(1, max(num_tokens, 1), num=50).astype(np.int64))
+        growth = np.searchsorted(first_occurrences, points, side="left")
+        heaps_k, heaps_beta = self.fit_heaps(points, growth)
+
+        # Zipf rank-frequency table
+        zipf_terms, zipf_frequencies = top_k(term_frequency[None, :], num_terms)
+        zipf_terms = zipf_terms[0]
+
+        summary = {
+            "num_documents": int(num_docs),
+            "num_tokens": int(num_tokens),
+            "vocabulary_size": int(vocabulary_size),
+            "hapax_legomena": int(np.count_nonzero(term_frequency == 1)),
+            "dis_legomena": int(np.count_nonzero(term_frequency == 2)),
+            "single_document_terms": int(np.count_nonzero(document_frequency == 1)),
+            "empty_documents": int(np.count_nonzero(doc_lengths == 0)),
+            "mean_document_length": float(doc_lengths.mean()),
+            "median_document_length": float(np.median(doc_lengths)),
+            "heaps_k": heaps_k,
+            "heaps_beta": heaps_beta,
+            "sample_fraction": sample_fraction,
+        }
+
+        outputs.set_value("summary", summary)
+        outputs.set_value("document_lengths", pa.table({
+            "percentile": pa.array(percentiles),
+            "length": pa.array(length_percentiles),
+        }))
+        outputs.set_value("heaps_curve", pa.table({
+            "num_tokens": pa.array(points),
+            "vocabulary_size": pa.array(growth.astype(np.int64)),
+        }))
+        outputs.set_value("zipf_table", pa.table({
+            "rank": pa.array(np.arange(1, len(zipf_terms) + 1, dtype=np.int64)),
+            "term": vocabulary.take(pa.array(zipf_terms)),
+            "frequency": pa.array(zipf_frequencies[0].astype(np.int64)),
+            "relative_frequency": pa.array(zipf_frequencies[0] / max(num_tokens, 1)),
+            "document_frequency": pa.array(document_frequency[zipf_terms].astype(np.int64)),
+        }))
+
+        term_lengths = pc.utf8_length(vocabulary).to_numpy(zero_copy_only=False)
+        filters = [
+            ("no_below", inputs.get_value_data("no_below_values"), lambda v: document_frequency >= v),
+            ("no_above", inputs.get_value_data("no_above_values"), lambda v: document_frequency <= v * num_docs),
+            ("min_length", inputs.get_value_data("min_length_values"), lambda v: term_lengths >= v),
+        ]
+        predictions = {"filter": [], "value": [], "vocabulary_size": [], "vocabulary_share": [], "token_share": []}
+        for name, values, keep_terms in filters:
+            for value in list(values or []):
+                keep = keep_terms(value)
+                kept_terms = int(np.count_nonzero(keep))
+                predictions["filter"].append(name)
+                predictions["value"].append(float(value))
+                predictions["vocabulary_size"].append(kept_terms)
+                predictions["vocabulary_share"].append(kept_terms / vocabulary_size if vocabulary_size else 0.0)
+                predictions["token_share"].append(float(term_frequency[keep].sum() / num_tokens) if num_tokens else 0.0)
+        outputs.set_value("filter_predictions", pa.table({
+            "filter": pa.array(predictions["filter"], type=pa.string()),
+            "value": pa.array(predictions["value"], type=pa.float64()),
+            "vocabulary_size": pa.array(predictions["vocabulary_size"], type=pa.int64()),
+            "vocabulary_share": pa.array(predictions["vocabulary_share"], type=pa.float64()),
+            "token_share": pa.array(predictions["token_share"], type=pa.float64()),
+        }))
+
+        outputs.set_value("phrase_predictions", self.predict_phrases(
+            term_ids,
+            doc_ids,
+            term_frequency,
+            list(inputs.get_value_data("min_count_values") or []),
+            list(inputs.get_value_data("threshold_values") or []),
+        ))
+
+    def fit_heaps(self, num_tokens, vocabulary_sizes):
+        """Fit Heaps' law (vocabulary_size = k * num_tokens ^ beta) with a least squares fit in log-log space."""
+
+        import numpy as np
+
+        valid = (num_tokens > 0) & (vocabulary_sizes > 0)
+        if np.count_nonzero(valid) < 2:
+            return None, None
+        beta, log_k = np.polyfit(np.log(num_tokens[valid]), np.log(vocabulary_sizes[valid]), 1)
+        return float(np.exp(log_k)), float(beta)
+
+    def predict_phrases(self, term_ids, doc_ids, term_frequency, min_count_values, threshold_values):
+        """Count the bigrams that gensim's phrase detection would merge, for each combination of min_count and threshold.
+
+        Uses the default scorer of gensim's Phrases: (bigram_count - min_count) / (count_a * count_b) * vocabulary_size,
+        where the vocabulary contains the unigrams and the bigrams.
+        """
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        # bigrams of consecutive tokens of the same document, encoded as a single integer
+        same_doc = doc_ids[1:] == doc_ids[:-1]
+        first = term_ids[:-1][same_doc].astype(np.int64)
+        second = term_ids[1:][same_doc].astype(np.int64)
+        keys, bigram_counts = np.unique(first * len(term_frequency) + second, return_counts=True)
+        count_a = term_frequency[keys // len(term_frequency)].astype(np.float64)
+        count_b = term_frequency[keys % len(term_frequency)].astype(np.float64)
+        phrases_vocabulary = len(term_frequency) + len(keys)
+
+        predictions = {"min_count": [], "threshold": [], "num_phrases": []}
+        for min_count in min_count_values:
+            for threshold in threshold_values:
+                scores = (bigram_counts - min_count) / (count_a * count_b) * phrases_vocabulary
+                predictions["min_count"].append(int(min_count))
+                predictions["threshold"].append(float(threshold))
+                predictions["num_phrases"].append(int(np.count_nonzero(scores > threshold)))
+
+        return pa.table({
+            "min_count": pa.array(predictions["min_count"], type=pa.int64()),
+            "threshold": pa.array(predictions["threshold"], type=pa.float64()),
+            "num_phrases": pa.array(predictions["num_phrases"], type=pa.int64()),
+        })
@@ -0,0 +1,827 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+INDEX_FORMAT_VERSION = 1
+SIMILARITY_INDEX_FORMAT_VERSION = 1
+
+
+class CreateInvertedIndex(KiaraModule):
+    """
+    This module builds a persistent inverted index from an array of tokens, for fast term and phrase lookups with 'topic_modelling.query_index'.
+
+    For every term, the index stores the ids of the documents it occurs in (the position of the document in the tokens array), and the positions of
+    the term within those documents, sorted by document and position. The index is saved as NumPy and Arrow files in 'index_dir', which are memory-mapped
+    when queried, so only the postings of the queried terms are read from disk.
+    """
+
+    _module_type_name = "topic_modelling.create_index"
+
+    def create_inputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens of each document.",
+            },
+            "index_dir": {
+                "type": "string",
+                "doc": "Local directory to save the index to. An existing index in this directory is replaced.",
+                "optional": False,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "index_dir": {
+                "type": "string",
+                "doc": "The directory of the index, to pass to 'topic_modelling.query_index'."
+            },
+            "index_statistics": {
+                "type": "dict",
+                "doc": "The number of documents, tokens and terms in the index."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import json
+        import os
+        import shutil
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens
+
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+        index_dir = inputs.get_value_data("index_dir")
+
+        num_docs = len(tokens_array_pa)
+
+        try:
+            flat_tokens, doc_ids = flatten_tokens(tokens_array_pa)
+            vocabulary, term_ids = encode_tokens(flat_tokens)
+
+            # position of every token within its document (null tokens keep their position, but are not indexed)
+            doc_starts = np.searchsorted(doc_ids, np.arange(num_docs))
+            positions = np.arange(len(doc_ids), dtype=np.int64) - doc_starts[doc_ids] if len(doc_ids) else doc_ids
+
+            valid = term_ids >= 0
+            doc_ids = doc_ids[valid]
+            positions = positions[valid]
+            term_ids = term_ids[valid]
+
+            # terms are stored sorted, so they can be looked up with a binary search
+            sort_order = pc.sort_indices(vocabulary).to_numpy()
+            terms = vocabulary.take(pa.array(sort_order))
+            term_rank = np.empty(len(sort_order), dtype=np.int64)
+            term_rank[sort_order] = np.arange(len(sort_order))
+            term_ids = term_rank[term_ids]
+
+            # a stable sort by term keeps the postings of each term sorted by document and position
+            order = np.argsort(term_ids, kind="stable")
+            term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_offsets[1:])
+            posting_docs = doc_ids[order].astype(np.int32)
+            posting_positions = positions[order].astype(np.int32)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to build the index: {e}")
+
+        statistics = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "num_documents": num_docs,
+            "num_tokens": int(len(posting_docs)),
+            "num_terms": int(len(terms)),
+        }
+
+        # the index is written to a temporary directory, and moved in place when complete
+        index_dir = os.path.abspath(index_dir)
+        temp = f"{index_dir}.tmp"
+        try:
+            shutil.rmtree(temp, ignore_errors=True)
+            os.makedirs(temp)
+            table = pa.table({"term": terms.cast(pa.large_string())})
+            with pa.OSFile(os.path.join(temp, "terms.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            np.save(os.path.join(temp, "term_offsets.npy"), term_offsets)
+            np.save(os.path.join(temp, "posting_docs.npy"), posting_docs)
+            np.save(os.path.join(temp, "posting_positions.npy"), posting_positions)
+            with open(os.path.join(temp, "index.json"), "w", encoding="utf-8") as f:
+                json.dump(statistics, f)
+            shutil.rmtree(index_dir, ignore_errors=True)
+            os.replace(temp, index_dir)
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to save the index to '{index_dir}': {e}")
+
+        outputs.set_value("index_dir", index_dir)
+        outputs.set_value("index_statistics", statistics)
+
+
+class QueryInvertedIndex(KiaraModule):
+    """
+    This module looks up documents in an index created with 'topic_modelling.create_index', and returns the matching rows of the corpus table.
+
+    Queries are made of terms, phrases in double quotes, the operators AND, OR and NOT, and parentheses, for example:
+    'camorra AND ("pubblica sicurezza" OR polizia) NOT austria'. Terms next to each other without an operator are combined with AND.
+    Terms are matched exactly, so they need to be preprocessed (e.g. lowercased) the same way as the indexed tokens.
+    """
+
+    _module_type_name = "topic_modelling.query_index"
+
+    def create_inputs_schema(self):
+        return {
+            "index_dir": {
+                "type": "string",
+                "doc": "Directory of the index.",
+                "optional": False,
+            },
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table the indexed tokens were created from.",
+                "optional": False,
+            },
+            "query": {
+                "type": "string",
+                "doc": "The query.",
+                "optional": False,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The rows of the corpus table that match the query."
+            },
+            "doc_ids": {
+                "type": "array",
+                "doc": "The ids (row indices in the corpus table) of the matching documents, in ascending order."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import pyarrow as pa  # type: ignore
+
+        index_dir = inputs.get_value_data("index_dir")
+        corpus_table: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        query = inputs.get_value_data("query")
+
+        index = self.load_index(index_dir)
+
+        if index["num_documents"] != corpus_table.num_rows:
+            raise KiaraProcessingException(
+                f"The index has {index['num_documents']} documents, but the corpus table has {corpus_table.num_rows} rows. Both need to be created from the same corpus."
+            )
+
+        expression = self.parse_query(query)
+        doc_ids = self.evaluate(expression, index)
+
+        outputs.set_value("corpus_table", corpus_table.take(pa.array(doc_ids)))
+        outputs.set_value("doc_ids", pa.array(doc_ids))
+
+    def load_index(self, index_dir):
+        """Memory-map the files of an index."""
+
+        import json
+        import os
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        try:
+            with open(os.path.join(index_dir, "index.json"), encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("format_version") != INDEX_FORMAT_VERSION:
+                raise ValueError(f"unsupported format version {index.get('format_version')}")
+
+            source = pa.memory_map(os.path.join(index_dir, "terms.arrow"))
+            index["terms"] = pa.ipc.open_file(source).read_all().column("term")
+            for name in ["term_offsets", "posting_docs", "posting_positions"]:
+                index[name] = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to load the index from '{index_dir}': {e}")
+
+        return index
+
+    def parse_query(self, query):
+        """Parse a query into a nested tuple expression.
+
+        The expressions are ('term', term), ('phrase', [terms]), ('not', expression), and ('and' | 'or', [expressions]).
+        """
+
+        import re
+
+        tokens = re.findall(r'"[^"]*"|\(|\)|[^\s()"]+', query)
+        position = 0
+
+        def peek():
+            return tokens[position] if position < len(tokens) else None
+
+        def parse_or():
+            nonlocal position
+            operands = [parse_and()]
+            while peek() == "OR":
+                position += 1
+                operands.append(parse_and())
+            return operands[0] if len(operands) == 1 else ("or", operands)
+
+        def parse_and():
+            nonlocal position
+            operands = [parse_not()]
+            while peek() is not None and peek() not in ("OR", ")"):
+                if peek() == "AND":
+                    position += 1
+                operands.append(parse_not())
+            return operands[0] if len(operands) == 1 else ("and", operands)
+
+        def parse_not():
+            nonlocal position
+            if peek() == "NOT":
+                position += 1
+                return ("not", parse_not())
+            return parse_atom()
+
+        def parse_atom():
+            nonlocal position
+            token = peek()
+            if token is None or token in ("AND", "OR", ")"):
+                raise KiaraProcessingException(f"Invalid query '{query}': expected a term at position {position + 1}.")
+            position += 1
+            if token == "(":
+                expression = parse_or()
+                if peek() != ")":
+                    raise KiaraProcessingException(f"Invalid query '{query}': missing closing parenthesis.")
+                position += 1
+                return expression
+            if token.startswith('"'):
+                words = token.strip('"').split()
+                if not words:
+                    raise KiaraProcessingException(f"Invalid query '{query}': empty phrase.")
+                return ("term", words[0]) if len(words) == 1 else ("phrase", words)
+            return ("term", token)
+
+        if not tokens:
+            raise KiaraProcessingException("The query is empty.")
+
+        expression = parse_or()
+        if position != len(tokens):
+            raise KiaraProcessingException(f"Invalid query '{query}': unexpected '{tokens[position]}'.")
+        return expression
+
+    def evaluate(self, expression, index):
+        """Evaluate a parsed query, and return the sorted ids of the matching documents."""
+
+        import numpy as np
+
+        kind, operand = expression
+        if kind == "term":
+            docs, _ = self.get_postings(index, operand)
+            return self.unique_sorted(docs)
+        if kind == "phrase":
+            return self.match_phrase(index, operand)
+        if kind == "not":
+            excluded = np.zeros(index["num_documents"], dtype=bool)
+            excluded[self.evaluate(operand, index)] = True
+            return np.flatnonzero(~excluded).astype(np.int64)
+
+        results = [self.evaluate(e, index) for e in operand]
+        result = results[0]
+        for other in results[1:]:
+            if kind == "and":
+                result = self.intersect_sorted(result, other)
+            else:
+                result = np.union1d(result, other)
+        return result
+
+    def get_postings(self, index, term):
+        """Find a term with a binary search over the sorted terms, and return the document ids and positions of its occurrences."""
+
+        import numpy as np
+
+        terms = index["terms"]
+        low, high = 0, len(terms)
+        while low < high:
+            middle = (low + high) // 2
+            if terms[middle].as_py() < term:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(terms) or terms[low].as_py() != term:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        start, end = index["term_offsets"][low], index["term_offsets"][low + 1]
+        return (
+            np.asarray(index["posting_docs"][start:end], dtype=np.int64),
+            np.asarray(index["posting_positions"][start:end], dtype=np.int64),
+        )
+
+    def match_phrase(self, index, words):
+        """Return the sorted ids of the documents that contain the words at consecutive positions."""
+
+        matches = None
+        for offset, word in enumerate(words):
+            docs, positions = self.get_postings(index, word)
+            # key of the position the phrase would start at
+            valid = positions >= offset
+            keys = (docs[valid] << 32) | (positions[valid] - offset)
+            matches = keys if matches is None else self.intersect_sorted(matches, keys)
+            if len(matches) == 0:
+                break
+
+        return self.unique_sorted(matches >> 32)
+
+    @staticmethod
+    def intersect_sorted(values, other):
+        """Intersect two sorted arrays without duplicates, with a binary search of the values of the shorter array in the longer one."""
+
+        import numpy as np
+
+        if len(values) > len(other):
+            values, other = other, values
+        if len(values) == 0 or len(other) == 0:
+            return values[:0]
+        found = np.searchsorted(other, values)
+        found[found == len(other)] = 0
+        return values[other[found] == values]
+
+    @staticmethod
+    def unique_sorted(values):
+        """Remove the duplicates of a sorted array."""
+
+        import numpy as np
+
+        if len(values) == 0:
+            return values.astype(np.int64)
+        return values[np.r_[True, values[1:] != values[:-1]]].astype(np.int64)
+
+
+class CreateSimilarityIndex(KiaraModule):
+    """
+    This module builds a persistent similarity index over the document vectors of a corpus, to find similar documents with 'topic_modelling.query_similarity_index'.
+
+    The vectors are either the topic weights of a document topics table (created by 'topic_modelling.lda' or 'topic_modelling.nmf'), or the TF-IDF vectors of
+    a tokens array. They are l2-normalized and stored as float32 (dense for topic weights, sparse for TF-IDF) in 'index_dir', so the cosine similarity of two
+    documents is the dot product of their vectors. Optionally, random-projection locality-sensitive hashing (LSH) signatures are stored as well, for
+    approximate queries that only compare the documents that share a hash bucket with the query document in at least one of the hash tables.
+    """
+
+    _module_type_name = "topic_modelling.create_similarity_index"
+
+    def create_inputs_schema(self):
+        return {
+            "document_topics": {
+                "type": "table",
+                "doc": "The document topics table to index, with a 'doc_id' column and one 'topic_<n>' column per topic.",
+                "optional": True,
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens of each document, to index their TF-IDF vectors. Only used if no document topics table is provided.",
+                "optional": True,
+            },
+            "no_below": {
+                "type": "integer",
+                "doc": "Remove tokens that appear in less than no_below documents from the TF-IDF vectors.",
+                "optional": True,
+            },
+            "no_above": {
+                "type": "float",
+                "doc": "Remove tokens that appear in more than no_above documents (fraction of the total number of documents) from the TF-IDF vectors.",
+                "optional": True,
+            },
+            "index_dir": {
+                "type": "string",
+                "doc": "Local directory to save the index to. An existing index in this directory is replaced.",
+                "optional": False,
+            },
+            "lsh_tables": {
+                "type": "integer",
+                "doc": "Number of LSH hash tables for approximate queries. More tables find more of the exact neighbours, at the cost of slower queries. If 0, only exact queries are supported.",
+                "optional": True,
+                "default": 0
+            },
+            "lsh_bits": {
+                "type": "integer",
+                "doc": "Number of random hyperplanes (bits of the signature) per LSH hash table, at most 32. More bits mean smaller buckets.",
+                "optional": True,
+                "default": 12
+            },
+            "random_state": {
+                "type": "integer",
+                "doc": "Random state of the LSH hyperplanes.",
+                "optional": True,
+                "default": 0
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "index_dir": {
+                "type": "string",
+                "doc": "The directory of the index, to pass to 'topic_modelling.query_similarity_index'."
+            },
+            "index_statistics": {
+                "type": "dict",
+                "doc": "The number of documents and dimensions of the index, and its LSH settings."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import json
+        import os
+        import shutil
+
+        import numpy as np
+
+        from kiara_plugin.topic_modelling.utils import (
+            create_doc_term_matrix,
+            create_tfidf_matrix,
+            filter_vocabulary,
+            get_topic_columns,
+        )
+
+        doc_topics_value = inputs.get_value_data("document_topics")
+        tokens_value = inputs.get_value_data("tokens_array")
+        no_below = inputs.get_value_data("no_below")
+        no_above = inputs.get_value_data("no_above")
+        index_dir = inputs.get_value_data("index_dir")
+        lsh_tables = inputs.get_value_data("lsh_tables")
+        lsh_bits = inputs.get_value_data("lsh_bits")
+        random_state = inputs.get_value_data("random_state")
+
+        if lsh_tables < 0:
+            raise KiaraProcessingException(f"Invalid number of LSH tables '{lsh_tables}', needs to be at least 0.")
+        if lsh_tables and not 1 <= lsh_bits <= 32:
+            raise KiaraProcessingException(f"Invalid number of LSH bits '{lsh_bits}', needs to be between 1 and 32.")
+
+        if doc_topics_value is not None:
+            doc_topics = doc_topics_value.arrow_table
+            topic_cols = get_topic_columns(doc_topics)
+            if not topic_cols:
+                raise KiaraProcessingException("The document topics table needs at least one 'topic_<n>' column.")
+            vectors = np.column_stack([doc_topics.column(c).to_numpy() for c in topic_cols]).astype(np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms > 0, norms, 1)
+            vector_type = "dense"
+        elif tokens_value is not None:
+            try:
+                counts, vocabulary = create_doc_term_matrix(tokens_value.arrow_array)
+                counts, vocabulary = filter_vocabulary(counts, vocabulary, no_below=no_below, no_above=no_above)
+            except Exception as e:
+                raise KiaraProcessingException(f"Failed to create document-term matrix: {e}")
+            if counts.shape[1] == 0:
+                raise KiaraProcessingException(
+                    "No terms left in the vocabulary, please check the no_below and no_above values."
+                )
+            # TF-IDF rows are already l2-normalized
+            vectors = create_tfidf_matrix(counts.tocsr())
+            vector_type = "sparse"
+        else:
+            raise KiaraProcessingException("Either a document topics table or a tokens array is needed.")
+
+        num_docs, num_dimensions = vectors.shape
+
+        statistics = {
+            "format_version": SIMILARITY_INDEX_FORMAT_VERSION,
+            "vector_type": vector_type,
+            "num_documents": int(num_docs),
+            "num_dimensions": int(num_dimensions),
+            "lsh_tables": int(lsh_tables),
+            "lsh_bits": int(lsh_bits) if lsh_tables else 0,
+        }
+
+        # the index is written to a temporary directory, and moved in place when complete
+        index_dir = os.path.abspath(index_dir)
+        temp = f"{index_dir}.tmp"
+        try:
+            shutil.rmtree(temp, ignore_errors=True)
+            os.makedirs(temp)
+            if vector_type == "dense":
+                np.save(os.path.join(temp, "vectors.npy"), np.ascontiguousarray(vectors))
+            else:
+                np.save(os.path.join(temp, "vectors_data.npy"), vectors.data.astype(np.float32))
+                np.save(os.path.join(temp, "vectors_indices.npy"), vectors.indices.astype(np.int32))
+                np.save(os.path.join(temp, "vectors_indptr.npy"), vectors.indptr.astype(np.int64))
+
+            if lsh_tables:
+                rng = np.random.default_rng(random_state)
+                planes = rng.standard_normal((num_dimensions, lsh_tables * lsh_bits)).astype(np.float32)
+                signatures = self.hash_vectors(vectors, planes, lsh_tables, lsh_bits)
+                # every table is stored sorted by signature, so the buckets are found with a binary search
+                bucket_docs = np.argsort(signatures, axis=0, kind="stable").astype(np.int32)
+                bucket_signatures = np.take_along_axis(signatures, bucket_docs, axis=0)
+                np.save(os.path.join(temp, "lsh_planes.npy"), planes)
+                np.save(os.path.join(temp, "lsh_signatures.npy"), np.ascontiguousarray(bucket_signatures.T))
+                np.save(os.path.join(temp, "lsh_docs.npy"), np.ascontiguousarray(bucket_docs.T))
+                statistics["lsh_mean_bucket_size"] = float(np.mean([
+                    num_docs / len(np.unique(signatures[:, table])) for table in range(lsh_tables)
+                ])) if num_docs else 0.0
+
+            with open(os.path.join(temp, "index.json"), "w", encoding="utf-8") as f:
+                json.dump(statistics, f)
+            shutil.rmtree(index_dir, ignore_errors=True)
+            os.replace(temp, index_dir)
+        except Exception as e:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise KiaraProcessingException(f"Failed to save the index to '{index_dir}': {e}")
+
+        outputs.set_value("index_dir", index_dir)
+        outputs.set_value("index_statistics", statistics)
+
+    @staticmethod
+    def hash_vectors(vectors, planes, num_tables, num_bits, batch_size=100_000):
+        """Compute the LSH signatures (one uint32 per table) of the rows of a dense or sparse matrix, batch by batch."""
+
+        import numpy as np
+
+        bit_values = (np.uint32(1) << np.arange(num_bits, dtype=np.uint32))
+        signatures = np.empty((vectors.shape[0], num_tables), dtype=np.uint32)
+        for start in range(0, vectors.shape[0], batch_size):
+            projections = np.asarray(vectors[start:start + batch_size] @ planes)
+            bits = (projections > 0).reshape(-1, num_tables, num_bits)
+            signatures[start:start + batch_size] = (bits * bit_values).sum(axis=2, dtype=np.uint32)
+        return signatures
+
+
+class QuerySimilarityIndex(KiaraModule):
+    """
+    This module finds the documents that are most similar (by cosine similarity) to one or more documents, in an index created with 'topic_modelling.create_similarity_index'.
+
+    Exact queries compare the query documents with all indexed documents, with float32 matrix products over blocks of 'block_size' documents of the
+    memory-mapped index, keeping only the running top 'k' of each block. Approximate queries only compare the documents that share an LSH bucket with
+    a query document, and need an index with LSH tables.
+    """
+
+    _module_type_name = "topic_modelling.query_similarity_index"
+
+    def create_inputs_schema(self):
+        return {
+            "index_dir": {
+                "type": "string",
+                "doc": "Directory of the index.",
+                "optional": False,
+            },
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table the indexed vectors were created from.",
+                "optional": False,
+            },
+            "doc_ids": {
+                "type": "list",
+                "doc": "The ids (row indices in the corpus table) of the documents to find similar documents for.",
+                "optional": False,
+            },
+            "k": {
+                "type": "integer",
+                "doc": "Number of similar documents to return per query document.",
+                "optional": True,
+                "default": 10
+            },
+            "approximate": {
+                "type": "boolean",
+                "doc": "Whether to only compare the documents that share an LSH bucket with the query document.",
+                "optional": True,
+                "default": False
+            },
+            "exclude_self": {
+                "type": "boolean",
+                "doc": "Whether to leave the query documents themselves out of their results.",
+                "optional": True,
+                "default": True
+            },
+            "block_size": {
+                "type": "integer",
+                "doc": "Number of indexed documents to compare with the query documents at a time, in exact queries.",
+                "optional": True,
+                "default": 65536
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The rows of the corpus table of the similar documents, with the query_doc_id, rank, doc_id and similarity columns added in front, ordered by query document and rank."
+            },
+            "similar_documents": {
+                "type": "table",
+                "doc": "The similar documents of every query document (query_doc_id, rank, doc_id, similarity)."
+            }
+        }
+
+    def process(self, inputs, outputs):
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+
+        index_dir = inputs.get_value_data("index_dir")
+        corpus_table: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        doc_ids = inputs.get_value_data("doc_ids")
+        k = inputs.get_value_data("k")
+        approximate = inputs.get_value_data("approximate")
+        exclude_self = inputs.get_value_data("exclude_self")
+        block_size = inputs.get_value_data("block_size")
+
+        index = self.load_index(index_dir)
+        num_docs = index["num_documents"]
+
+        if num_docs != corpus_table.num_rows:
+            raise KiaraProcessingException(
+                f"The index has {num_docs} documents, but the corpus table has {corpus_table.num_rows} rows. Both need to be created from the same corpus."
+            )
+        if k < 1:
+            raise KiaraProcessingException(f"Invalid k '{k}', needs to be at least 1.")
+        if block_size < 1:
+            raise KiaraProcessingException(f"Invalid block size '{block_size}', needs to be at least 1.")
+        if approximate and not index["lsh_tables"]:
+            raise KiaraProcessingException(
+                "The index has no LSH tables, please create it with 'lsh_tables' > 0 for approximate queries."
+            )
+
+        query_ids = np.asarray(list(doc_ids or []), dtype=np.int64)
+        if len(query_ids) == 0:
+            raise KiaraProcessingException("No query document ids provided.")
+        invalid = (query_ids < 0) | (query_ids >= num_docs)
+        if invalid.any():
+            raise KiaraProcessingException(
+                f"Invalid document id '{query_ids[invalid][0]}', needs to be between 0 and {num_docs - 1}."
+            )
+
+        if approximate:
+            neighbours, similarities = self.search_lsh(index, query_ids, k, exclude_self)
+        else:
+            neighbours, similarities = self.search_exact(index, query_ids, k, exclude_self, block_size)
+
+        # results with fewer than k candidates are padded with -1
+        found = neighbours >= 0
+        num_found = found.sum(axis=1)
+        similar_documents = pa.table({
+            "query_doc_id": pa.array(np.repeat(query_ids, num_found)),
+            "rank": pa.array(np.concatenate([np.arange(1, n + 1, dtype=np.int32) for n in num_found])),
+            "doc_id": pa.array(neighbours[found].astype(np.int64)),
+            "similarity": pa.array(similarities[found].astype(np.float32)),
+        })
+
+        result_table = corpus_table.take(similar_documents.column("doc_id"))
+        for position, name in enumerate(similar_documents.column_names):
+            if name in result_table.column_names:
+                result_table = result_table.drop_columns([name])
+            result_table = result_table.add_column(position, name, similar_documents.column(name))
+
+        outputs.set_value("corpus_table", result_table)
+        outputs.set_value("similar_documents", similar_documents)
+
+    def load_index(self, index_dir):
+        """Memory-map the files of an index."""
+
+        import json
+        import os
+
+        import numpy as np
+
+        try:
+            with open(os.path.join(index_dir, "index.json"), encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("format_version") != SIMILARITY_INDEX_FORMAT_VERSION or "vector_type" not in index:
+                raise ValueError(f"unsupported format version {index.get('format_version')}")
+
+            names = ["vectors"] if index["vector_type"] == "dense" else ["vectors_data", "vectors_indices", "vectors_indptr"]
+            if index["lsh_tables"]:
+                names += ["lsh_planes", "lsh_signatures", "lsh_docs"]
+            for name in names:
+                index[name] = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to load the index from '{index_dir}': {e}")
+
+        return index
+
+    def get_vectors(self, index, start, end):
+        """Return the vectors of a range of documents, as a dense array or a sparse matrix."""
+
+        import numpy as np
+        from scipy import sparse  # type: ignore
+
+        if index["vector_type"] == "dense":
+            return np.asarray(index["vectors"][start:end])
+
+        indptr = np.asarray(index["vectors_indptr"][start:end + 1])
+        return sparse.csr_matrix(
+            (
+                np.asarray(index["vectors_data"][indptr[0]:indptr[-1]]),
+                np.asarray(index["vectors_indices"][indptr[0]:indptr[-1]]),
+                indptr - indptr[0],
+            ),
+            shape=(len(indptr) - 1, index["num_dimensions"]),
+        )
+
+    def take_vectors(self, index, doc_ids):
+        """Return the vectors of a list of documents, as a dense array or a sparse matrix."""
+
+        import numpy as np
+        from scipy import sparse  # type: ignore
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if index["vector_type"] == "dense":
+            return np.asarray(index["vectors"][doc_ids])
+
+        indptr = index["vectors_indptr"]
+        starts = np.asarray(indptr[doc_ids])
+        lengths = np.asarray(indptr[doc_ids + 1]) - starts
+        offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # positions of the non-zero values of the documents in the index arrays
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return sparse.csr_matrix(
+            (np.asarray(index["vectors_data"][positions]), np.asarray(index["vectors_indices"][positions]), offsets),
+            shape=(len(doc_ids), index["num_dimensions"]),
+        )
+
+    @staticmethod
+    def similarities(queries, vectors):
+        """Compute the (queries x documents) dot products of two (dense or sparse) matrices of normalized vectors, as a dense float32 array."""
+
+        import numpy as np
+        from scipy import sparse  # type: ignore
+
+        scores = vectors @ queries.T
+        if sparse.issparse(scores):
+            scores = scores.toarray()
+        return np.ascontiguousarray(np.asarray(scores, dtype=np.float32).T)
+
+    def search_exact(self, index, query_ids, k, exclude_self, block_size):
+        """Find the top k documents for every query document, block by block over all indexed documents.
+
+        Returns the document ids and similarities, as (queries x k) arrays sorted by descending similarity.
+        """
+
+        import numpy as np
+
+        from kiara_plugin.topic_modelling.utils import top_k
+
+        num_docs = index["num_documents"]
+        queries = self.take_vectors(index, query_ids)
+
+        best_ids = np.full((len(query_ids), 0), -1, dtype=np.int64)
+        best_scores = np.full((len(query_ids), 0), -np.inf, dtype=np.float32)
+        for start in range(0, num_docs, block_size):
+            end = min(start + block_size, num_docs)
+            scores = self.similarities(queries, self.get_vectors(index, start, end))
+            if exclude_self:
+                in_block = (query_ids >= start) & (query_ids < end)
+                scores[np.flatnonzero(in_block), query_ids[in_block] - start] = -np.inf
+
+            # merge the top k of the block with the running top k
+            block_ids, block_scores = top_k(scores, k)
+            candidate_ids = np.hstack([best_ids, block_ids + start])
+            candidate_scores = np.hstack([best_scores, block_scores])
+            order, best_scores = top_k(candidate_scores, k)
+            best_ids = np.take_along_axis(candidate_ids, order, axis=1)
+
+        best_ids[np.isneginf(best_scores)] = -1
+        return best_ids, best_scores
+
+    def search_lsh(self, index, query_ids, k, exclude_self):
+        """Find the approximate top k documents for every query document, among the documents that share an LSH bucket with it.
+
+        Returns the document ids and similarities, as (queries x k) arrays sorted by descending similarity, padded with -1 if fewer than k candidates were found.
+        """
+
+        import numpy as np
+
+        from kiara_plugin.topic_modelling.utils import top_k
+
+        num_tables = index["lsh_tables"]
+        num_bits = index["lsh_bits"]
+        queries = self.take_vectors(index, query_ids)
+        query_signatures = CreateSimilarityIndex.hash_vectors(
+            queries, np.asarray(index["lsh_planes"]), num_tables, num_bits
+        )
+
+        best_ids = np.full((len(query_ids), k), -1, dtype=np.int64)
+        best_scores = np.full((len(query_ids), k), -np.inf, dtype=np.float32)
+        for query, query_id in enumerate(query_ids):
+            candidates = []
+            for table in range(num_tables):
+                signatures = index["lsh_signatures"][table]
+                signature = query_signatures[query, table]
+                low = np.searchsorted(signatures, signature, side="left")
+                high = np.searchsorted(signatures, signature, side="right")
+                candidates.append(np.asarray(index["lsh_docs"][table][low:high], dtype=np.int64))
+            candidates = np.unique(np.concatenate(candidates))
+            if exclude_self:
+                candidates = candidates[candidates != query_id]
+            if len(candidates) == 0:
+                continue
+
+            scores = self.similarities(queries[query:query + 1], self.take_vectors(index, candidates))
+            order, values = top_k(scores, k)
+            best_ids[query, :order.shape[1]] = candidates[order[0]]
+            best_scores[query, :order.shape[1]] = values[0]
+
+        return best_ids, best_scores
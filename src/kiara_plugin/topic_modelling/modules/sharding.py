@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+SHARDS_FORMAT_VERSION = 1
+RESULT_STEPS_HASH_KEY = "kiara_plugin.topic_modelling.steps_hash"
+
+DEFAULT_SHARD_STEPS = [
+    "topic_modelling.tokenize_array",
+    "topic_modelling.preprocess_tokens",
+    "topic_modelling.remove_stopwords",
+]
+
+# the kiara API of a worker process, only set in worker processes, by their initializer
+_shard_worker_state: dict = {}
+
+
+def _init_shard_worker(context_dir):
+    """Create the kiara context the shard jobs of a worker process run in."""
+
+    import os
+
+    from kiara.api import KiaraAPI
+    from kiara.context import KiaraConfig
+
+    config = KiaraConfig.create_in_folder(os.path.join(context_dir, f"worker_{os.getpid()}"))
+    _shard_worker_state["api"] = KiaraAPI(config)
+
+
+def _run_shard(shard_path, result_path, text_column, steps, steps_hash):
+    """Run a chain of kiara operations on the text column of a shard, save the resulting tokens, and return the number of rows and seconds it took (runs in worker processes).
+
+    Every step gets the output of the previous step as its 'corpus_array' or 'tokens_array' input, depending on what the previous step returned.
+    The hash of the steps is saved in the metadata of the result, so results of other steps are not mistaken for this one.
+    """
+
+    import os
+    import time
+
+    import pyarrow as pa  # type: ignore
+
+    start = time.perf_counter()
+    with pa.memory_map(shard_path) as source:
+        shard = pa.ipc.open_file(source).read_all()
+
+    current_name, current_value = "corpus_array", shard.column(text_column)
+    for step in steps:
+        step_inputs = dict(step.get("inputs") or {})
+        step_inputs[current_name] = current_value
+        result = _shard_worker_state["api"].run_job(step["operation"], inputs=step_inputs, comment=f"shard {os.path.basename(shard_path)}: {step['operation']}")
+        if "tokens_array" in result.field_names:
+            current_name = "tokens_array"
+        elif "corpus_array" not in result.field_names:
+            raise ValueError(f"operation '{step['operation']}' has neither a 'tokens_array' nor a 'corpus_array' output")
+        current_value = result.get_value_data(current_name).arrow_array
+
+    table = pa.table({"doc_id": shard.column("doc_id"), current_name: current_value}).replace_schema_metadata(
+        {RESULT_STEPS_HASH_KEY: steps_hash}
+    )
+    # the result is written to a temporary file, and moved in place when complete, so partial results are never merged
+    temp = f"{result_path}.tmp"
+    with pa.OSFile(temp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp, result_path)
+    return table.num_rows, time.perf_counter() - start
+
+
+def _load_shard_manifest(shard_dir):
+    """Load the manifest of the shards in a directory created by 'topic_modelling.split_corpus'."""
+
+    import json
+    import os
+
+    try:
+        with open(os.path.join(shard_dir, "shards.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != SHARDS_FORMAT_VERSION:
+            raise ValueError(f"unsupported format version {manifest.get('format_version')}")
+    except Exception as e:
+        raise KiaraProcessingException(f"Failed to load the shards from '{shard_dir}': {e}")
+    return manifest
+
+
+def _get_result_path(shard_dir, shard):
+    """Return the path of the result file of a shard."""
+
+    import os
+
+    return os.path.join(shard_dir, "results", shard["file_name"])
+
+
+def _get_steps_hash(text_column, steps):
+    """Return a hash of the text column and the (normalized) steps that create the results of the shards."""
+
+    import hashlib
+    import json
+
+    key = json.dumps({"text_column": text_column, "steps": steps}, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _read_result_steps_hash(result_path):
+    """Return the hash of the steps that created a shard result, or None if there is no (readable) result."""
+
+    import os
+
+    import pyarrow as pa  # type: ignore
+
+    if not os.path.exists(result_path):
+        return None
+    try:
+        with pa.memory_map(result_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except Exception:
+        return None
+    steps_hash = metadata.get(RESULT_STEPS_HASH_KEY.encode("utf-8"))
+    return steps_hash.decode("utf-8") if steps_hash is not None else None
+
+
+class SplitCorpus(KiaraModule):
+    """
+    This module splits a corpus table into shards, to pre-process them independently with 'topic_modelling.run_shards'.
+
+    Shards are either contiguous ranges of rows of about the same size, or the rows of one publication each (based on the columns created by
+    'topic_modelling.lccn_metadata'). Every shard is saved as an Arrow file in 'shard_dir', with a 'doc_id' column (the position of the row in the
+    corpus table) to merge the results back in order, and a manifest of all shards. When 'shard_dir' is on a file system that all nodes can access,
+    the shards can be processed on several machines.
+    """
+
+    _module_type_name = "topic_modelling.split_corpus"
+
+    def create_inputs_schema(self):
+        return {
+            "corpus_table": {
+                "type": "table",
+                "doc": "The corpus table to split.",
+                "optional": False,
+            },
+            "shard_dir": {
+                "type": "string",
+                "doc": "Directory to save the shards to. Existing shards and results in this directory are replaced.",
+                "optional": False,
+            },
+            "shard_by": {
+                "type": "string",
+                "type_config": {"allowed_strings": ["rows", "publication"]},
+                "doc": "How to split the corpus: into ranges of rows ('rows'), or by publication ('publication').",
+                "optional": True,
+                "default": "rows",
+            },
+            "num_shards": {
+                "type": "integer",
+                "doc": "Number of shards, if the corpus is split into ranges of rows.",
+                "optional": True,
+                "default": 8,
+            },
+            "publication_ref_col": {
+                "type": "string",
+                "doc": "Column name of the values containing publication names or ref/id, if the corpus is split by publication.",
+                "optional": True,
+                "default": "publication_ref",
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "shard_dir": {
+                "type": "string",
+                "doc": "The directory of the shards, to pass to 'topic_modelling.run_shards'."
+            },
+            "shards": {
+                "type": "table",
+                "doc": "The shards (shard_id, publication, num_rows, first_doc_id)."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import json
+        import os
+        import shutil
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens
+
+        corpus_table: pa.Table = inputs.get_value_data("corpus_table").arrow_table
+        shard_dir = os.path.abspath(inputs.get_value_data("shard_dir"))
+        shard_by = inputs.get_value_data("shard_by")
+        num_shards = inputs.get_value_data("num_shards")
+        title_col = inputs.get_value_data("publication_ref_col")
+
+        sources_col_names = corpus_table.column_names
+        if "doc_id" in sources_col_names:
+            raise KiaraProcessingException(
+                "The corpus table already has a 'doc_id' column, which is added to the shards. Please rename it first."
+            )
+
+        num_docs = corpus_table.num_rows
+        row_ids = np.arange(num_docs, dtype=np.int64)
+
+        if shard_by == "rows":
+            if num_shards < 1:
+                raise KiaraProcessingException(f"Invalid number of shards '{num_shards}', needs to be at least 1.")
+            shard_rows = [rows for rows in np.array_split(row_ids, min(num_shards, max(num_docs, 1))) if len(rows)]
+            publications = [None] * len(shard_rows)
+        else:
+            if title_col not in sources_col_names:
+                raise KiaraProcessingException(
+                    f"Could not find title name/id column '{title_col}' in the table. Please specify a valid column name manually, using one of: {', '.join(sources_col_names)}"
+                )
+            titles = pc.cast(corpus_table.column(title_col), pa.string())
+            vocabulary, title_ids = encode_tokens(titles)
+            # documents without publication (id -1) get a shard of their own
+            order = np.argsort(title_ids, kind="stable")
+            boundaries = np.flatnonzero(np.diff(title_ids[order])) + 1
+            shard_rows = [rows for rows in np.split(row_ids[order], boundaries) if len(rows)]
+            publications = [
+                vocabulary[int(title_ids[rows[0]])].as_py() if title_ids[rows[0]] >= 0 else None for rows in shard_rows
+            ]
+
+        manifest = {"format_version": SHARDS_FORMAT_VERSION, "num_documents": int(num_docs), "shards": []}
+
+        # the shards are written to a temporary directory, and moved in place when complete
+        temp = f"{shard_dir}.tmp"
+        try:
+            shutil.rmtree(temp, ignore_errors=True)
+            os.makedirs(os.path.join(temp, "shards"))
+            os.makedirs(os.path.join(temp, "results"))
+            for shard_id, rows in enumerate(shard_rows):
+                shard = corpus_table.take(pa.array(rows))
+                shard = shard.add_column(0, "doc_id", pa.array(rows))
+                file_name = f"shard_{shard_id:05d}.arrow"
+                with pa.OSFile(os.path.join(temp, "shards", file_name), "wb") as sink:
+                    with pa.ipc.new_file(sink, shard.schema) as writer:
+                        writer.write_table(shard)
+                manifest["shards"].append({
+                    "shard_id": shard_id,
+                    "file_name": file_name,
+                    "publication": publications[shard_id],
+                    "num_rows": int(len(rows)),
+                    "first_doc_id": int(rows[0]),
+                })
+            with open(os.path.join(temp, "shards.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            os.replace(temp, shard_dir)
+        except Exception as e:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise KiaraProcessingException(f"Failed to save the shards to '{shard_dir}': {e}")
+
+        shards = manifest["shards"]
+        outputs.set_value("shard_dir", shard_dir)
+        outputs.set_value("shards", pa.table({
+            "shard_id": pa.array([s["shard_id"] for s in shards], type=pa.int32()),
+            "publication": pa.array([s["publication"] for s in shards], type=pa.string()),
+            "num_rows": pa.array([s["num_rows"] for s in shards], type=pa.int64()),
+            "first_doc_id": pa.array([s["first_doc_id"] for s in shards], type=pa.int64()),
+        }))
+
+
+class RunShards(KiaraModule):
+    """
+    This module runs a chain of pre-processing operations on every shard created by 'topic_modelling.split_corpus', as independent kiara jobs in parallel worker processes.
+
+    By default, the text column of every shard is tokenized ('topic_modelling.tokenize_array'), pre-processed ('topic_modelling.preprocess_tokens') and
+    cleaned of stop words ('topic_modelling.remove_stopwords'). Every step gets the output array of the previous step, and the inputs configured for it.
+    The result of every shard is saved next to the shards, and shards with an existing result of the same steps are skipped (results of other steps
+    are replaced). So the shards can be divided between several nodes that share 'shard_dir' (with 'shard_ids'), and an interrupted run can be resumed.
+    The results are combined with 'topic_modelling.merge_shards'.
+    """
+
+    _module_type_name = "topic_modelling.run_shards"
+
+    def create_inputs_schema(self):
+        return {
+            "shard_dir": {
+                "type": "string",
+                "doc": "Directory of the shards.",
+                "optional": False,
+            },
+            "text_column": {
+                "type": "string",
+                "doc": "Name of the column of the corpus table that contains the text.",
+                "optional": True,
+                "default": "content",
+            },
+            "steps": {
+                "type": "list",
+                "doc": "The operations to run on every shard, in order. Every step is either an operation name, or a dict with an 'operation' and its 'inputs'.",
+                "optional": True,
+                "default": DEFAULT_SHARD_STEPS,
+            },
+            "stopwords_list": {
+                "type": "list",
+                "doc": "The stop words list for the 'topic_modelling.remove_stopwords' steps that don't have one in their inputs.",
+                "optional": True,
+            },
+            "shard_ids": {
+                "type": "list",
+                "doc": "The ids of the shards to process on this node. If not set, all shards are processed.",
+                "optional": True,
+            },
+            "workers": {
+                "type": "integer",
+                "doc": "Number of shards to process in parallel. Defaults to the number of cores.",
+                "optional": True,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "shard_dir": {
+                "type": "string",
+                "doc": "The directory of the shards and their results, to pass to 'topic_modelling.merge_shards'."
+            },
+            "shard_report": {
+                "type": "table",
+                "doc": "The processing status of the shards of this run (shard_id, num_rows, status, seconds), where the status is 'processed' or 'skipped'."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import multiprocessing
+        import os
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        import pyarrow as pa  # type: ignore
+
+        shard_dir = os.path.abspath(inputs.get_value_data("shard_dir"))
+        text_column = inputs.get_value_data("text_column")
+        stopwords_list = inputs.get_value_data("stopwords_list")
+        shard_ids = inputs.get_value_data("shard_ids")
+        workers = inputs.get_value_data("workers") or os.cpu_count() or 1
+
+        manifest = _load_shard_manifest(shard_dir)
+        steps = self.create_steps(list(inputs.get_value_data("steps") or []), stopwords_list)
+
+        shards = manifest["shards"]
+        if shard_ids is not None:
+            wanted = {int(shard_id) for shard_id in shard_ids}
+            unknown = wanted - {s["shard_id"] for s in shards}
+            if unknown:
+                raise KiaraProcessingException(f"Unknown shard ids: {', '.join(str(s) for s in sorted(unknown))}.")
+            shards = [s for s in shards if s["shard_id"] in wanted]
+
+        report = {"shard_id": [], "num_rows": [], "status": [], "seconds": []}
+        # results of other steps (or of another text column) are processed again, and replaced
+        steps_hash = _get_steps_hash(text_column, steps)
+        pending = []
+        for shard in shards:
+            if _read_result_steps_hash(_get_result_path(shard_dir, shard)) == steps_hash:
+                report["shard_id"].append(shard["shard_id"])
+                report["num_rows"].append(shard["num_rows"])
+                report["status"].append("skipped")
+                report["seconds"].append(0.0)
+            else:
+                pending.append(shard)
+
+        if pending:
+            # every worker process runs its jobs in a kiara context of its own, so the jobs don't contend for one store
+            with tempfile.TemporaryDirectory(prefix="kiara_shards_") as context_dir:
+                try:
+                    with ProcessPoolExecutor(
+                        max_workers=min(workers, len(pending)),
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_shard_worker,
+                        initargs=(context_dir,),
+                    ) as executor:
+                        futures = {
+                            shard["shard_id"]: executor.submit(
+                                _run_shard,
+                                os.path.join(shard_dir, "shards", shard["file_name"]),
+                                _get_result_path(shard_dir, shard),
+                                text_column,
+                                steps,
+                                steps_hash,
+                            )
+                            for shard in pending
+                        }
+                        for shard in pending:
+                            num_rows, seconds = futures[shard["shard_id"]].result()
+                            report["shard_id"].append(shard["shard_id"])
+                            report["num_rows"].append(num_rows)
+                            report["status"].append("processed")
+                            report["seconds"].append(seconds)
+                except Exception as e:
+                    raise KiaraProcessingException(f"Failed to process the shards: {e}")
+
+        outputs.set_value("shard_dir", shard_dir)
+        outputs.set_value("shard_report", pa.table({
+            "shard_id": pa.array(report["shard_id"], type=pa.int32()),
+            "num_rows": pa.array(report["num_rows"], type=pa.int64()),
+            "status": pa.array(report["status"], type=pa.string()),
+            "seconds": pa.array(report["seconds"], type=pa.float64()),
+        }))
+
+    def create_steps(self, steps, stopwords_list):
+        """Normalize the steps to dicts with an 'operation' and its 'inputs', and add the stop words list to the stop word removal steps."""
+
+        if not steps:
+            raise KiaraProcessingException("No steps to run on the shards.")
+
+        normalized = []
+        for step in steps:
+            step_config = {"operation": step} if isinstance(step, str) else step
+            if not isinstance(step_config, dict) or not step_config.get("operation"):
+                raise KiaraProcessingException(
+                    f"Invalid step '{step}', needs to be an operation name or a dict with an 'operation'."
+                )
+            step_inputs = dict(step_config.get("inputs") or {})
+            if step_config["operation"] == "topic_modelling.remove_stopwords" and "stopwords_list" not in step_inputs:
+                if stopwords_list is None:
+                    raise KiaraProcessingException(
+                        "The 'topic_modelling.remove_stopwords' step needs a stop words list, please provide 'stopwords_list'."
+                    )
+                step_inputs["stopwords_list"] = list(stopwords_list)
+            normalized.append({"operation": step_config["operation"], "inputs": step_inputs})
+        return normalized
+
+
+class MergeShards(KiaraModule):
+    """
+    This module merges the results of 'topic_modelling.run_shards' into one tokens array, in the order of the rows of the original corpus table.
+
+    Since the shards are pre-processed independently, it also counts the vocabulary of the merged corpus, with one id per term (in alphabetical order),
+    so all shards share one consistent vocabulary.
+    """
+
+    _module_type_name = "topic_modelling.merge_shards"
+
+    def create_inputs_schema(self):
+        return {
+            "shard_dir": {
+                "type": "string",
+                "doc": "Directory of the shards and their results.",
+                "optional": False,
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "tokens_array": {
+                "type": "array",
+                "doc": "The merged tokens (or text, if the last step returned text) of all documents, in the order of the corpus table."
+            },
+            "vocabulary": {
+                "type": "table",
+                "doc": "The vocabulary of the merged tokens (term_id, term, term_frequency, document_frequency), sorted by term. Empty if the results are text."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import os
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens
+
+        shard_dir = os.path.abspath(inputs.get_value_data("shard_dir"))
+        manifest = _load_shard_manifest(shard_dir)
+
+        steps_hashes = [_read_result_steps_hash(_get_result_path(shard_dir, s)) for s in manifest["shards"]]
+        missing = [s["shard_id"] for s, steps_hash in zip(manifest["shards"], steps_hashes) if steps_hash is None]
+        if missing:
+            raise KiaraProcessingException(
+                f"The shards {', '.join(str(s) for s in missing)} have not been processed yet, please run 'topic_modelling.run_shards' for them first."
+            )
+        if len(set(steps_hashes)) > 1:
+            raise KiaraProcessingException(
+                "The shard results were created with different steps, please run 'topic_modelling.run_shards' for all shards with the same steps first."
+            )
+
+        try:
+            results = []
+            for shard in manifest["shards"]:
+                with pa.memory_map(_get_result_path(shard_dir, shard)) as source:
+                    results.append(pa.ipc.open_file(source).read_all())
+            merged = pa.concat_tables(results, promote_options="permissive")
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to read the shard results: {e}")
+
+        if merged.num_rows != manifest["num_documents"]:
+            raise KiaraProcessingException(
+                f"The shard results have {merged.num_rows} documents, but the corpus table has {manifest['num_documents']}."
+            )
+
+        value_column = next(c for c in merged.column_names if c != "doc_id")
+        # shards split by publication are not contiguous, so the documents are put back in the order of the corpus table
+        doc_ids = merged.column("doc_id").to_numpy()
+        if np.any(doc_ids[1:] < doc_ids[:-1]):
+            merged = merged.take(pa.array(np.argsort(doc_ids, kind="stable")))
+        values = merged.column(value_column)
+
+        vocabulary_table = pa.table({
+            "term_id": pa.array([], type=pa.int64()),
+            "term": pa.array([], type=pa.large_string()),
+            "term_frequency": pa.array([], type=pa.int64()),
+            "document_frequency": pa.array([], type=pa.int64()),
+        })
+        if value_column == "tokens_array":
+            flat_tokens, token_doc_ids = flatten_tokens(values)
+            vocabulary, term_ids = encode_tokens(flat_tokens)
+            valid = term_ids >= 0
+            term_ids = term_ids[valid].astype(np.int64)
+            token_doc_ids = token_doc_ids[valid]
+
+            term_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+            document_frequency = np.bincount(
+                np.unique(token_doc_ids * len(vocabulary) + term_ids) % max(len(vocabulary), 1), minlength=len(vocabulary)
+            )
+            order = pc.sort_indices(vocabulary).to_numpy()
+            vocabulary_table = pa.table({
+                "term_id": pa.array(np.arange(len(order), dtype=np.int64)),
+                "term": vocabulary.take(pa.array(order)).cast(pa.large_string()),
+                "term_frequency": pa.array(term_frequency[order].astype(np.int64)),
+                "document_frequency": pa.array(document_frequency[order].astype(np.int64)),
+            })
+
+        outputs.set_value("tokens_array", values)
+        outputs.set_value("vocabulary", vocabulary_table)
+
@@ -8,6 +8,10 @@ class CreateSwList(KiaraModule):
     """
     This module creates a stop words list and enables to combine predefined stop words lists from nltk and/or a custom additional stop words list.
 
+    If a tokens array is provided, candidate stop words are also derived from the corpus itself: terms that appear in at least 'min_doc_frequency' of the documents,
+    and whose occurrences are spread evenly over the documents (normalized entropy of at least 'min_entropy'), ranked by their corpus-level TF-IDF (lowest first).
+    This catches corpus-specific high-frequency terms and recurring OCR artifacts. The statistics of all terms are returned as a ranked table.
+
     Dependencies:
     - NLTK: https://www.nltk.org/
     """
@@ -27,7 +31,30 @@ class CreateSwList(KiaraModule):
                 "doc": "A python list of stopwords.",
                 "optional": True,
                 "default": False
-            }
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "An array of tokens to derive corpus-specific stop words from.",
+                "optional": True,
+            },
+            "min_doc_frequency": {
+                "type": "float",
+                "doc": "Minimum fraction of documents a term needs to appear in to be a corpus stop word.",
+                "optional": True,
+                "default": 0.5
+            },
+            "min_entropy": {
+                "type": "float",
+                "doc": "Minimum normalized entropy (between 0 and 1) of the distribution of a term over the documents to be a corpus stop word.",
+                "optional": True,
+                "default": 0.8
+            },
+            "max_corpus_stopwords": {
+                "type": "integer",
+                "doc": "Maximum number of stop words derived from the corpus.",
+                "optional": True,
+                "default": 100
+            },
         }
 
     def create_outputs_schema(self):
@@ -35,7 +62,11 @@ class CreateSwList(KiaraModule):
             "stopwords_list": {
                 "type": "list",
                 "doc": "The combined stop words list."
-            }
+            },
+            "stopwords_statistics": {
+                "type": "table",
+                "doc": "The corpus statistics of all terms (term, term_frequency, document_frequency, tfidf, entropy, rank, selected), ranked by TF-IDF. Empty if no tokens array is provided."
+            },
         }
 
     def process(self, inputs, outputs):
@@ -47,9 +78,10 @@ class CreateSwList(KiaraModule):
         nltk_languages = set(stopwords.fileids())
         languages: List[str] = inputs.get_value_data("languages")
         custom_stopwords: List[str] = inputs.get_value_data("stopwords_list")
+        tokens_array = inputs.get_value_data("tokens_array")
 
-        if not languages and not custom_stopwords:
-            raise KiaraProcessingException("At least one language or custom stopwords list must be provided.")
+        if not languages and not custom_stopwords and tokens_array is None:
+            raise KiaraProcessingException("At least one language, custom stopwords list or tokens array must be provided.")
 
         sw_list: List[str] = []
 
@@ -61,15 +93,252 @@ class CreateSwList(KiaraModule):
             except LookupError as e:
                 raise KiaraProcessingException(f"Failed to create stopwords list for language '{lang}': {e}")
 
-        sw_list.extend(custom_stopwords)
+        if custom_stopwords:
+            sw_list.extend(custom_stopwords)
+
+        if tokens_array is not None:
+            try:
+                statistics = self.create_statistics(
+                    tokens_array.arrow_array,
+                    min_doc_frequency=inputs.get_value_data("min_doc_frequency"),
+                    min_entropy=inputs.get_value_data("min_entropy"),
+                    max_corpus_stopwords=inputs.get_value_data("max_corpus_stopwords"),
+                )
+            except Exception as e:
+                raise KiaraProcessingException(f"Failed to derive stop words from the corpus: {e}")
+            sw_list.extend(statistics.filter(statistics.column("selected")).column("term").to_pylist())
+        else:
+            statistics = self.create_statistics(None)
+
         sw_list = list(dict.fromkeys(sw_list))
         outputs.set_value("stopwords_list", sw_list)
+        outputs.set_value("stopwords_statistics", statistics)
+
+    def create_statistics(
+        self,
+        tokens_array,
+        min_doc_frequency: float = 0.5,
+        min_entropy: float = 0.8,
+        max_corpus_stopwords: Optional[int] = None,
+    ):
+        """Compute the corpus statistics of all terms with a single group-by over the flattened tokens, and select the stop word candidates."""
+
+        import numpy as np
+        import polars as pl  # type: ignore
+        import pyarrow as pa  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import encode_tokens, flatten_tokens
+
+        schema = pa.schema([
+            ("term", pa.large_string()),
+            ("term_frequency", pa.int64()),
+            ("document_frequency", pa.float64()),
+            ("tfidf", pa.float64()),
+            ("entropy", pa.float64()),
+            ("rank", pa.int64()),
+            ("selected", pa.bool_()),
+        ])
+        if tokens_array is None:
+            return schema.empty_table()
+
+        num_docs = len(tokens_array)
+        flat_tokens, doc_ids = flatten_tokens(tokens_array)
+        vocabulary, term_ids = encode_tokens(flat_tokens)
+        valid = term_ids >= 0
+
+        # entropy of the distribution of a term over the documents, normalized to [0, 1] by the maximum log(num_docs)
+        max_entropy = np.log(num_docs) if num_docs > 1 else 1.0
+        stats = (
+            pl.DataFrame({"term_id": term_ids[valid], "doc_id": doc_ids[valid]})
+            .lazy()
+            .group_by(["term_id", "doc_id"])
+            .agg(pl.len().alias("count"))
+            .with_columns((pl.col("count") / pl.col("count").sum().over("term_id")).alias("p"))
+            .group_by("term_id")
+            .agg(
+                pl.col("count").sum().cast(pl.Int64).alias("term_frequency"),
+                (pl.len() / num_docs).alias("document_frequency"),
+                (-(pl.col("p") * pl.col("p").log()).sum() / max_entropy).alias("entropy"),
+            )
+            .with_columns(
+                (pl.col("term_frequency") * (1 / pl.col("document_frequency")).log()).alias("tfidf")
+            )
+            .sort(["tfidf", "term_frequency"], descending=[False, True])
+            .with_columns(pl.int_range(1, pl.len() + 1, dtype=pl.Int64).alias("rank"))
+            .collect()
+        )
+
+        candidates = (stats["document_frequency"] >= min_doc_frequency) & (stats["entropy"] >= min_entropy)
+        if max_corpus_stopwords is not None:
+            candidates = candidates & (candidates.cast(pl.Int64).cum_sum() <= max_corpus_stopwords)
+
+        return pa.table({
+            "term": vocabulary.cast(pa.large_string()).take(pa.array(stats["term_id"].to_numpy())),
+            "term_frequency": stats["term_frequency"].to_arrow(),
+            "document_frequency": stats["document_frequency"].cast(pl.Float64).to_arrow(),
+            "tfidf": stats["tfidf"].cast(pl.Float64).to_arrow(),
+            "entropy": stats["entropy"].cast(pl.Float64).to_arrow(),
+            "rank": stats["rank"].to_arrow(),
+            "selected": candidates.to_arrow(),
+        }, schema=schema)
+
+
+class DetectLanguage(KiaraModule):
+    """
+    This module identifies the language of each document of an array of texts (or of token lists), for example to remove stop words per language
+    with the 'document_languages' input of 'topic_modelling.remove_stopwords'.
+
+    A character trigram profile is built for every language from its NLTK stop words list, and the documents are classified with a multinomial naive Bayes
+    model over the trigrams that occur in the profiles. The trigrams of a batch of documents are extracted from the UTF-8 bytes of the whole batch at once,
+    and scored against all profiles in one sparse matrix product. Documents without any profile trigram get no language.
+
+    Dependencies:
+    - NLTK: https://www.nltk.org/
+    """
+
+    _module_type_name = "topic_modelling.detect_language"
+
+    def create_inputs_schema(self):
+        return {
+            "corpus_array": {
+                "type": "array",
+                "doc": "Array that contains the texts (or the tokens) of the documents.",
+            },
+            "languages": {
+                "type": "list",
+                "doc": "List of candidate languages supported by NLTK, e.g. ['english', 'italian']. If empty, all languages of the NLTK stop words corpus are candidates.",
+                "optional": True,
+                "default": []
+            },
+            "max_characters": {
+                "type": "integer",
+                "doc": "Number of characters at the start of each document that are used for the identification.",
+                "optional": True,
+                "default": 2000
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "languages": {
+                "type": "array",
+                "doc": "The language of each document (null if it could not be identified)."
+            },
+            "confidence": {
+                "type": "array",
+                "doc": "The probability of the identified language of each document."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import nltk  # type: ignore
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        from nltk.corpus import stopwords  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import iter_batches
+
+        nltk.download('stopwords', quiet=True)
+
+        corpus_array_pa = inputs.get_value_data("corpus_array").arrow_array
+        languages: List[str] = list(inputs.get_value_data("languages") or [])
+        max_characters = inputs.get_value_data("max_characters")
+
+        nltk_languages = stopwords.fileids()
+        if not languages:
+            languages = nltk_languages
+        for lang in languages:
+            if lang not in nltk_languages:
+                raise KiaraProcessingException(f"Language '{lang}' not supported by NLTK.")
+
+        try:
+            profiles = self.count_trigrams(
+                pa.array([" ".join(stopwords.words(lang)) for lang in languages], type=pa.large_string()),
+                max_characters=None,
+            )
+        except LookupError as e:
+            raise KiaraProcessingException(f"Failed to load the stop words lists: {e}")
+
+        # naive Bayes log probabilities, with Laplace smoothing over the trigrams of all profiles
+        profiles = profiles.toarray().astype(np.float64)
+        features = np.flatnonzero(profiles.sum(axis=0))
+        profiles = profiles[:, features] + 1
+        log_probabilities = np.log(profiles / profiles.sum(axis=1, keepdims=True))
+
+        detected = []
+        confidences = []
+        try:
+            for batch in iter_batches(corpus_array_pa):
+                counts = self.count_trigrams(batch, max_characters=max_characters)[:, features]
+                scores = np.asarray(counts @ log_probabilities.T)
+                scores -= scores.max(axis=1, keepdims=True)
+                probabilities = np.exp(scores)
+                probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+                best = probabilities.argmax(axis=1)
+                unknown = np.asarray(counts.sum(axis=1)).ravel() == 0
+                detected.append(
+                    pa.array(np.array(languages, dtype=object)[best], type=pa.string(), mask=unknown)
+                )
+                confidences.append(
+                    pa.array(probabilities[np.arange(len(best)), best].astype(np.float32), mask=unknown)
+                )
+        except Exception as e:
+            raise KiaraProcessingException(f"Failed to identify the languages: {e}")
+
+        outputs.set_value("languages", pa.chunked_array(detected, type=pa.string()))
+        outputs.set_value("confidence", pa.chunked_array(confidences, type=pa.float32()))
+
+    def count_trigrams(self, texts, max_characters=None, num_buckets: int = 2**18):
+        """Count the hashed character trigrams (of the UTF-8 bytes) of each text, as a sparse (texts x buckets) matrix.
+
+        Texts are lowercased, and every run of non-letters is replaced by a single space, so trigrams at word boundaries include the spaces.
+        """
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+        from scipy import sparse  # type: ignore
+
+        if pa.types.is_list(texts.type) or pa.types.is_large_list(texts.type):
+            texts = pc.binary_join(texts, " ")
+        texts = pc.fill_null(texts.cast(pa.large_string()), "")
+        if max_characters:
+            texts = pc.utf8_slice_codeunits(texts, 0, max_characters)
+        texts = pc.replace_substring_regex(pc.utf8_lower(texts), pattern=r"[^\pL]+", replacement=" ")
+        space = pa.scalar(" ", type=pa.large_string())
+        texts = pc.binary_join_element_wise(space, texts, space, pa.scalar("", type=pa.large_string()))
+        if isinstance(texts, pa.ChunkedArray):
+            texts = texts.combine_chunks()
+
+        _, offsets_buffer, data_buffer = texts.buffers()
+        offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[texts.offset:texts.offset + len(texts) + 1]
+        data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]].astype(np.uint64)
+        offsets = offsets - offsets[0]
+
+        # trigrams that don't cross the boundary between two texts
+        doc_ids = np.repeat(np.arange(len(texts), dtype=np.int64), np.diff(offsets))
+        valid = doc_ids[:-2] == doc_ids[2:] if len(data) > 2 else np.zeros(0, dtype=bool)
+        codes = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+        buckets = ((codes[valid] * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)) % np.uint64(num_buckets)
+
+        counts = sparse.coo_matrix(
+            (np.ones(len(buckets), dtype=np.float64), (doc_ids[:-2][valid], buckets.astype(np.int64))),
+            shape=(len(texts), num_buckets),
+        ).tocsr()
+        counts.sum_duplicates()
+        return counts
 
 
 class RemoveSw(KiaraModule):
     """
     
     This module removes stop words from an array of tokens.
+
+    If the language of each document is provided (see 'topic_modelling.detect_language'), only the NLTK stop words list of that language is removed
+    from each document, and the stop words list is optional and removed from all documents (so it should only contain custom stop words then).
+    Documents without a language get the stop words of all the languages in the corpus.
     
     """
 
@@ -79,14 +348,19 @@ class RemoveSw(KiaraModule):
         return {
             "stopwords_list": {
                 "type": "list",
-                "doc": "A list of stop words to be removed from the tokens.",
-                "optional": False
+                "doc": "A list of stop words to be removed from the tokens. Required, unless the document languages are provided.",
+                "optional": True
             },
             "tokens_array": {
                 "type": "array",
                 "doc": "An array of tokens.",
                 "optional": False,
-            }
+            },
+            "document_languages": {
+                "type": "array",
+                "doc": "The NLTK language (e.g. 'italian') of each document, to remove only the stop words of that language from each document.",
+                "optional": True,
+            },
         }
 
     def create_outputs_schema(self):
@@ -100,19 +374,92 @@ class RemoveSw(KiaraModule):
     def process(self, inputs, outputs):
         import pyarrow as pa # type: ignore
         from pyarrow import compute as pc # type: ignore
-        
+
+        from kiara_plugin.topic_modelling.utils import transform_tokens
+
         tokens_array = inputs.get_value_data("tokens_array")
         sw_list = inputs.get_value_data("stopwords_list")
-        
-        stopwords_set = set(sw_list)
+        document_languages = inputs.get_value_data("document_languages")
+
+        if sw_list is None and document_languages is None:
+            raise KiaraProcessingException("Either a stop words list or the document languages are needed.")
+
+        stopwords = pa.array(list(set(sw_list or [])), type=pa.large_string())
         tokens_array_pa = tokens_array.arrow_array
-        
-        def remove_stopwords(words, stopwords_set):
-            return [word for word in words if word not in stopwords_set]
+
+        if document_languages is not None:
+            remove_stopwords = self.create_language_filter(
+                tokens_array_pa, document_languages.arrow_array, stopwords
+            )
+        else:
+            def remove_stopwords(tokens):
+                return tokens, pc.invert(pc.is_in(tokens, value_set=stopwords))
 
         try:
-            tokens_nostop = pa.array([remove_stopwords(words, stopwords_set) for words in tokens_array_pa.to_pylist()])
+            tokens_nostop = transform_tokens(
+                tokens_array_pa, remove_stopwords, with_doc_ids=document_languages is not None
+            )
         except Exception as e:
             raise KiaraProcessingException(f"An error occurred while removing stop words: {e}")
 
-        outputs.set_value("tokens_array", tokens_nostop)
\ No newline at end of file
+        outputs.set_value("tokens_array", tokens_nostop)
+
+    def create_language_filter(self, tokens_array, document_languages, stopwords):
+        """Create a transformation for 'transform_tokens' (with document ids) that removes the stop words of the language of each document.
+
+        The tokens of a chunk are dictionary encoded, every stop words list of a language in the chunk is looked up once in the (small) dictionary,
+        and every token is then checked with an array lookup by the language of its document and its dictionary index.
+        """
+
+        import nltk  # type: ignore
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+        from nltk.corpus import stopwords as nltk_stopwords  # type: ignore
+
+        nltk.download('stopwords', quiet=True)
+
+        if len(document_languages) != len(tokens_array):
+            raise KiaraProcessingException(
+                f"The document languages array has {len(document_languages)} rows, but the tokens array has {len(tokens_array)}. Both need to be created from the same corpus."
+            )
+
+        languages = pc.unique(document_languages.cast(pa.string())).drop_null().to_pylist()
+        nltk_languages = set(nltk_stopwords.fileids())
+        for lang in languages:
+            if lang not in nltk_languages:
+                raise KiaraProcessingException(f"Language '{lang}' not supported by NLTK.")
+
+        # documents without a language get the id after the last language, with the stop words of all languages;
+        # the custom stop words are removed from all documents
+        custom = stopwords.to_pylist()
+        language_stopwords = [nltk_stopwords.words(lang) for lang in languages]
+        language_stopwords.append([word for words in language_stopwords for word in words])
+        language_stopwords = [
+            pa.array(sorted(set(words) | set(custom)), type=pa.large_string()) for words in language_stopwords
+        ]
+
+        language_ids = pc.fill_null(
+            pc.index_in(document_languages.cast(pa.string()), value_set=pa.array(languages, type=pa.string())),
+            len(languages),
+        )
+        language_ids = np.concatenate(
+            [c.to_numpy(zero_copy_only=False) for c in getattr(language_ids, "chunks", [language_ids])]
+            or [np.empty(0, dtype=np.int32)]
+        ).astype(np.int64)
+
+        def remove_stopwords(tokens, doc_ids):
+            encoded = pc.dictionary_encode(tokens)
+            dictionary = encoded.dictionary
+            # null tokens get the index after the last term, which is never a stop word
+            term_ids = pc.fill_null(encoded.indices, len(dictionary)).to_numpy(zero_copy_only=False)
+            token_languages = language_ids[doc_ids]
+
+            is_stopword = np.zeros((len(language_stopwords), len(dictionary) + 1), dtype=bool)
+            for language_id in np.unique(token_languages):
+                is_stopword[language_id, :-1] = pc.is_in(
+                    dictionary, value_set=language_stopwords[language_id]
+                ).to_numpy(zero_copy_only=False)
+            return tokens, pa.array(~is_stopword[token_languages, term_ids])
+
+        return remove_stopwords
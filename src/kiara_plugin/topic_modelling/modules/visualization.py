@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+from kiara.api import KiaraModule
+from kiara.exceptions import KiaraProcessingException
+
+
+class PrepareTopicVisualization(KiaraModule):
+    """
+    This module prepares the data for an interactive (pyLDAvis-style) visualization of a topic model created by 'topic_modelling.lda' or 'topic_modelling.nmf'.
+
+    It computes the Jensen-Shannon distances between the topics, a 2-D projection of those distances (principal coordinate analysis), the prevalence of each topic,
+    the saliency of the terms, and the relevance of the terms for each topic, for a range of lambda values (lambda = 1 ranks terms by their weight in the topic,
+    lambda = 0 by their lift). Term and document frequencies are counted from the tokens array the model was trained on.
+    All tables are computed with vectorized NumPy from the topic-term and document-topic matrices of the model.
+    """
+
+    _module_type_name = "topic_modelling.topic_visualization_data"
+
+    def create_inputs_schema(self):
+        return {
+            "topic_terms": {
+                "type": "table",
+                "doc": "The topic terms table of the model, with a 'term' column and one 'topic_<n>' column per topic.",
+                "optional": False,
+            },
+            "document_topics": {
+                "type": "table",
+                "doc": "The document topics table of the model, with a 'doc_id' column and one 'topic_<n>' column per topic.",
+                "optional": False,
+            },
+            "tokens_array": {
+                "type": "array",
+                "doc": "Array that contains the tokens the model was trained on.",
+                "optional": False,
+            },
+            "num_terms": {
+                "type": "integer",
+                "doc": "Number of terms per topic (and lambda value) in the term relevance table, and in the term saliency table.",
+                "optional": True,
+                "default": 30
+            },
+            "lambda_step": {
+                "type": "float",
+                "doc": "Step size of the lambda values (between 0 and 1) the term relevance is computed for.",
+                "optional": True,
+                "default": 0.01
+            },
+        }
+
+    def create_outputs_schema(self):
+        return {
+            "topic_coordinates": {
+                "type": "table",
+                "doc": "The 2-D coordinates and the prevalence of each topic (topic_id, x, y, token_count, prevalence)."
+            },
+            "topic_distances": {
+                "type": "table",
+                "doc": "The Jensen-Shannon distance (base 2, between 0 and 1) of each pair of topics (topic_a, topic_b, distance), with topic_a < topic_b."
+            },
+            "term_relevance": {
+                "type": "table",
+                "doc": "The most relevant terms of each topic for each lambda value, in long format (topic_id, lambda, rank, term, relevance, weight, topic_term_frequency, term_frequency)."
+            },
+            "term_saliency": {
+                "type": "table",
+                "doc": "The most salient terms of the corpus (rank, term, term_frequency, distinctiveness, saliency)."
+            },
+        }
+
+    def process(self, inputs, outputs):
+
+        import numpy as np
+        import pyarrow as pa  # type: ignore
+        import pyarrow.compute as pc  # type: ignore
+
+        from kiara_plugin.topic_modelling.utils import flatten_tokens, get_topic_columns, top_k
+
+        topic_terms: pa.Table = inputs.get_value_data("topic_terms").arrow_table
+        doc_topics: pa.Table = inputs.get_value_data("document_topics").arrow_table
+        tokens_array_pa = inputs.get_value_data("tokens_array").arrow_array
+        num_terms = inputs.get_value_data("num_terms")
+        lambda_step = inputs.get_value_data("lambda_step")
+
+        topic_cols = get_topic_columns(topic_terms)
+        if "term" not in topic_terms.column_names or not topic_cols:
+            raise KiaraProcessingException(
+                "The topic terms table needs a 'term' column and at least one 'topic_<n>' column."
+            )
+        if get_topic_columns(doc_topics) != topic_cols:
+            raise KiaraProcessingException(
+                "The document topics table needs to have the same 'topic_<n>' columns as the topic terms table."
+            )
+        if doc_topics.num_rows != len(tokens_array_pa):
+            raise KiaraProcessingException(
+                f"The document topics table has {doc_topics.num_rows} rows, but the tokens array has {len(tokens_array_pa)}. Both need to be created from the same corpus."
+            )
+        if not 0 < lambda_step <= 1:
+            raise KiaraProcessingException(
+                f"Invalid lambda step '{lambda_step}', needs to be larger than 0 and at most 1."
+            )
+
+        terms = topic_terms.column("term").combine_chunks()
+        phi = np.column_stack([topic_terms.column(c).to_numpy() for c in topic_cols]).T.astype(np.float64)
+        theta = np.column_stack([doc_topics.column(c).to_numpy() for c in topic_cols]).astype(np.float64)
+        phi = self.normalize_rows(np.clip(phi, 0, None))
+        theta = self.normalize_rows(np.clip(theta, 0, None))
+
+        # term frequencies and document lengths, counted over the terms of the model's vocabulary
+        flat_tokens, doc_ids = flatten_tokens(tokens_array_pa)
+        term_ids = pc.fill_null(pc.index_in(flat_tokens, value_set=terms), -1)
+        term_ids = np.concatenate(
+            [c.to_numpy(zero_copy_only=False) for c in term_ids.chunks]
+            or [np.empty(0, dtype=np.int32)]
+        )
+        valid = term_ids >= 0
+        term_frequency = np.bincount(term_ids[valid], minlength=len(terms)).astype(np.float64)
+        doc_lengths = np.bincount(doc_ids[valid], minlength=len(tokens_array_pa)).astype(np.float64)
+
+        if term_frequency.sum() == 0:
+            raise KiaraProcessingException(
+                "None of the terms of the model occur in the tokens array, please check that it is the array the model was trained on."
+            )
+
+        topic_frequency = theta.T @ doc_lengths
+        prevalence = topic_frequency / topic_frequency.sum()
+        term_proportion = term_frequency / term_frequency.sum()
+
+        distances = self.js_distances(phi)
+        coordinates = self.principal_coordinates(distances)
+
+        topic_ids = np.arange(len(topic_cols), dtype=np.int32)
+        topic_a, topic_b = np.triu_indices(len(topic_cols), k=1)
+
+        # estimated frequency of each term in each topic, scaled so the topics add up to the term frequency
+        topic_term_frequency = phi * topic_frequency[:, None]
+        topic_term_frequency *= term_frequency / np.maximum(topic_term_frequency.sum(axis=0), np.finfo(np.float64).tiny)
+
+        # saliency (Chuang et al., 2012)
+        topic_given_term = self.normalize_rows((phi * topic_frequency[:, None]).T).T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kernel = np.where(
+                topic_given_term > 0,
+                topic_given_term * np.log(topic_given_term / np.maximum(prevalence, np.finfo(np.float64).tiny)[:, None]),
+                0,
+            )
+        distinctiveness = kernel.sum(axis=0)
+        saliency = term_proportion * distinctiveness
+        salient_terms, salient_values = top_k(saliency[None, :], num_terms)
+
+        # relevance (Sievert and Shirley, 2014)
+        tiny = np.finfo(np.float64).tiny
+        log_weight = np.log(np.maximum(phi, tiny))
+        log_lift = log_weight - np.log(np.maximum(term_proportion, tiny))
+        # terms that don't occur in the tokens array are never relevant
+        missing = term_proportion == 0
+        lambdas = np.round(np.arange(0, 1 + lambda_step / 2, lambda_step), 6)
+        relevance_tables = []
+        for lambda_ in lambdas:
+            relevance = lambda_ * log_weight + (1 - lambda_) * log_lift
+            relevance[:, missing] = -np.inf
+            indices, values = top_k(relevance, num_terms)
+            k = indices.shape[1]
+            rows = np.repeat(topic_ids, k)
+            columns = indices.ravel()
+            relevance_tables.append(pa.table({
+                "topic_id": pa.array(rows),
+                "lambda": pa.array(np.full(len(rows), lambda_)),
+                "rank": pa.array(np.tile(np.arange(1, k + 1, dtype=np.int32), len(topic_ids))),
+                "term": terms.take(pa.array(columns)),
+                "relevance": pa.array(values.ravel().astype(np.float32)),
+                "weight": pa.array(phi[rows, columns].astype(np.float32)),
+                "topic_term_frequency": pa.array(topic_term_frequency[rows, columns].astype(np.float32)),
+                "term_frequency": pa.array(term_frequency[columns].astype(np.int64)),
+            }))
+
+        outputs.set_value("topic_coordinates", pa.table({
+            "topic_id": pa.array(topic_ids),
+            "x": pa.array(coordinates[:, 0].astype(np.float32)),
+            "y": pa.array(coordinates[:, 1].astype(np.float32)),
+            "token_count": pa.array(topic_frequency.astype(np.float32)),
+            "prevalence": pa.array(prevalence.astype(np.float32)),
+        }))
+        outputs.set_value("topic_distances", pa.table({
+            "topic_a": pa.array(topic_a.astype(np.int32)),
+            "topic_b": pa.array(topic_b.astype(np.int32)),
+            "distance": pa.array(distances[topic_a, topic_b].astype(np.float32)),
+        }))
+        outputs.set_value("term_relevance", pa.concat_tables(relevance_tables))
+        outputs.set_value("term_saliency", pa.table({
+            "rank": pa.array(np.arange(1, salient_terms.shape[1] + 1, dtype=np.int32)),
+            "term": terms.take(pa.array(salient_terms[0])),
+            "term_frequency": pa.array(term_frequency[salient_terms[0]].astype(np.int64)),
+            "distinctiveness": pa.array(distinctiveness[salient_terms[0]].astype(np.float32)),
+            "saliency": pa.array(salient_values[0].astype(np.float32)),
+        }))
+
+    def js_distances(self, distributions):
+        """Compute the Jensen-Shannon distances (base 2) between all pairs of rows of a matrix of probability distributions."""
+
+        import numpy as np
+        from scipy.special import rel_entr  # type: ignore
+
+        num_rows = distributions.shape[0]
+        distances = np.zeros((num_rows, num_rows))
+        # one row against all others at a time, so memory stays at (rows x columns)
+        for row in range(num_rows):
+            middle = (distributions[row] + distributions) / 2
+            divergence = (
+                rel_entr(distributions[row], middle).sum(axis=1)
+                + rel_entr(distributions, middle).sum(axis=1)
+            ) / (2 * np.log(2))
+            distances[row] = np.sqrt(np.clip(divergence, 0, 1))
+        np.fill_diagonal(distances, 0)
+        return distances
+
+    def principal_coordinates(self, distances, dimensions=2):
+        """Project a distance matrix to 'dimensions' coordinates with principal coordinate analysis (classical multidimensional scaling)."""
+
+        import numpy as np
+
+        num_rows = distances.shape[0]
+        centering = np.eye(num_rows) - np.full((num_rows, num_rows), 1 / num_rows)
+        gram = -0.5 * centering @ (distances ** 2) @ centering
+
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        order = np.argsort(eigenvalues)[::-1][:dimensions]
+        coordinates = eigenvectors[:, order] * np.sqrt(np.clip(eigenvalues[order], 0, None))
+
+        if coordinates.shape[1] < dimensions:
+            coordinates = np.hstack([coordinates, np.zeros((num_rows, dimensions - coordinates.shape[1]))])
+        return coordinates
+
+    @staticmethod
+    def normalize_rows(matrix):
+        """Scale the rows of a matrix to sum to 1 (rows that sum to 0 are left as they are)."""
+
+        import numpy as np
+
+        sums = matrix.sum(axis=1, keepdims=True)
+        return matrix / np.where(sums > 0, sums, 1)
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""Helper functions that are shared between the modules of the ``kiara_plugin.topic_modelling`` package.
+"""
+
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pyarrow as pa
+    from scipy import sparse  # type: ignore
+
+
+# number of documents that are converted between Python objects and Arrow at a time
+TOKENS_BATCH_SIZE = 10_000
+
+
+def get_tokens_type() -> "pa.DataType":
+    """Return the Arrow type of the token arrays created by the modules of this package.
+
+    64-bit offsets are used, so token arrays don't overflow past 2 GB of token data.
+    """
+
+    import pyarrow as pa  # type: ignore
+
+    return pa.large_list(pa.large_string())
+
+
+def iter_batches(
+    array: Union["pa.Array", "pa.ChunkedArray"], batch_size: int = TOKENS_BATCH_SIZE
+) -> Iterator["pa.Array"]:
+    """Iterate over (zero-copy) slices of an array, chunk by chunk."""
+
+    import pyarrow as pa  # type: ignore
+
+    chunks = [array] if isinstance(array, pa.Array) else array.chunks
+    for chunk in chunks:
+        for start in range(0, len(chunk), batch_size):
+            yield chunk.slice(start, batch_size)
+
+
+def create_tokens_array(batches: Iterable[List[Union[List[str], None]]]) -> "pa.ChunkedArray":
+    """Create a chunked token array from batches of Python token lists, one chunk per batch."""
+
+    import pyarrow as pa  # type: ignore
+
+    tokens_type = get_tokens_type()
+    chunks = [pa.array(batch, type=tokens_type) for batch in batches]
+    return pa.chunked_array(chunks, type=tokens_type)
+
+
+def transform_tokens(
+    tokens_array: Union["pa.Array", "pa.ChunkedArray"],
+    transform: Callable[..., Tuple["pa.Array", Union["pa.Array", None]]],
+    with_doc_ids: bool = False,
+) -> "pa.ChunkedArray":
+    """Apply a columnar transformation to the tokens of an array of token lists, chunk by chunk.
+
+    The transformation gets the flat tokens of a chunk, and returns the transformed tokens and an (optional) mask
+    of the tokens to keep. The lists are rebuilt from the kept tokens with 64-bit offsets, documents keep their
+    position. Arrays of plain strings are transformed directly. If 'with_doc_ids' is set, the transformation also
+    gets the index of the document (in the whole array) of every token.
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+
+    chunks = [tokens_array] if isinstance(tokens_array, pa.Array) else tokens_array.chunks
+
+    result = []
+    row_offset = 0
+    for chunk in chunks:
+        if not (pa.types.is_list(chunk.type) or pa.types.is_large_list(chunk.type)):
+            args = [chunk.cast(pa.large_string())]
+            if with_doc_ids:
+                args.append(np.arange(row_offset, row_offset + len(chunk), dtype=np.int64))
+            values, keep = transform(*args)
+            if keep is not None:
+                values = values.filter(pc.fill_null(keep, False))
+            result.append(values)
+            row_offset += len(chunk)
+            continue
+
+        parent_indices = pc.list_parent_indices(chunk)
+        args = [chunk.flatten().cast(pa.large_string())]
+        if with_doc_ids:
+            args.append(parent_indices.to_numpy(zero_copy_only=False).astype(np.int64) + row_offset)
+        values, keep = transform(*args)
+        row_offset += len(chunk)
+        if keep is not None:
+            keep = pc.fill_null(keep, False)
+            values = values.filter(keep)
+            parent_indices = parent_indices.filter(keep)
+
+        lengths = np.bincount(
+            parent_indices.to_numpy(zero_copy_only=False), minlength=len(chunk)
+        )
+        offsets = np.zeros(len(chunk) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        result.append(
+            pa.LargeListArray.from_arrays(
+                pa.array(offsets), values, mask=chunk.is_null() if chunk.null_count else None
+            )
+        )
+
+    if not result:
+        return pa.chunked_array([], type=get_tokens_type())
+    return pa.chunked_array(result)
+
+
+def flatten_tokens(
+    tokens_array: Union["pa.Array", "pa.ChunkedArray"]
+) -> Tuple["pa.ChunkedArray", "np.ndarray"]:
+    """Flatten an array of token lists.
+
+    Returns the flat tokens, and for every token the index of the document it belongs to.
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+
+    chunks = [tokens_array] if isinstance(tokens_array, pa.Array) else tokens_array.chunks
+
+    flat_chunks = []
+    doc_ids = []
+    row_offset = 0
+    for chunk in chunks:
+        flat_chunks.append(chunk.flatten().cast(pa.large_string()))
+        parent_indices = pc.list_parent_indices(chunk).to_numpy(zero_copy_only=False)
+        doc_ids.append(parent_indices.astype(np.int64) + row_offset)
+        row_offset += len(chunk)
+
+    flat_tokens = pa.chunked_array(flat_chunks, type=pa.large_string())
+    if not doc_ids:
+        return flat_tokens, np.empty(0, dtype=np.int64)
+    return flat_tokens, np.concatenate(doc_ids)
+
+
+def encode_tokens(
+    flat_tokens: "pa.ChunkedArray",
+) -> Tuple["pa.Array", "np.ndarray"]:
+    """Map flat tokens to integer term ids.
+
+    Returns the vocabulary (in order of first appearance), and the term id of every token. Null tokens get the
+    term id -1.
+    """
+
+    import numpy as np
+    import pyarrow.compute as pc  # type: ignore
+
+    vocabulary = pc.unique(flat_tokens).drop_null()
+    term_ids = pc.fill_null(pc.index_in(flat_tokens, value_set=vocabulary), -1)
+    term_ids = np.concatenate(
+        [c.to_numpy(zero_copy_only=False) for c in term_ids.chunks]
+        or [np.empty(0, dtype=np.int32)]
+    )
+    return vocabulary, term_ids
+
+
+def hash_terms(terms: "pa.Array") -> "np.ndarray":
+    """Hash the strings of an array to unsigned 64-bit integers (FNV-1a over the UTF-8 bytes), directly on the Arrow buffers.
+
+    The hashes don't depend on the process or the batch, so arrays can be hashed independently. Null strings get the hash of the empty string.
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+
+    terms = terms.cast(pa.large_string())
+    if isinstance(terms, pa.ChunkedArray):
+        terms = terms.combine_chunks()
+
+    hashes = np.full(len(terms), 14695981039346656037, dtype=np.uint64)
+    if len(terms) == 0:
+        return hashes
+
+    _, offsets_buffer, data_buffer = terms.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[terms.offset:terms.offset + len(terms) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.empty(0, dtype=np.uint8)
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+
+    # one step per byte position, over the strings that are long enough (the longest strings first)
+    order = np.argsort(-lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    prime = np.uint64(1099511628211)
+    for position in range(int(sorted_lengths[0]) if len(sorted_lengths) else 0):
+        active = order[:np.searchsorted(-sorted_lengths, -position, side="left")]
+        hashes[active] = (hashes[active] ^ data[starts[active] + position].astype(np.uint64)) * prime
+
+    return hashes
+
+
+def create_doc_term_matrix(
+    tokens_array: Union["pa.Array", "pa.ChunkedArray"]
+) -> Tuple["sparse.csr_matrix", "pa.Array"]:
+    """Create a sparse (documents x terms) count matrix from an array of token lists."""
+
+    import numpy as np
+    from scipy import sparse  # type: ignore
+
+    flat_tokens, doc_ids = flatten_tokens(tokens_array)
+    vocabulary, term_ids = encode_tokens(flat_tokens)
+
+    # null tokens are not part of the vocabulary
+    valid = term_ids >= 0
+    doc_ids = doc_ids[valid]
+    term_ids = term_ids[valid]
+
+    counts = sparse.coo_matrix(
+        (np.ones(len(term_ids), dtype=np.float32), (doc_ids, term_ids)),
+        shape=(len(tokens_array), len(vocabulary)),
+    ).tocsr()
+    counts.sum_duplicates()
+    return counts, vocabulary
+
+
+def create_tfidf_matrix(counts: "sparse.csr_matrix") -> "sparse.csr_matrix":
+    """Weight a (documents x terms) count matrix with smoothed idf, and l2-normalize the document rows."""
+
+    import numpy as np
+    from scipy import sparse  # type: ignore
+
+    num_docs = counts.shape[0]
+    doc_freqs = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + num_docs) / (1 + doc_freqs)).astype(np.float32) + 1
+
+    tfidf = counts @ sparse.diags(idf)
+    row_norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    row_norms[row_norms == 0] = 1
+    tfidf = sparse.diags(1 / row_norms) @ tfidf
+    return tfidf.astype(np.float32).tocsr()
+
+
+def filter_vocabulary(
+    counts: "sparse.csr_matrix",
+    vocabulary: "pa.Array",
+    no_below: Union[int, None] = None,
+    no_above: Union[float, None] = None,
+) -> Tuple["sparse.csr_matrix", "pa.Array"]:
+    """Remove terms from a count matrix, based on their document frequencies.
+
+    Follows the semantics of gensim's ``Dictionary.filter_extremes``: ``no_below`` is an absolute number of documents,
+    ``no_above`` a fraction of the total number of documents.
+    """
+
+    import numpy as np
+
+    doc_freqs = np.asarray((counts > 0).sum(axis=0)).ravel()
+    keep = np.ones(len(doc_freqs), dtype=bool)
+    if no_below:
+        keep &= doc_freqs >= no_below
+    if no_above:
+        keep &= doc_freqs <= no_above * counts.shape[0]
+
+    keep_idx = np.flatnonzero(keep)
+    return counts[:, keep_idx], vocabulary.take(keep_idx)
+
+
+def format_topic(terms: List[str], weights: List[float]) -> str:
+    """Format the top terms of a topic the same way gensim's ``print_topics`` does."""
+
+    return " + ".join(f'{weight:.3f}*"{term}"' for term, weight in zip(terms, weights))
+
+
+def create_document_topics_table(doc_topic: "np.ndarray") -> "pa.Table":
+    """Create a table with a 'doc_id' column and one 'topic_<n>' weight column per topic.
+
+    The 'doc_id' is the position of the document in the tokens array (and in the corpus table it was created from).
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+
+    doc_topic = np.asarray(doc_topic, dtype=np.float32)
+    columns = {"doc_id": pa.array(np.arange(doc_topic.shape[0], dtype=np.int64))}
+    for topic_id in range(doc_topic.shape[1]):
+        columns[f"topic_{topic_id}"] = pa.array(doc_topic[:, topic_id])
+    return pa.table(columns)
+
+
+def create_topic_terms_table(topic_term: "np.ndarray", terms: "pa.Array") -> "pa.Table":
+    """Create a table with a 'term' column and one 'topic_<n>' column with the term weights of each topic.
+
+    This is the full (transposed) topic-term matrix of a model, with one row per term of the vocabulary.
+    """
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+
+    topic_term = np.asarray(topic_term, dtype=np.float32)
+    columns = {"term": terms}
+    for topic_id in range(topic_term.shape[0]):
+        columns[f"topic_{topic_id}"] = pa.array(topic_term[topic_id])
+    return pa.table(columns)
+
+
+def get_topic_columns(document_topics: "pa.Table") -> List[str]:
+    """Return the names of the topic weight columns ('topic_<n>') of a document topics table, ordered by topic id."""
+
+    import re
+
+    topic_columns = [c for c in document_topics.column_names if re.fullmatch(r"topic_\d+", c)]
+    return sorted(topic_columns, key=lambda c: int(c[len("topic_"):]))
+
+
+def top_k(matrix: "np.ndarray", k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Find the k largest values of each row of a matrix, with 'argpartition' (no full sort).
+
+    Returns the column indices and the values, both sorted in descending order of value per row.
+    """
+
+    import numpy as np
+
+    k = min(k, matrix.shape[1])
+    if k <= 0:
+        empty = np.empty((matrix.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(matrix.dtype)
+
+    indices = np.argpartition(-matrix, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(matrix, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def create_topic_words_table(
+    topic_term: "np.ndarray", terms: "pa.Array", num_words: int
+) -> "pa.Table":
+    """Create a long-format table (topic_id, rank, term, weight) of the top words of each topic."""
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+
+    indices, weights = top_k(topic_term, num_words)
+    num_topics, k = indices.shape
+    return pa.table({
+        "topic_id": pa.array(np.repeat(np.arange(num_topics, dtype=np.int32), k)),
+        "rank": pa.array(np.tile(np.arange(1, k + 1, dtype=np.int32), num_topics)),
+        "term": terms.take(pa.array(indices.ravel())),
+        "weight": pa.array(weights.ravel().astype(np.float32)),
+    })
+
+
+def create_top_documents_table(doc_topic: "np.ndarray", num_documents: int) -> "pa.Table":
+    """Create a long-format table (topic_id, rank, doc_id, weight) of the documents with the highest weight for each topic."""
+
+    import numpy as np
+    import pyarrow as pa  # type: ignore
+
+    indices, weights = top_k(np.ascontiguousarray(doc_topic.T), num_documents)
+    num_topics, k = indices.shape
+    return pa.table({
+        "topic_id": pa.array(np.repeat(np.arange(num_topics, dtype=np.int32), k)),
+        "rank": pa.array(np.tile(np.arange(1, k + 1, dtype=np.int32), num_topics)),
+        "doc_id": pa.array(indices.ravel().astype(np.int64)),
+        "weight": pa.array(weights.ravel().astype(np.float32)),
+    })
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from kiara.api import KiaraAPI
+from kiara.models.values.value import Value
+
+
+def check_topics(topics: Value):
+
+    assert [topic_id for topic_id, _ in topics.data.list_data] == [0, 1, 2]
+
+
+def check_document_topics(kiara_api: KiaraAPI, document_topics: Value):
+
+    table = document_topics.data.arrow_table
+    num_docs = len(kiara_api.get_value("alias:tokens_array_no_stopwords").data.arrow_array)
+
+    assert table.column_names == ["doc_id", "topic_0", "topic_1", "topic_2"]
+    assert table.column("doc_id").to_pylist() == list(range(num_docs))
+
+    weights = np.column_stack([table.column(c).to_numpy() for c in table.column_names[1:]])
+    assert (weights >= 0).all()
+    # documents without any term of the vocabulary have no topic weights
+    sums = weights.sum(axis=1)
+    assert (np.isclose(sums, 1.0, rtol=1e-4) | (sums == 0)).all()
+
+
+def check_topic_words(topic_words: Value):
+
+    table = topic_words.data.arrow_table
+    assert set(table.column("topic_id").to_pylist()) == {0, 1, 2}
+    assert (np.diff(table.column("weight").to_numpy()[:30]) <= 0).all()
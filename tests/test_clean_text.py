@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.clean_text`."""
+
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+OCR_TEXTS = [
+    # hyphenated across a line break, a form feed, a soft hyphen and a double space
+    "Il gior-\nnale\x0c della  sera\u00ad",
+    # a page header, decomposed accents, and surrounding whitespace
+    "Pagina 12\ncaffe\u0301 e te\u0301 ",
+    None,
+    "",
+]
+
+
+def test_cleaning_report(kiara_api: KiaraAPI):
+
+    result = kiara_api.run_job(
+        "topic_modelling.clean_text",
+        inputs={"corpus_array": pa.array(OCR_TEXTS), "junk_patterns": [r"Pagina \d+"]},
+        comment="clean ocr texts",
+    )
+
+    assert result["corpus_array"].data.arrow_array.to_pylist() == ["Il giornale della sera", "caff\u00e9 e t\u00e9", None, ""]
+
+    report = result["cleaning_report"].data.arrow_table.to_pylist()
+    assert report == [
+        {"rule": "normalize_unicode", "pattern": "NFC", "characters_removed": 2},
+        {"rule": "remove_control_characters", "pattern": r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\x{AD}]", "characters_removed": 2},
+        {"rule": "dehyphenate", "pattern": r"(\pL)-[ \t]*\r?\n[ \t]*(\pL)", "characters_removed": 2},
+        {"rule": "junk_pattern", "pattern": r"Pagina \d+", "characters_removed": 9},
+        {"rule": "collapse_whitespace", "pattern": r"\s+", "characters_removed": 3},
+    ]
+
+
+def test_rules_can_be_disabled(kiara_api: KiaraAPI):
+
+    result = kiara_api.run_job(
+        "topic_modelling.clean_text",
+        inputs={
+            "corpus_array": pa.array(OCR_TEXTS),
+            "normalize_unicode": False,
+            "dehyphenate": False,
+            "collapse_whitespace": False,
+        },
+        comment="clean ocr texts, control characters only",
+    )
+
+    assert result["corpus_array"].data.arrow_array.to_pylist() == [
+        "Il gior-\nnale della  sera",
+        "Pagina 12\ncaffe\u0301 e te\u0301 ",
+        None,
+        "",
+    ]
+    report = result["cleaning_report"].data.arrow_table
+    assert report.column("rule").to_pylist() == ["remove_control_characters"]
+    assert report.column("characters_removed").to_pylist() == [2]
+
+
+def test_invalid_junk_pattern(kiara_api: KiaraAPI):
+
+    with pytest.raises(Exception, match="Invalid cleaning pattern"):
+        kiara_api.run_job(
+            "topic_modelling.clean_text",
+            inputs={"corpus_array": pa.array(OCR_TEXTS), "junk_patterns": ["(unclosed"]},
+            comment="invalid junk pattern",
+        )
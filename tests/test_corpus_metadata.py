@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the corpus metadata modules (`topic_modelling.topic_distribution`, `topic_modelling.term_distribution`,
+`topic_modelling.sample_corpus`)."""
+
+from datetime import date
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+CORPUS_TABLE = pa.table({
+    "date": ["1900-01-05", "1900-01-20", "1900-02-01", "1900-01-12", "1901-03-03"],
+    "publication_ref": ["sn1", "sn1", "sn1", "sn2", "sn2"],
+})
+
+
+def test_topic_distribution(kiara_api: KiaraAPI):
+
+    document_topics = pa.table({
+        "doc_id": pa.array(np.arange(5, dtype=np.int64)),
+        "topic_0": [0.8, 0.4, 0.1, 0.5, 0.3],
+        "topic_1": [0.2, 0.6, 0.9, 0.5, 0.7],
+    })
+
+    result = kiara_api.run_job(
+        "topic_modelling.topic_distribution",
+        inputs={
+            "periodicity": "month",
+            "date_col": "date",
+            "publication_ref_col": "publication_ref",
+            "corpus_table": CORPUS_TABLE,
+            "document_topics": document_topics,
+        },
+        comment="topic distribution by month",
+    )
+
+    dist_table = result["dist_table"].data.arrow_table
+    rows = [
+        (row["date"], row["publication_name"], row["topic_id"], row["doc_count"])
+        for row in dist_table.to_pylist()
+    ]
+    january, february, march = date(1900, 1, 1), date(1900, 2, 1), date(1901, 3, 1)
+    assert rows == [
+        (january, "sn1", 0, 2),
+        (january, "sn1", 1, 2),
+        (january, "sn2", 0, 1),
+        (january, "sn2", 1, 1),
+        (february, "sn1", 0, 1),
+        (february, "sn1", 1, 1),
+        (march, "sn2", 0, 1),
+        (march, "sn2", 1, 1),
+    ]
+    np.testing.assert_allclose(dist_table.column("weight_sum").to_numpy(), [1.2, 0.8, 0.5, 0.5, 0.1, 0.9, 0.3, 0.7])
+    np.testing.assert_allclose(dist_table.column("weight_mean").to_numpy(), [0.6, 0.4, 0.5, 0.5, 0.1, 0.9, 0.3, 0.7])
+
+    # the mean weights are the prevalence of the topics in a period and publication, they add up to 1
+    prevalence = dist_table.group_by(["date", "publication_name"]).aggregate([("weight_mean", "sum")])
+    np.testing.assert_allclose(prevalence.column("weight_mean_sum").to_numpy(), 1.0)
+
+
+def test_term_distribution(kiara_api: KiaraAPI):
+
+    corpus_table = pa.table({
+        "date": ["1900-01-05", "1900-01-20", None, "1900-03-12", None],
+        "publication_ref": ["sn1", "sn1", "sn1", "sn1", "sn1"],
+    })
+    tokens = [
+        ["camorra", "napoli", "polizia"],
+        ["camorra", "camorra"],
+        ["camorra", "sciopero", "sciopero", "lavoro"],
+        None,
+        ["napoli"],
+    ]
+
+    result = kiara_api.run_job(
+        "topic_modelling.term_distribution",
+        inputs={
+            "periodicity": "month",
+            "date_col": "date",
+            "publication_ref_col": "publication_ref",
+            "corpus_table": corpus_table,
+            "tokens_array": pa.array(tokens),
+            "terms": ["camorra", "sciopero", "brigante"],
+        },
+        comment="term distribution by month",
+    )
+
+    # documents without a date are counted in a period with a null date, with the tokens of all of them as total
+    rows = [tuple(row.values()) for row in result["dist_table"].data.arrow_table.to_pylist()]
+    january = date(1900, 1, 1)
+    assert rows == [
+        (january, "sn1", "camorra", 3, 5, 0.6),
+        (None, "sn1", "camorra", 1, 5, 0.2),
+        (None, "sn1", "sciopero", 2, 5, 0.4),
+    ]
+
+
+def get_strata_table() -> pa.Table:
+
+    # strata by publication and year: 20 (sn1, 1900), 5 (sn1, 1901), 10 (sn2, 1900) and 3 (sn2, no date) documents
+    strata = [("sn1", "1900-05-01")] * 20 + [("sn1", "1901-02-03")] * 5 + [("sn2", "1900-07-08")] * 10 + [("sn2", None)] * 3
+    rng = np.random.default_rng(1)
+    order = rng.permutation(len(strata))
+    return pa.table({
+        "id": list(range(len(strata))),
+        "publication_ref": [strata[i][0] for i in order],
+        "date": [strata[i][1] for i in order],
+    })
+
+
+@pytest.mark.parametrize(
+    "inputs, expected",
+    [
+        ({"sample_fraction": 0.2}, {("sn1", "1900"): 4, ("sn1", "1901"): 1, ("sn2", "1900"): 2, ("sn2", None): 1}),
+        (
+            {"sample_fraction": 0.2, "max_per_stratum": 3},
+            {("sn1", "1900"): 3, ("sn1", "1901"): 1, ("sn2", "1900"): 2, ("sn2", None): 1},
+        ),
+        ({"sample_fraction": 0.2, "stratify_by": "publication"}, {"sn1": 5, "sn2": 3}),
+        ({"sample_fraction": 0.5, "stratify_by": "period"}, {"1900": 15, "1901": 2, None: 2}),
+    ],
+)
+def test_sample_corpus_stratum_sizes(kiara_api: KiaraAPI, inputs, expected):
+
+    corpus_table = get_strata_table()
+
+    def sample(random_state):
+        result = kiara_api.run_job(
+            "topic_modelling.sample_corpus",
+            inputs={"corpus_table": corpus_table, "random_state": random_state, **inputs},
+            comment="stratified sample",
+        )
+        return result["corpus_table"].data.arrow_table
+
+    sampled = sample(random_state=3)
+
+    stratify_by = inputs.get("stratify_by", "publication_period")
+    sizes = {}
+    for row in sampled.to_pylist():
+        year = row["date"][:4] if row["date"] else None
+        key = {"publication": row["publication_ref"], "period": year, "publication_period": (row["publication_ref"], year)}[stratify_by]
+        sizes[key] = sizes.get(key, 0) + 1
+    assert sizes == expected
+
+    # the order of the corpus table is kept, and the sample is reproducible
+    ids = sampled.column("id").to_pylist()
+    assert ids == sorted(ids)
+    assert sample(random_state=3).equals(sampled)
+
+
+def test_invalid_sample_fraction(kiara_api: KiaraAPI):
+
+    with pytest.raises(Exception, match="Invalid sample fraction"):
+        kiara_api.run_job(
+            "topic_modelling.sample_corpus",
+            inputs={"corpus_table": get_strata_table(), "sample_fraction": 0.0},
+            comment="invalid sample fraction",
+        )
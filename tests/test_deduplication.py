@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.deduplicate`."""
+
+import numpy as np
+import pyarrow as pa
+
+from kiara.api import KiaraAPI
+from kiara_plugin.topic_modelling.modules.deduplication import Deduplicate
+
+
+def test_bucket_with_colliding_first_member():
+
+    # 2 bands of 4 rows: all documents but the last share a bucket in the first band, and none in the second one
+    signatures = np.array(
+        [
+            [1, 1, 1, 1, 5, 5, 5, 5],  # collides with 1 and 2, but is not similar to them
+            [1, 1, 1, 1, 2, 2, 2, 3],
+            [1, 1, 1, 1, 2, 2, 2, 4],  # duplicate of 1 (estimated similarity 0.875)
+            [7, 7, 7, 7, 7, 7, 7, 7],
+        ],
+        dtype=np.uint32,
+    )
+
+    cluster_ids = Deduplicate().cluster(signatures, np.arange(4), bands=2, threshold=0.8)
+
+    assert cluster_ids.tolist() == [0, 1, 1, 3]
+
+
+def test_deduplicate_removes_reprints(kiara_api: KiaraAPI):
+
+    words = [f"word{i}" for i in range(200)]
+    tokens = [words[0:50], words[50:100], words[0:50], words[100:150], [*words[50:99], "other"]]
+    corpus_table = pa.table({"id": list(range(len(tokens)))})
+
+    result = kiara_api.run_job(
+        "topic_modelling.deduplicate",
+        inputs={"corpus_table": corpus_table, "tokens_array": pa.array(tokens), "threshold": 0.8},
+        comment="deduplicate reprints",
+    )
+
+    assert result["cluster_ids"].data.arrow_array.to_pylist() == [0, 1, 0, 3, 1]
+    assert result["corpus_table"].data.arrow_table.column("id").to_pylist() == [0, 1, 3]
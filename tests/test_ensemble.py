@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.lda_ensemble`."""
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+from kiara_plugin.topic_modelling.modules import ensemble
+from kiara_plugin.topic_modelling.modules.ensemble import RunLdaEnsemble
+
+
+def create_separable_tokens(num_docs: int = 60, doc_length: int = 20) -> pa.Array:
+
+    # every document draws its tokens from the vocabulary of one of three topics, which share no term
+    rng = np.random.default_rng(2)
+    vocabularies = [[f"{prefix}{i}" for i in range(10)] for prefix in "abc"]
+    return pa.array([
+        rng.choice(vocabularies[doc % 3], size=doc_length).tolist() for doc in range(num_docs)
+    ])
+
+
+def run_ensemble(kiara_api: KiaraAPI, **inputs):
+
+    return kiara_api.run_job(
+        "topic_modelling.lda_ensemble",
+        inputs={
+            "tokens_array": create_separable_tokens(),
+            "num_topics": 3,
+            "num_runs": 3,
+            # the runs with these random states all find the three topics, LDA doesn't with every random state
+            "random_state": 14,
+            "passes": 10,
+            "chunksize": 20,
+            "workers": 1,
+            **inputs,
+        },
+        comment="lda ensemble",
+    )
+
+
+def test_identical_seeds_are_stable(kiara_api: KiaraAPI, monkeypatch):
+
+    train_lda_run = ensemble._train_lda_run
+
+    def train_with_first_seed(corpus_path, dictionary_path, num_topics, random_state, *args):
+        return train_lda_run(corpus_path, dictionary_path, num_topics, 14, *args)
+
+    monkeypatch.setattr(ensemble, "_train_lda_run", train_with_first_seed)
+    result = run_ensemble(kiara_api)
+
+    stability = result["topic_stability"].data.arrow_table
+    np.testing.assert_allclose(stability.column("stability_mean").to_numpy(), 1.0, rtol=1e-5)
+    np.testing.assert_allclose(stability.column("stability_min").to_numpy(), 1.0, rtol=1e-5)
+
+    # every run found the same topics, in the same order
+    alignment = result["run_alignment"].data.arrow_table
+    assert alignment.column("run_topic_id").to_pylist() == [0, 1, 2] * 3
+    assert alignment.column("random_state").to_pylist() == [14] * 3 + [15] * 3 + [16] * 3
+
+
+def test_separable_topics_are_stable(kiara_api: KiaraAPI):
+
+    result = run_ensemble(kiara_api)
+
+    stability = result["topic_stability"].data.arrow_table
+    assert (stability.column("stability_min").to_numpy() > 0.95).all()
+
+    # each consensus topic is one of the vocabularies
+    topic_words = result["topic_words"].data.arrow_table
+    prefixes = set()
+    for topic_id in range(3):
+        terms = topic_words.filter(pa.compute.equal(topic_words.column("topic_id"), topic_id)).column("term").to_pylist()
+        assert len({term[0] for term in terms[:10]}) == 1
+        prefixes.add(terms[0][0])
+    assert prefixes == {"a", "b", "c"}
+
+
+def test_align_permuted_topics():
+
+    rng = np.random.default_rng(0)
+    topics = rng.dirichlet(np.full(20, 0.1), size=4)
+    permutations = [[0, 1, 2, 3], [2, 0, 3, 1], [3, 2, 1, 0]]
+    run_topics = np.stack([topics[permutation] for permutation in permutations])
+
+    reference, matches, similarities = RunLdaEnsemble().align(run_topics)
+
+    # the topics of every run are matched to the same topics of the reference run
+    for run, permutation in enumerate(permutations):
+        np.testing.assert_array_equal(
+            np.array(permutation)[matches[run]], np.array(permutations[reference])
+        )
+    np.testing.assert_allclose(similarities, 1.0)
+
+
+def test_invalid_number_of_runs(kiara_api: KiaraAPI):
+
+    with pytest.raises(Exception, match="Invalid number of runs"):
+        run_ensemble(kiara_api, num_runs=1)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.export_parquet`."""
+
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+from kiara.api import KiaraAPI
+
+CORPUS_TABLE = pa.table({
+    "file_name": [f"file_{i}.txt" for i in range(6)],
+    "date": ["1900-01-05", "1901-03-02", "1900-07-08", None, "1901-11-30", "1900-02-01"],
+    "publication_ref": ["sn1", "sn2", "sn1", "sn2", "sn1", "sn2"],
+})
+TOKENS = [["camorra"], ["polizia", "napoli"], [], None, ["sciopero"], ["austria", "trieste", "vienna"]]
+
+
+def export(kiara_api: KiaraAPI, export_dir: Path, **inputs):
+
+    result = kiara_api.run_job(
+        "topic_modelling.export_parquet",
+        inputs={"corpus_table": CORPUS_TABLE, "export_dir": str(export_dir), **inputs},
+        comment="export parquet datasets",
+    )
+    return result["export_statistics"].data.dict_data
+
+
+def read_dataset(path: Path) -> pa.Table:
+
+    dataset = ds.dataset(str(path), format="parquet", partitioning="hive")
+    return dataset.to_table().sort_by("doc_id")
+
+
+def test_export_round_trip(kiara_api: KiaraAPI, tmp_path: Path):
+
+    topic_words = pa.table({"topic_id": [0, 0, 1], "rank": [1, 2, 1], "term": ["camorra", "napoli", "vienna"]})
+    statistics = export(kiara_api, tmp_path, tokens_array=pa.array(TOKENS), topic_words=topic_words)
+
+    # hive layout, documents without a date are in the default partition
+    partitions = sorted(
+        os.path.relpath(root, tmp_path / "corpus") for root, _, files in os.walk(tmp_path / "corpus") if files
+    )
+    assert partitions == [
+        "publication=sn1/year=1900",
+        "publication=sn1/year=1901",
+        "publication=sn2/year=1900",
+        "publication=sn2/year=1901",
+        "publication=sn2/year=__HIVE_DEFAULT_PARTITION__",
+    ]
+    assert statistics["corpus"] == {"num_rows": 6, "num_files": 5, "num_partitions": 5}
+
+    corpus = read_dataset(tmp_path / "corpus")
+    assert corpus.column("doc_id").to_pylist() == list(range(6))
+    for column_name in CORPUS_TABLE.column_names:
+        assert corpus.column(column_name).to_pylist() == CORPUS_TABLE.column(column_name).to_pylist()
+    assert corpus.column("publication").to_pylist() == CORPUS_TABLE.column("publication_ref").to_pylist()
+    assert corpus.column("year").to_pylist() == [1900, 1901, 1900, None, 1901, 1900]
+
+    tokens = read_dataset(tmp_path / "tokens")
+    assert tokens.column("tokens").to_pylist() == TOKENS
+
+    # the partitions can be pruned by a filter on the partition keys
+    filtered = ds.dataset(str(tmp_path / "corpus"), format="parquet", partitioning="hive").to_table(
+        filter=(ds.field("publication") == "sn1") & (ds.field("year") == 1900)
+    )
+    assert sorted(filtered.column("doc_id").to_pylist()) == [0, 2]
+
+    assert ds.dataset(str(tmp_path / "topic_words"), format="parquet").to_table().equals(topic_words)
+
+
+def test_export_replaces_existing_datasets(kiara_api: KiaraAPI, tmp_path: Path, monkeypatch):
+
+    stale = tmp_path / "corpus" / "publication=old" / "year=1800"
+    stale.mkdir(parents=True)
+    (stale / "part-0.parquet").write_bytes(b"stale")
+
+    export(kiara_api, tmp_path)
+    assert not (tmp_path / "corpus" / "publication=old").exists()
+    assert read_dataset(tmp_path / "corpus").num_rows == 6
+
+    # a failed export leaves the existing dataset as it was, and no temporary directory
+    write_dataset = ds.write_dataset
+
+    def failing_write_dataset(*args, **kwargs):
+        write_dataset(*args, **kwargs)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ds, "write_dataset", failing_write_dataset)
+    with pytest.raises(Exception, match="disk full"):
+        export(kiara_api, tmp_path, tokens_array=pa.array(TOKENS))
+
+    assert read_dataset(tmp_path / "corpus").num_rows == 6
+    assert sorted(os.listdir(tmp_path)) == ["corpus"]
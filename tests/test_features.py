@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the hashing of terms (`hash_terms`) and `topic_modelling.hash_features`."""
+
+from collections import Counter
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+from kiara_plugin.topic_modelling.utils import hash_terms
+
+TOKENS = [
+    ["camorra", "napoli", "camorra", "città"],
+    None,
+    ["polizia", "napoli", "", "sciopero"],
+    ["città", "austria"],
+]
+
+
+def fnv1a(term: str) -> int:
+
+    value = 14695981039346656037
+    for byte in term.encode("utf-8"):
+        value = ((value ^ byte) * 1099511628211) % 2**64
+    return value
+
+
+def test_hash_terms():
+
+    # published FNV-1a (64 bit) test vectors
+    assert hash_terms(pa.array(["", "a", "foobar"])).tolist() == [
+        0xCBF29CE484222325,
+        0xAF63DC4C8601EC8C,
+        0x85944171F73967E8,
+    ]
+
+    terms = ["camorra", "città", "", "polizia", "napoletano", "ü"]
+    expected = [fnv1a(term) for term in terms]
+    assert hash_terms(pa.array(terms)).tolist() == expected
+    # the hashes don't depend on the array type, its offset or its chunks, and nulls hash like empty strings
+    assert hash_terms(pa.array(["x", *terms], type=pa.large_string()).slice(1)).tolist() == expected
+    assert hash_terms(pa.chunked_array([terms[:2], terms[2:]])).tolist() == expected
+    assert hash_terms(pa.array([None, "a"])).tolist() == [fnv1a(""), fnv1a("a")]
+    assert hash_terms(pa.array([], type=pa.string())).tolist() == []
+
+
+def featurize(kiara_api: KiaraAPI, tokens, **inputs):
+
+    result = kiara_api.run_job(
+        "topic_modelling.hash_features",
+        inputs={"tokens_array": pa.array(tokens), **inputs},
+        comment="hash features",
+    )
+    return result["feature_counts"].data.arrow_table, result["feature_lookup"].data.arrow_table
+
+
+@pytest.mark.parametrize("num_features", [3, 2**18])
+def test_hash_features(kiara_api: KiaraAPI, num_features: int):
+
+    feature_counts, feature_lookup = featurize(kiara_api, TOKENS, num_features=num_features, num_lookup_terms=3)
+
+    # with 3 features, terms collide, and the counts of the colliding terms of a document are added up
+    expected = Counter()
+    for doc_id, tokens in enumerate(TOKENS):
+        for token in tokens or []:
+            expected[(doc_id, fnv1a(token) % num_features)] += 1
+    assert feature_counts.to_pylist() == [
+        {"doc_id": doc_id, "feature": feature, "count": count} for (doc_id, feature), count in sorted(expected.items())
+    ]
+    if num_features == 3:
+        # 'napoli' and 'città' share a feature
+        assert {"doc_id": 0, "feature": 0, "count": 2} in feature_counts.to_pylist()
+
+    assert feature_lookup.to_pylist() == [
+        {"feature": fnv1a("camorra") % num_features, "term": "camorra", "count": 2},
+        {"feature": fnv1a("città") % num_features, "term": "città", "count": 2},
+        {"feature": fnv1a("napoli") % num_features, "term": "napoli", "count": 2},
+    ]
+
+
+def test_separately_featurized_batches_are_compatible(kiara_api: KiaraAPI):
+
+    feature_counts, _ = featurize(kiara_api, TOKENS, num_features=1024)
+    first, _ = featurize(kiara_api, TOKENS[:2], num_features=1024)
+    second, _ = featurize(kiara_api, TOKENS[2:], num_features=1024)
+
+    doc_ids = np.concatenate([first.column("doc_id").to_numpy(), second.column("doc_id").to_numpy() + 2])
+    assert doc_ids.tolist() == feature_counts.column("doc_id").to_pylist()
+    assert first.column("feature").to_pylist() + second.column("feature").to_pylist() == feature_counts.column(
+        "feature"
+    ).to_pylist()
+
+
+def test_invalid_number_of_features(kiara_api: KiaraAPI):
+
+    with pytest.raises(Exception, match="Invalid number of features"):
+        featurize(kiara_api, TOKENS, num_features=0)
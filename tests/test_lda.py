@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.lda`."""
+
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+from kiara_plugin.topic_modelling.modules import lda
+from kiara_plugin.topic_modelling.modules.lda import RunLda
+
+from test_lda_checkpoint import get_tokens_array
+
+
+def test_passes_match_gensim(kiara_api: KiaraAPI, tests_resources_folder: Path):
+
+    from gensim.models.ldamodel import LdaModel
+
+    tokens_array = get_tokens_array(tests_resources_folder)
+    result = kiara_api.run_job(
+        "topic_modelling.lda",
+        inputs={
+            "tokens_array": tokens_array,
+            "num_topics": 3,
+            "passes": 4,
+            "chunksize": 5,
+            "iterations": 20,
+            "random_state": 7,
+            "workers": 1,
+        },
+        comment="lda passes",
+    )
+
+    # the passes are run one by one, with the same learning rate schedule as gensim's own multi-pass training
+    id2word = RunLda.create_dictionary(tokens_array.to_pylist(), no_below=False, no_above=False)
+    corpus = [id2word.doc2bow(tokens) for tokens in tokens_array.to_pylist()]
+    expected = LdaModel(
+        corpus=corpus, id2word=id2word, num_topics=3, random_state=7, passes=4, chunksize=5, iterations=20, eval_every=None
+    )
+
+    topic_terms = result["topic_terms"].data.arrow_table
+    assert topic_terms.column("term").to_pylist() == [id2word[term_id] for term_id in range(len(id2word))]
+    topic_term = np.vstack([topic_terms.column(f"topic_{topic_id}").to_numpy() for topic_id in range(3)])
+    np.testing.assert_allclose(topic_term, expected.get_topics(), rtol=1e-5, atol=1e-7)
+
+
+def create_synthetic_tokens(num_docs: int, doc_length: int = 10, num_terms: int = 50) -> pa.Array:
+
+    rng = np.random.default_rng(5)
+    terms = np.array([f"term{i}" for i in range(num_terms)])
+    return pa.array([terms[rng.integers(num_terms, size=doc_length)].tolist() for _ in range(num_docs)])
+
+
+@pytest.mark.parametrize("calibrate", [True, False])
+def test_auto_tune(kiara_api: KiaraAPI, monkeypatch, calibrate: bool):
+
+    # 600 documents for a single worker: a chunksize of 150, and candidates of 75, 150 and 300 on a sample of all 600 documents
+    if calibrate:
+        monkeypatch.setattr(lda, "MIN_CORPUS_PER_CALIBRATION_SAMPLE", 1)
+
+    result = kiara_api.run_job(
+        "topic_modelling.lda",
+        inputs={
+            "tokens_array": create_synthetic_tokens(600),
+            "num_topics": 3,
+            "passes": 1,
+            "iterations": 5,
+            "random_state": 7,
+            "workers": 1,
+            "auto_tune": True,
+        },
+        comment="lda auto tune",
+    )
+
+    settings = result["training_settings"].data.dict_data
+    assert settings["workers"] == 1
+    if calibrate:
+        assert [c["chunksize"] for c in settings["calibration"]] == [75, 150, 300]
+        assert all(c["docs_per_second"] > 0 for c in settings["calibration"])
+        best = max(settings["calibration"], key=lambda c: c["docs_per_second"])
+        assert settings["chunksize"] == best["chunksize"]
+    else:
+        assert settings["calibration"] == []
+        assert settings["chunksize"] == 150
+
+
+def test_long_tables(kiara_api: KiaraAPI, tests_resources_folder: Path):
+
+    tokens_array = get_tokens_array(tests_resources_folder)
+    num_topics, num_words, num_top_documents = 3, 5, 4
+    result = kiara_api.run_job(
+        "topic_modelling.lda",
+        inputs={
+            "tokens_array": tokens_array,
+            "num_topics": num_topics,
+            "passes": 2,
+            "random_state": 7,
+            "workers": 1,
+            "num_words": num_words,
+            "num_top_documents": num_top_documents,
+        },
+        comment="lda long tables",
+    )
+
+    document_topics = result["document_topics"].data.arrow_table
+    assert document_topics.column_names == ["doc_id"] + [f"topic_{topic_id}" for topic_id in range(num_topics)]
+    assert document_topics.column("doc_id").to_pylist() == list(range(len(tokens_array)))
+    doc_topic = np.column_stack([document_topics.column(f"topic_{topic_id}").to_numpy() for topic_id in range(num_topics)])
+    np.testing.assert_allclose(doc_topic.sum(axis=1), 1.0, rtol=1e-5)
+
+    topic_terms = result["topic_terms"].data.arrow_table
+    terms = topic_terms.column("term").to_pylist()
+    topic_term = np.vstack([topic_terms.column(f"topic_{topic_id}").to_numpy() for topic_id in range(num_topics)])
+
+    topic_words = result["topic_words"].data.arrow_table
+    assert topic_words.schema == pa.schema(
+        [("topic_id", pa.int32()), ("rank", pa.int32()), ("term", pa.large_string()), ("weight", pa.float32())]
+    )
+    assert topic_words.column("topic_id").to_pylist() == [t for t in range(num_topics) for _ in range(num_words)]
+    assert topic_words.column("rank").to_pylist() == list(range(1, num_words + 1)) * num_topics
+    # the top words are the terms with the highest weights of each topic, in descending order
+    expected_order = np.argsort(-topic_term, axis=1, kind="stable")[:, :num_words]
+    np.testing.assert_allclose(
+        topic_words.column("weight").to_numpy(), np.take_along_axis(topic_term, expected_order, axis=1).ravel(), rtol=1e-6
+    )
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    np.testing.assert_allclose(
+        topic_term[topic_words.column("topic_id").to_numpy(), [term_ids[term] for term in topic_words.column("term").to_pylist()]],
+        topic_words.column("weight").to_numpy(),
+        rtol=1e-6,
+    )
+
+    top_documents = result["top_documents"].data.arrow_table
+    assert top_documents.schema == pa.schema(
+        [("topic_id", pa.int32()), ("rank", pa.int32()), ("doc_id", pa.int64()), ("weight", pa.float32())]
+    )
+    assert top_documents.column("rank").to_pylist() == list(range(1, num_top_documents + 1)) * num_topics
+    expected_docs = np.argsort(-doc_topic.T, axis=1, kind="stable")[:, :num_top_documents]
+    np.testing.assert_allclose(
+        top_documents.column("weight").to_numpy(), np.take_along_axis(doc_topic.T, expected_docs, axis=1).ravel(), rtol=1e-6
+    )
+    doc_ids = top_documents.column("doc_id").to_numpy()
+    np.testing.assert_allclose(
+        doc_topic[doc_ids, top_documents.column("topic_id").to_numpy()], top_documents.column("weight").to_numpy(), rtol=1e-6
+    )
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for checkpointing and resuming `topic_modelling.lda` runs."""
+
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+
+class TrainingInterrupted(Exception):
+    pass
+
+
+def get_tokens_array(tests_resources_folder: Path) -> pa.Array:
+
+    corpus_folder = tests_resources_folder / "resources" / "data" / "text_corpus" / "data"
+    tokens = []
+    for file in sorted(corpus_folder.glob("*/*.txt")):
+        text = file.read_text(encoding="utf-8").lower()
+        tokens.append([t for t in re.findall(r"[^\W\d_]+", text) if len(t) > 3])
+    return pa.array(tokens)
+
+
+def test_resume_matches_uninterrupted_run(
+    kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path, monkeypatch
+):
+
+    from gensim.models.ldamodel import LdaModel
+
+    inputs = {
+        "tokens_array": get_tokens_array(tests_resources_folder),
+        "num_topics": 3,
+        "passes": 4,
+        "chunksize": 5,
+        "iterations": 20,
+        "random_state": 7,
+        "workers": 1,
+    }
+
+    expected = kiara_api.run_job(
+        "topic_modelling.lda", inputs=inputs, comment="uninterrupted run"
+    )
+
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    original_update = LdaModel.update
+    calls = []
+
+    def interrupted_update(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) > 2:
+            raise TrainingInterrupted("killed during pass 3")
+        return original_update(self, *args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(LdaModel, "update", interrupted_update)
+        with pytest.raises(Exception, match="killed during pass 3"):
+            kiara_api.run_job(
+                "topic_modelling.lda",
+                inputs={**inputs, "checkpoint_dir": checkpoint_dir},
+                comment="interrupted run",
+            )
+
+    assert os.listdir(checkpoint_dir) == ["pass_2"]
+
+    resumed = kiara_api.run_job(
+        "topic_modelling.lda",
+        inputs={**inputs, "checkpoint_dir": checkpoint_dir, "resume": True},
+        comment="resumed run",
+    )
+
+    assert resumed["topics"].data.list_data == expected["topics"].data.list_data
+    assert sorted(os.listdir(checkpoint_dir)) == ["pass_4"]
+
+    expected_convergence = expected["convergence"].data.arrow_table
+    resumed_convergence = resumed["convergence"].data.arrow_table
+    assert resumed_convergence.column("pass").to_pylist() == [1, 2, 3, 4]
+    np.testing.assert_allclose(
+        resumed_convergence.column("per_word_bound").to_numpy(),
+        expected_convergence.column("per_word_bound").to_numpy(),
+        rtol=1e-5,
+    )
+
+    expected_topics = expected["document_topics"].data.arrow_table.to_pandas()
+    resumed_topics = resumed["document_topics"].data.arrow_table.to_pandas()
+    np.testing.assert_allclose(resumed_topics.values, expected_topics.values, rtol=1e-5)
+
+
+def test_resume_after_early_stop_does_not_train(
+    kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path, monkeypatch
+):
+
+    from gensim.models.ldamodel import LdaModel
+
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    inputs = {
+        "tokens_array": get_tokens_array(tests_resources_folder),
+        "num_topics": 3,
+        "passes": 10,
+        "chunksize": 5,
+        "iterations": 20,
+        "random_state": 7,
+        "workers": 1,
+        # every improvement is below the tolerance, so training stops after the second pass
+        "tolerance": 1.0,
+        "checkpoint_dir": checkpoint_dir,
+        "checkpoint_every": 5,
+    }
+
+    stopped = kiara_api.run_job("topic_modelling.lda", inputs=inputs, comment="early stop")
+
+    assert stopped["convergence"].data.arrow_table.column("pass").to_pylist() == [1, 2]
+    assert os.listdir(checkpoint_dir) == ["pass_2"]
+
+    def failing_update(self, *args, **kwargs):
+        raise TrainingInterrupted("trained after convergence")
+
+    with monkeypatch.context() as m:
+        m.setattr(LdaModel, "update", failing_update)
+        resumed = kiara_api.run_job(
+            "topic_modelling.lda", inputs={**inputs, "resume": True}, comment="resumed converged run"
+        )
+
+    assert resumed["topics"].data.list_data == stopped["topics"].data.list_data
+    assert resumed["convergence"].data.arrow_table.column("pass").to_pylist() == [1, 2]
+
+
+def test_invalid_checkpoint_interval(kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path):
+
+    with pytest.raises(Exception, match="Invalid checkpoint interval"):
+        kiara_api.run_job(
+            "topic_modelling.lda",
+            inputs={
+                "tokens_array": get_tokens_array(tests_resources_folder),
+                "num_topics": 3,
+                "workers": 1,
+                "checkpoint_dir": str(tmp_path / "checkpoints"),
+                "checkpoint_every": 0,
+            },
+            comment="invalid checkpoint interval",
+        )
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.corpus_profile`."""
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+
+def profile(kiara_api: KiaraAPI, tokens, **inputs):
+
+    return kiara_api.run_job(
+        "topic_modelling.corpus_profile",
+        inputs={"tokens_array": pa.array(tokens), **inputs},
+        comment="profile corpus",
+    )
+
+
+@pytest.mark.parametrize("power", [1, 2])
+def test_heaps_fit(kiara_api: KiaraAPI, power: int):
+
+    # term j first occurs at token j ^ power, all other tokens repeat the first term,
+    # so the vocabulary after n tokens grows as n ^ (1 / power)
+    num_tokens = 10_000
+    first_positions = np.arange(num_tokens) ** power
+    first_positions = first_positions[first_positions < num_tokens]
+    stream = np.zeros(num_tokens, dtype=np.int64)
+    stream[first_positions] = np.arange(len(first_positions))
+    words = [f"w{term_id}" for term_id in stream]
+    tokens = [words[start:start + 100] for start in range(0, num_tokens, 100)]
+
+    result = profile(kiara_api, tokens)
+
+    heaps_curve = result["heaps_curve"].data.arrow_table
+    points = heaps_curve.column("num_tokens").to_numpy()
+    assert points[0] == 1 and points[-1] == num_tokens
+    expected_growth = [len(set(stream[:n])) for n in points]
+    assert heaps_curve.column("vocabulary_size").to_pylist() == expected_growth
+
+    summary = result["summary"].data.dict_data
+    assert summary["num_documents"] == 100
+    assert summary["num_tokens"] == num_tokens
+    assert summary["vocabulary_size"] == len(first_positions)
+    # the least squares fit of the curve in log-log space
+    beta, log_k = np.polyfit(np.log(points), np.log(expected_growth), 1)
+    assert summary["heaps_beta"] == pytest.approx(beta)
+    assert summary["heaps_k"] == pytest.approx(np.exp(log_k))
+    assert summary["heaps_beta"] == pytest.approx(1 / power, abs=0.02)
+    assert summary["heaps_k"] == pytest.approx(1.0, abs=0.2)
+
+
+def test_zipf_table(kiara_api: KiaraAPI):
+
+    # the frequency of the term of rank r is 2520 / r, spread over 10 documents
+    frequencies = {f"t{rank}": 2520 // rank for rank in range(1, 11)}
+    words = [term for term, frequency in frequencies.items() for _ in range(frequency)]
+    rng = np.random.default_rng(0)
+    words = [words[i] for i in rng.permutation(len(words))]
+    tokens = [words[doc::10] for doc in range(10)]
+
+    result = profile(kiara_api, tokens, num_terms=5)
+
+    zipf_table = result["zipf_table"].data.arrow_table
+    assert zipf_table.column("rank").to_pylist() == [1, 2, 3, 4, 5]
+    assert zipf_table.column("term").to_pylist() == ["t1", "t2", "t3", "t4", "t5"]
+    assert zipf_table.column("frequency").to_pylist() == [2520, 1260, 840, 630, 504]
+    np.testing.assert_allclose(
+        zipf_table.column("relative_frequency").to_numpy(), np.array([2520, 1260, 840, 630, 504]) / len(words)
+    )
+    assert zipf_table.column("document_frequency").to_pylist() == [10] * 5
+
+    # the rank-frequency curve is a line with slope -1 in log-log space
+    slope, _ = np.polyfit(np.log(zipf_table.column("rank").to_numpy()), np.log(zipf_table.column("frequency").to_numpy()), 1)
+    assert slope == pytest.approx(-1.0)
+
+    summary = result["summary"].data.dict_data
+    assert summary["vocabulary_size"] == 10
+    assert summary["hapax_legomena"] == 0
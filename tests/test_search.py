@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the inverted index (`topic_modelling.create_index`, `topic_modelling.query_index`) and the similarity index
+(`topic_modelling.create_similarity_index`, `topic_modelling.query_similarity_index`)."""
+
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+TOKENS = [
+    ["pubblica", "sicurezza", "camorra", "napoli"],
+    ["sicurezza", "pubblica", "polizia"],
+    ["camorra", "polizia", "austria"],
+    None,
+    ["napoli", "pubblica", "sicurezza", "pubblica", "sicurezza"],
+    ["austria", "camorra"],
+]
+
+
+@pytest.fixture
+def index_dir(kiara_api: KiaraAPI, tmp_path: Path) -> str:
+
+    result = kiara_api.run_job(
+        "topic_modelling.create_index",
+        inputs={"tokens_array": pa.array(TOKENS), "index_dir": str(tmp_path / "index")},
+        comment="create test index",
+    )
+
+    statistics = result["index_statistics"].data.dict_data
+    assert statistics["num_documents"] == len(TOKENS)
+    assert statistics["num_tokens"] == sum(len(doc) for doc in TOKENS if doc)
+    assert statistics["num_terms"] == 6
+
+    return result["index_dir"].data
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("camorra", [0, 2, 5]),
+        ('"pubblica sicurezza"', [0, 4]),
+        ('"sicurezza pubblica polizia"', [1]),
+        ('"camorra napoli" OR "polizia austria"', [0, 2]),
+        ("camorra AND polizia", [2]),
+        ("camorra polizia", [2]),
+        ("camorra NOT austria", [0]),
+        ('NOT "pubblica sicurezza"', [1, 2, 3, 5]),
+        ("NOT camorra", [1, 3, 4]),
+        ('camorra AND ("pubblica sicurezza" OR polizia) NOT austria', [0]),
+        ("napoli AND austria", []),
+        ('"napoli camorra"', []),
+        ("brigante", []),
+        ('"pubblica brigante"', []),
+        ("NOT brigante", [0, 1, 2, 3, 4, 5]),
+        ("camorra OR brigante", [0, 2, 5]),
+    ],
+)
+def test_query(kiara_api: KiaraAPI, index_dir: str, query: str, expected):
+
+    corpus_table = pa.table({"id": [f"doc_{i}" for i in range(len(TOKENS))]})
+
+    result = kiara_api.run_job(
+        "topic_modelling.query_index",
+        inputs={"index_dir": index_dir, "corpus_table": corpus_table, "query": query},
+        comment=f"query: {query}",
+    )
+
+    assert result["doc_ids"].data.arrow_array.to_pylist() == expected
+    assert result["corpus_table"].data.arrow_table.column("id").to_pylist() == [f"doc_{i}" for i in expected]
+
+
+@pytest.mark.parametrize("query", ["", "camorra AND", "(camorra OR polizia", '""', "camorra )"])
+def test_invalid_query(kiara_api: KiaraAPI, index_dir: str, query: str):
+
+    corpus_table = pa.table({"id": [f"doc_{i}" for i in range(len(TOKENS))]})
+
+    with pytest.raises(Exception, match="query"):
+        kiara_api.run_job(
+            "topic_modelling.query_index",
+            inputs={"index_dir": index_dir, "corpus_table": corpus_table, "query": query},
+            comment="invalid query",
+        )
+
+
+def create_document_topics(num_docs: int, num_topics: int) -> pa.Table:
+
+    rng = np.random.default_rng(3)
+    weights = rng.dirichlet(np.full(num_topics, 0.3), size=num_docs)
+    columns = {"doc_id": pa.array(np.arange(num_docs, dtype=np.int64))}
+    for topic in range(num_topics):
+        columns[f"topic_{topic}"] = pa.array(weights[:, topic])
+    return pa.table(columns)
+
+
+def brute_force_neighbours(document_topics: pa.Table, query_ids, k: int, exclude_self: bool):
+
+    vectors = np.column_stack([document_topics.column(c).to_numpy() for c in document_topics.column_names[1:]])
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = []
+    for query_id in query_ids:
+        similarities = vectors @ vectors[query_id]
+        order = [doc_id for doc_id in np.argsort(-similarities, kind="stable") if not (exclude_self and doc_id == query_id)]
+        expected.append((order[:k], similarities[order[:k]]))
+    return expected
+
+
+def create_similarity_index(kiara_api: KiaraAPI, index_dir: Path, **inputs) -> str:
+
+    result = kiara_api.run_job(
+        "topic_modelling.create_similarity_index",
+        inputs={"index_dir": str(index_dir), **inputs},
+        comment="create test similarity index",
+    )
+    return result["index_dir"].data
+
+
+def query_similarity_index(kiara_api: KiaraAPI, index_dir: str, num_docs: int, **inputs) -> pa.Table:
+
+    result = kiara_api.run_job(
+        "topic_modelling.query_similarity_index",
+        inputs={"index_dir": index_dir, "corpus_table": pa.table({"id": list(range(num_docs))}), **inputs},
+        comment="query test similarity index",
+    )
+    similar_documents = result["similar_documents"].data.arrow_table
+    corpus_table = result["corpus_table"].data.arrow_table
+    assert corpus_table.column("id").to_pylist() == similar_documents.column("doc_id").to_pylist()
+    return similar_documents
+
+
+@pytest.mark.parametrize("exclude_self", [True, False])
+@pytest.mark.parametrize("block_size", [7, 64, 65536])
+def test_exact_similarity_matches_brute_force(kiara_api: KiaraAPI, tmp_path: Path, exclude_self: bool, block_size: int):
+
+    num_docs, k = 150, 5
+    query_ids = [0, 6, 7, 70, 149]
+    document_topics = create_document_topics(num_docs, num_topics=8)
+    index_dir = create_similarity_index(kiara_api, tmp_path / "index", document_topics=document_topics)
+
+    similar_documents = query_similarity_index(
+        kiara_api, index_dir, num_docs, doc_ids=query_ids, k=k, exclude_self=exclude_self, block_size=block_size
+    )
+
+    expected = brute_force_neighbours(document_topics, query_ids, k, exclude_self)
+    assert similar_documents.column("query_doc_id").to_pylist() == np.repeat(query_ids, k).tolist()
+    assert similar_documents.column("rank").to_pylist() == list(range(1, k + 1)) * len(query_ids)
+    assert similar_documents.column("doc_id").to_pylist() == [doc_id for ids, _ in expected for doc_id in ids]
+    np.testing.assert_allclose(
+        similar_documents.column("similarity").to_numpy(), np.concatenate([s for _, s in expected]), rtol=1e-5
+    )
+    if exclude_self:
+        assert query_ids[0] not in similar_documents.filter(
+            pa.compute.equal(similar_documents.column("query_doc_id"), query_ids[0])
+        ).column("doc_id").to_pylist()
+
+
+def test_approximate_similarity(kiara_api: KiaraAPI, tmp_path: Path):
+
+    num_docs, k = 150, 5
+    query_ids = [0, 70, 149]
+    document_topics = create_document_topics(num_docs, num_topics=8)
+    index_dir = create_similarity_index(
+        kiara_api, tmp_path / "index", document_topics=document_topics, lsh_tables=4, lsh_bits=4, random_state=1
+    )
+
+    similar_documents = query_similarity_index(kiara_api, index_dir, num_docs, doc_ids=query_ids, k=k, approximate=True)
+
+    # every candidate is scored exactly, and the results are ranked by similarity
+    vectors = np.column_stack([document_topics.column(c).to_numpy() for c in document_topics.column_names[1:]])
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_doc_ids = similar_documents.column("query_doc_id").to_numpy()
+    doc_ids = similar_documents.column("doc_id").to_numpy()
+    similarities = similar_documents.column("similarity").to_numpy()
+    assert len(doc_ids) > 0
+    assert not (query_doc_ids == doc_ids).any()
+    np.testing.assert_allclose(similarities, (vectors[query_doc_ids] * vectors[doc_ids]).sum(axis=1), rtol=1e-5)
+    for query_id in query_ids:
+        assert (np.diff(similarities[query_doc_ids == query_id]) <= 0).all()
+
+    # the nearest neighbour (almost) always shares a bucket with the query document
+    expected = brute_force_neighbours(document_topics, query_ids, 1, exclude_self=True)
+    found = [doc_ids[query_doc_ids == query_id][:1].tolist() for query_id in query_ids]
+    assert sum(f == e for f, (e, _) in zip(found, expected)) >= len(query_ids) - 1
+
+
+def test_tfidf_similarity(kiara_api: KiaraAPI, tmp_path: Path):
+
+    tokens = [
+        ["camorra", "napoli", "polizia"],
+        ["austria", "vienna"],
+        ["camorra", "napoli"],
+        ["camorra", "napoli", "polizia"],
+        ["vienna", "trieste"],
+    ]
+    index_dir = create_similarity_index(kiara_api, tmp_path / "index", tokens_array=pa.array(tokens))
+
+    similar_documents = query_similarity_index(kiara_api, index_dir, len(tokens), doc_ids=[0], k=4)
+
+    # the documents that share no term with the query document are tied, in any order
+    doc_ids = similar_documents.column("doc_id").to_pylist()
+    assert doc_ids[:2] == [3, 2]
+    assert sorted(doc_ids[2:]) == [1, 4]
+    similarities = similar_documents.column("similarity").to_numpy()
+    np.testing.assert_allclose(similarities[0], 1.0, rtol=1e-5)
+    assert 0 < similarities[1] < 1
+    np.testing.assert_allclose(similarities[2:], 0.0, atol=1e-6)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.segment_tokens`."""
+
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+TOKENS = [
+    [f"a{i}" for i in range(10)],
+    [f"b{i}" for i in range(3)],
+    [],
+    None,
+    [f"c{i}" for i in range(7)],
+]
+
+
+def segment(kiara_api: KiaraAPI, tokens_array, **inputs):
+
+    result = kiara_api.run_job(
+        "topic_modelling.segment_tokens",
+        inputs={"tokens_array": tokens_array, **inputs},
+        comment="segment tokens",
+    )
+    return result["tokens_array"].data.arrow_array.to_pylist(), result["segments"].data.arrow_table.to_pylist()
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_fixed_size_segments(kiara_api: KiaraAPI, chunked: bool):
+
+    tokens_array = pa.chunked_array([TOKENS[:2], TOKENS[2:]]) if chunked else pa.array(TOKENS)
+
+    segments, table = segment(kiara_api, tokens_array, segment_length=4)
+
+    assert segments == [
+        ["a0", "a1", "a2", "a3"], ["a4", "a5", "a6", "a7"], ["a8", "a9"],
+        ["b0", "b1", "b2"],
+        [],
+        None,
+        ["c0", "c1", "c2", "c3"], ["c4", "c5", "c6"],
+    ]
+    assert [(row["parent_doc_id"], row["segment_id"], row["start"], row["num_tokens"]) for row in table] == [
+        (0, 0, 0, 4), (0, 1, 4, 4), (0, 2, 8, 2),
+        (1, 0, 0, 3),
+        (2, 0, 0, 0),
+        (3, 0, 0, 0),
+        (4, 0, 0, 4), (4, 1, 4, 3),
+    ]
+
+
+def test_short_last_segment_is_merged(kiara_api: KiaraAPI):
+
+    segments, table = segment(kiara_api, pa.array(TOKENS), segment_length=4, min_segment_length=3)
+
+    # the last two tokens of the first document are merged into its second segment, the last 3 of the last document are kept
+    assert segments[:3] == [["a0", "a1", "a2", "a3"], ["a4", "a5", "a6", "a7", "a8", "a9"], ["b0", "b1", "b2"]]
+    assert segments[-2:] == [["c0", "c1", "c2", "c3"], ["c4", "c5", "c6"]]
+    assert [row["num_tokens"] for row in table] == [4, 6, 3, 0, 0, 4, 3]
+
+
+def test_sliding_windows(kiara_api: KiaraAPI):
+
+    segments, table = segment(kiara_api, pa.array(TOKENS), segment_length=4, step=3)
+
+    # windows start every 3 tokens, and the last window of a document ends at the end of the document
+    assert segments == [
+        ["a0", "a1", "a2", "a3"], ["a3", "a4", "a5", "a6"], ["a6", "a7", "a8", "a9"],
+        ["b0", "b1", "b2"],
+        [],
+        None,
+        ["c0", "c1", "c2", "c3"], ["c3", "c4", "c5", "c6"],
+    ]
+    assert [(row["parent_doc_id"], row["segment_id"], row["start"]) for row in table] == [
+        (0, 0, 0), (0, 1, 3), (0, 2, 6),
+        (1, 0, 0),
+        (2, 0, 0),
+        (3, 0, 0),
+        (4, 0, 0), (4, 1, 3),
+    ]
+
+
+def test_sliding_windows_with_partial_last_window(kiara_api: KiaraAPI):
+
+    segments, table = segment(kiara_api, pa.array([[f"a{i}" for i in range(9)]]), segment_length=4, step=2)
+
+    # the windows at 0, 2 and 4 leave one token, so the last window is moved back to end with the document
+    assert segments == [["a0", "a1", "a2", "a3"], ["a2", "a3", "a4", "a5"], ["a4", "a5", "a6", "a7"], ["a5", "a6", "a7", "a8"]]
+    assert [row["start"] for row in table] == [0, 2, 4, 5]
+
+
+def test_invalid_step(kiara_api: KiaraAPI):
+
+    with pytest.raises(Exception, match="Invalid step"):
+        segment(kiara_api, pa.array(TOKENS), segment_length=4, step=5)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for sharded pre-processing (`topic_modelling.split_corpus`, `topic_modelling.run_shards`, `topic_modelling.merge_shards`,
+and the `topic_modelling.preprocess_sharded` pipeline)."""
+
+from pathlib import Path
+
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+
+STOPWORDS = ["della", "alla", "nella", "questo", "sono"]
+
+
+def require_word_tokenizer():
+
+    import nltk
+
+    try:
+        nltk.word_tokenize("Una prova.")
+    except LookupError:
+        pytest.skip("The NLTK punkt tokenizer data is not available.")
+
+
+def get_corpus_table(tests_resources_folder: Path) -> pa.Table:
+
+    corpus_folder = tests_resources_folder / "resources" / "data" / "text_corpus" / "data"
+    files = sorted(corpus_folder.glob("*/*.txt"))
+    # interleave the publications, so shards by publication are not contiguous ranges of rows
+    files = files[::2] + files[1::2]
+    return pa.table({
+        "publication_ref": [file.parent.name for file in files],
+        "content": [file.read_text(encoding="utf-8") for file in files],
+    })
+
+
+@pytest.mark.parametrize("shard_by, num_shards", [("rows", 3), ("publication", 0)])
+def test_sharded_run_matches_unsharded_run(
+    kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path, shard_by: str, num_shards: int
+):
+
+    corpus_table = get_corpus_table(tests_resources_folder)
+    step_inputs = {"junk_patterns": [r"\d+"], "dehyphenate": True}
+
+    expected = kiara_api.run_job(
+        "topic_modelling.clean_text",
+        inputs={"corpus_array": corpus_table.column("content"), **step_inputs},
+        comment="unsharded run",
+    )
+
+    split_inputs = {"corpus_table": corpus_table, "shard_dir": str(tmp_path / "shards"), "shard_by": shard_by}
+    if num_shards:
+        split_inputs["num_shards"] = num_shards
+    split = kiara_api.run_job("topic_modelling.split_corpus", inputs=split_inputs, comment="split corpus")
+    shards = split["shards"].data.arrow_table
+    assert shards.num_rows > 1
+    assert sum(shards.column("num_rows").to_pylist()) == corpus_table.num_rows
+
+    steps = [{"operation": "topic_modelling.clean_text", "inputs": step_inputs}]
+    run = kiara_api.run_job(
+        "topic_modelling.run_shards",
+        inputs={"shard_dir": split["shard_dir"].data, "steps": steps, "workers": 2},
+        comment="run shards",
+    )
+    assert set(run["shard_report"].data.arrow_table.column("status").to_pylist()) == {"processed"}
+
+    merged = kiara_api.run_job(
+        "topic_modelling.merge_shards", inputs={"shard_dir": split["shard_dir"].data}, comment="merge shards"
+    )
+
+    assert merged["tokens_array"].data.arrow_array.to_pylist() == expected["corpus_array"].data.arrow_array.to_pylist()
+
+    # shards with a result are skipped when the run is repeated
+    rerun = kiara_api.run_job(
+        "topic_modelling.run_shards",
+        inputs={"shard_dir": split["shard_dir"].data, "steps": steps, "workers": 2},
+        comment="rerun shards",
+    )
+    assert set(rerun["shard_report"].data.arrow_table.column("status").to_pylist()) == {"skipped"}
+
+
+def test_results_of_other_steps_are_replaced(kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path):
+
+    corpus_table = get_corpus_table(tests_resources_folder)
+    split = kiara_api.run_job(
+        "topic_modelling.split_corpus",
+        inputs={"corpus_table": corpus_table, "shard_dir": str(tmp_path / "shards"), "num_shards": 3},
+        comment="split corpus",
+    )
+    shard_dir = split["shard_dir"].data
+
+    def run_shards(steps, **inputs):
+        result = kiara_api.run_job(
+            "topic_modelling.run_shards",
+            inputs={"shard_dir": shard_dir, "steps": steps, "workers": 1, **inputs},
+            comment="run shards",
+        )
+        return result["shard_report"].data.arrow_table.column("status").to_pylist()
+
+    def merge_shards():
+        result = kiara_api.run_job("topic_modelling.merge_shards", inputs={"shard_dir": shard_dir}, comment="merge shards")
+        return result["tokens_array"].data.arrow_array.to_pylist()
+
+    digits = [{"operation": "topic_modelling.clean_text", "inputs": {"junk_patterns": [r"\d+"]}}]
+    letters = [{"operation": "topic_modelling.clean_text", "inputs": {"junk_patterns": ["[aeiou]"]}}]
+
+    assert run_shards(digits) == ["processed"] * 3
+    without_digits = merge_shards()
+
+    # only the shards of this node are re-run with the other steps, the results can't be merged with the stale ones
+    assert run_shards(letters, shard_ids=[0]) == ["processed"]
+    with pytest.raises(Exception, match="different steps"):
+        merge_shards()
+
+    assert run_shards(letters) == ["skipped", "processed", "processed"]
+    without_vowels = merge_shards()
+    assert without_vowels != without_digits
+    assert not any(vowel in text for text in without_vowels for vowel in "aeiou")
+
+    assert run_shards(digits) == ["processed"] * 3
+    assert merge_shards() == without_digits
+
+
+def test_default_steps_match_unsharded_run(kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path):
+
+    require_word_tokenizer()
+
+    corpus_table = get_corpus_table(tests_resources_folder)
+
+    tokens = kiara_api.run_job(
+        "topic_modelling.tokenize_array", inputs={"corpus_array": corpus_table.column("content")}, comment="tokenize"
+    )["tokens_array"].data.arrow_array
+    tokens = kiara_api.run_job(
+        "topic_modelling.preprocess_tokens", inputs={"tokens_array": tokens}, comment="preprocess"
+    )["tokens_array"].data.arrow_array
+    expected = kiara_api.run_job(
+        "topic_modelling.remove_stopwords",
+        inputs={"tokens_array": tokens, "stopwords_list": STOPWORDS},
+        comment="remove stop words",
+    )["tokens_array"].data.arrow_array.to_pylist()
+    assert any(expected)
+
+    split = kiara_api.run_job(
+        "topic_modelling.split_corpus",
+        inputs={"corpus_table": corpus_table, "shard_dir": str(tmp_path / "shards"), "shard_by": "publication"},
+        comment="split corpus",
+    )
+    # without steps, the default steps are run, and the stop words list is added to the stop word removal
+    kiara_api.run_job(
+        "topic_modelling.run_shards",
+        inputs={"shard_dir": split["shard_dir"].data, "stopwords_list": STOPWORDS, "workers": 2},
+        comment="run shards",
+    )
+    merged = kiara_api.run_job(
+        "topic_modelling.merge_shards", inputs={"shard_dir": split["shard_dir"].data}, comment="merge shards"
+    )
+
+    assert merged["tokens_array"].data.arrow_array.to_pylist() == expected
+    vocabulary = merged["vocabulary"].data.arrow_table
+    assert not set(STOPWORDS) & set(vocabulary.column("term").to_pylist())
+    assert sum(vocabulary.column("term_frequency").to_pylist()) == sum(len(doc or []) for doc in expected)
+
+
+def test_default_steps_need_a_stopwords_list(kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path):
+
+    split = kiara_api.run_job(
+        "topic_modelling.split_corpus",
+        inputs={"corpus_table": get_corpus_table(tests_resources_folder), "shard_dir": str(tmp_path / "shards")},
+        comment="split corpus",
+    )
+
+    with pytest.raises(Exception, match="stop words list"):
+        kiara_api.run_job(
+            "topic_modelling.run_shards", inputs={"shard_dir": split["shard_dir"].data}, comment="run shards"
+        )
+
+
+def test_preprocess_sharded_pipeline(kiara_api: KiaraAPI, tests_resources_folder: Path, tmp_path: Path):
+
+    operation = kiara_api.get_operation("topic_modelling.preprocess_sharded")
+    assert {"split_corpus__corpus_table", "split_corpus__shard_dir", "create_stopwords_list__stopwords_list"} <= set(
+        operation.inputs_schema.keys()
+    )
+    assert {"merge_shards__tokens_array", "merge_shards__vocabulary", "run_shards__shard_report"} <= set(
+        operation.outputs_schema.keys()
+    )
+
+    require_word_tokenizer()
+
+    corpus_table = get_corpus_table(tests_resources_folder)
+    result = kiara_api.run_job(
+        "topic_modelling.preprocess_sharded",
+        inputs={
+            "split_corpus__corpus_table": corpus_table,
+            "split_corpus__shard_dir": str(tmp_path / "shards"),
+            "split_corpus__num_shards": 3,
+            "create_stopwords_list__stopwords_list": STOPWORDS,
+            "run_shards__workers": 2,
+        },
+        comment="sharded pre-processing pipeline",
+    )
+
+    tokens = result["merge_shards__tokens_array"].data.arrow_array.to_pylist()
+    assert len(tokens) == corpus_table.num_rows
+    assert any(tokens)
+    assert not {token for doc in tokens for token in doc or []} & set(STOPWORDS)
+    assert set(result["run_shards__shard_report"].data.arrow_table.column("status").to_pylist()) == {"processed"}
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.stopwords_list`, `topic_modelling.detect_language` and `topic_modelling.remove_stopwords`."""
+
+import math
+
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+
+
+def require_stopwords():
+
+    from nltk.corpus import stopwords
+
+    try:
+        stopwords.words("italian")
+        stopwords.words("english")
+    except LookupError:
+        pytest.skip("The NLTK stop words data is not available.")
+
+
+TOKENS = [
+    ["il", "la", "camorra", "napoli", "pagina", "il"],
+    ["il", "la", "polizia", "pagina"],
+    ["il", "camorra", "sciopero", "pagina", "la"],
+    ["il", "la", "austria", "pagina", "il", "pagina"],
+    None,
+]
+
+
+@pytest.mark.parametrize("max_corpus_stopwords, expected", [(100, ["la", "pagina", "il"]), (2, ["la", "pagina"])])
+def test_corpus_stopwords(kiara_api: KiaraAPI, max_corpus_stopwords: int, expected):
+
+    require_stopwords()
+
+    result = kiara_api.run_job(
+        "topic_modelling.stopwords_list",
+        inputs={
+            "stopwords_list": ["della"],
+            "tokens_array": pa.array(TOKENS),
+            "min_doc_frequency": 0.8,
+            "max_corpus_stopwords": max_corpus_stopwords,
+        },
+        comment="corpus stop words",
+    )
+
+    assert result["stopwords_list"].data.list_data == ["della", *expected]
+
+    statistics = {row["term"]: row for row in result["stopwords_statistics"].data.arrow_table.to_pylist()}
+    assert len(statistics) == 8
+    # the terms of (almost) every document have the lowest TF-IDF, at the same document frequency the less frequent ones first
+    assert [(term, statistics[term]["rank"], statistics[term]["term_frequency"]) for term in ["la", "pagina", "il"]] == [
+        ("la", 1, 4),
+        ("pagina", 2, 5),
+        ("il", 3, 6),
+    ]
+    assert statistics["la"]["document_frequency"] == 0.8
+    assert statistics["la"]["entropy"] == pytest.approx(math.log(4) / math.log(5))
+    assert statistics["il"]["entropy"] == pytest.approx((2 * math.log(3) / 3 + math.log(6) / 3) / math.log(5))
+    assert statistics["il"]["tfidf"] == pytest.approx(6 * math.log(5 / 4))
+
+    # a term of half the documents is neither frequent nor spread evenly enough
+    camorra = statistics["camorra"]
+    assert camorra["document_frequency"] == 0.4
+    assert camorra["entropy"] == pytest.approx(math.log(2) / math.log(5))
+    assert camorra["tfidf"] == pytest.approx(2 * math.log(5 / 2))
+    assert [term for term, row in statistics.items() if row["selected"]] == expected
+
+
+
+TEXTS = [
+    "Il governo ha approvato la legge sulla pubblica sicurezza, e il parlamento ne discute oggi.",
+    "The government passed the law on public safety, and the parliament is discussing it today.",
+    "1900 - 1901",
+    None,
+    "La polizia di Napoli ha arrestato i capi della camorra.",
+]
+
+
+def test_detect_language(kiara_api: KiaraAPI):
+
+    require_stopwords()
+
+    result = kiara_api.run_job(
+        "topic_modelling.detect_language",
+        inputs={"corpus_array": pa.array(TEXTS), "languages": ["english", "italian"]},
+        comment="detect languages",
+    )
+
+    # documents without letters get no language
+    assert result["languages"].data.arrow_array.to_pylist() == ["italian", "english", None, None, "italian"]
+    confidence = result["confidence"].data.arrow_array.to_pylist()
+    assert confidence[2] is None and confidence[3] is None
+    assert all(confidence[i] > 0.9 for i in [0, 1, 4])
+
+
+def test_remove_stopwords_by_document_language(kiara_api: KiaraAPI):
+
+    require_stopwords()
+
+    tokens = [
+        ["della", "governo", "the", "di", "legge"],
+        ["the", "government", "di", "and", "law"],
+        ["della", "the", "camorra"],
+        None,
+    ]
+    result = kiara_api.run_job(
+        "topic_modelling.remove_stopwords",
+        inputs={
+            "tokens_array": pa.array(tokens),
+            "document_languages": pa.array(["italian", "english", None, "english"]),
+            "stopwords_list": ["legge", "law"],
+        },
+        comment="remove stop words by language",
+    )
+
+    # only the stop words of the language of a document are removed from it, the custom ones from all documents,
+    # and all of them from the documents without a language
+    assert result["tokens_array"].data.arrow_array.to_pylist() == [
+        ["governo", "the"],
+        ["government", "di"],
+        ["camorra"],
+        None,
+    ]
+
+
+def test_remove_stopwords_unsupported_language(kiara_api: KiaraAPI):
+
+    require_stopwords()
+
+    with pytest.raises(Exception, match="not supported by NLTK"):
+        kiara_api.run_job(
+            "topic_modelling.remove_stopwords",
+            inputs={"tokens_array": pa.array([["della"]]), "document_languages": pa.array(["klingon"])},
+            comment="unsupported language",
+        )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `topic_modelling.topic_visualization_data`."""
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from kiara.api import KiaraAPI
+
+TERMS = ["a", "b", "c", "d"]
+PHI = np.array([[0.5, 0.3, 0.15, 0.05], [0.05, 0.15, 0.3, 0.5]])
+THETA = np.array([[0.9, 0.1], [0.2, 0.8], [0.5, 0.5]])
+# 'x' is not a term of the model, so the term proportions are 0.4, 0.1, 0.1 and 0.4
+TOKENS = [["a", "a", "a", "b"], ["c", "d", "d", "d"], ["a", "d", "x"]]
+
+
+def test_term_relevance(kiara_api: KiaraAPI):
+
+    topic_terms = pa.table({"term": TERMS, "topic_0": PHI[0], "topic_1": PHI[1]})
+    document_topics = pa.table({"doc_id": list(range(3)), "topic_0": THETA[:, 0], "topic_1": THETA[:, 1]})
+
+    result = kiara_api.run_job(
+        "topic_modelling.topic_visualization_data",
+        inputs={
+            "topic_terms": topic_terms,
+            "document_topics": document_topics,
+            "tokens_array": pa.array(TOKENS),
+            "num_terms": 4,
+            "lambda_step": 0.5,
+        },
+        comment="topic visualization data",
+    )
+
+    term_relevance = result["term_relevance"].data.arrow_table
+    assert sorted(set(term_relevance.column("lambda").to_pylist())) == [0.0, 0.5, 1.0]
+
+    term_proportion = np.array([0.4, 0.1, 0.1, 0.4])
+    expected_relevance = {
+        # lambda = 1: the weight of the term in the topic
+        1.0: np.log(PHI),
+        # lambda = 0: the lift of the term, its weight in the topic relative to its proportion in the corpus
+        0.0: np.log(PHI / term_proportion),
+    }
+    for lambda_, relevance in expected_relevance.items():
+        for topic_id in range(2):
+            rows = term_relevance.filter(
+                pa.compute.and_(
+                    pa.compute.equal(term_relevance.column("lambda"), lambda_),
+                    pa.compute.equal(term_relevance.column("topic_id"), topic_id),
+                )
+            )
+            order = np.argsort(-relevance[topic_id], kind="stable")
+            assert rows.column("rank").to_pylist() == [1, 2, 3, 4]
+            assert rows.column("term").to_pylist() == [TERMS[i] for i in order]
+            np.testing.assert_allclose(rows.column("relevance").to_numpy(), relevance[topic_id][order], rtol=1e-6)
+            np.testing.assert_allclose(rows.column("weight").to_numpy(), PHI[topic_id][order], rtol=1e-6)
+            assert rows.column("term_frequency").to_pylist() == [[4, 1, 1, 4][i] for i in order]
+
+    # the topic frequencies are the document lengths (over the terms of the model), weighted by the topics of each document
+    topic_coordinates = result["topic_coordinates"].data.arrow_table
+    np.testing.assert_allclose(topic_coordinates.column("token_count").to_numpy(), [5.4, 4.6], rtol=1e-6)
+    np.testing.assert_allclose(topic_coordinates.column("prevalence").to_numpy(), [0.54, 0.46], rtol=1e-6)
+
+    # the two topics are mirror images, so they are projected to opposite points
+    distance = result["topic_distances"].data.arrow_table.column("distance").to_pylist()
+    assert len(distance) == 1 and 0 < distance[0] < 1
+    x = topic_coordinates.column("x").to_numpy()
+    assert x[0] == pytest.approx(-x[1], abs=1e-6)
+    assert abs(x[0] - x[1]) == pytest.approx(distance[0], rel=1e-5)